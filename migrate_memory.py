@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+记忆迁移脚本
+
+用法:
+    python migrate_memory.py                 # 将旧版 *_chunk_NNN.json 分片转换为 JSONL 格式
+    python migrate_memory.py --session abc   # 只迁移指定会话
+    python migrate_memory.py --to-sqlite     # 将文件布局的全部会话导入 {memory_path}/memory.db
+"""
+
+import os
+import argparse
+
+from src.memory_chunk_manager import MemoryChunkManager
+from src.file_memory_storage import FileMemoryStorage
+from src.sqlite_memory_storage import SQLiteMemoryStorage
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="迁移记忆存储")
+    parser.add_argument("--memory-path", default="./memory", help="记忆目录")
+    parser.add_argument("--chunk-size", type=int, default=100, help="分片大小")
+    parser.add_argument("--session", default=None, help="只迁移指定会话")
+    parser.add_argument("--to-sqlite", action="store_true", help="导入到SQLite存储")
+    parser.add_argument("--replace", action="store_true", help="导入时覆盖SQLite中已存在的会话")
+    args = parser.parse_args()
+
+    chunk_manager = MemoryChunkManager(args.chunk_size)
+    file_storage = FileMemoryStorage(args.memory_path, chunk_manager)
+
+    migrated = file_storage.migrate_legacy_chunks(args.session)
+    for filename, count in migrated.items():
+        print(f"   ✅ {filename}: {count} 条消息")
+    print(f"分片迁移完成，共 {len(migrated)} 个分片，{sum(migrated.values())} 条消息")
+
+    if args.to_sqlite:
+        db_path = os.path.join(args.memory_path, "memory.db")
+        sqlite_storage = SQLiteMemoryStorage(db_path, chunk_manager)
+        imported = sqlite_storage.import_from(file_storage, replace=args.replace)
+        for session_id, count in imported.items():
+            print(f"   ✅ {session_id}: {count} 条消息")
+        print(f"SQLite导入完成: {db_path}，共 {len(imported)} 个会话")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# chunk_codec.py
+import os, json, glob, time, hashlib, threading, zlib
+from typing import Dict, Any, List, Optional
+
+# === 冷分片编码 ===
+class ChunkCodec:
+    """冷分片的二进制压缩编码
+
+    安装了 msgpack 和 zstandard 时使用 "msgpack+zstd"（zstd 字典压缩），
+    否则使用标准库的 "json+zlib"（zlib 预置字典）。文件格式：
+        MAGIC + 一行JSON头 {"codec", "dict", "count", "raw_bytes"} + 压缩数据
+    头中记录了编码方式和字典ID，读取时按头解码，与当前默认编码无关。
+    字典由已有分片的消息训练，保存在 dicts_path/{字典ID}.dict，训练后不再修改。
+    """
+
+    MAGIC = b"AWCK1\n"
+    dict_size: int = 16 * 1024
+    zlib_dict_size: int = 32 * 1024  # zlib 预置字典的上限
+    level: int = 9
+
+    def __init__(self, dicts_path: str):
+        self.dicts_path = dicts_path
+        os.makedirs(dicts_path, exist_ok=True)
+        self._dicts: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default_codec() -> str:
+        try:
+            import msgpack  # noqa: F401
+            import zstandard  # noqa: F401
+            return "msgpack+zstd"
+        except ImportError:
+            return "json+zlib"
+
+    def _dict_path(self, codec: str, dict_id: str) -> str:
+        return os.path.join(self.dicts_path, f"{codec.replace('+', '_')}_{dict_id}.dict")
+
+    def _load_dict(self, codec: str, dict_id: Optional[str]) -> Optional[bytes]:
+        if not dict_id:
+            return None
+        key = f"{codec}:{dict_id}"
+        with self._lock:
+            if key not in self._dicts:
+                with open(self._dict_path(codec, dict_id), 'rb') as f:
+                    self._dicts[key] = f.read()
+            return self._dicts[key]
+
+    def current_dict_id(self, codec: str) -> Optional[str]:
+        """当前编码最新训练的字典ID，没有时返回None"""
+        paths = glob.glob(self._dict_path(codec, "*"))
+        if not paths:
+            return None
+        latest = max(paths, key=os.path.getmtime)
+        return os.path.basename(latest)[len(codec.replace('+', '_')) + 1:-len(".dict")]
+
+    @staticmethod
+    def _pack(codec: str, messages: List[Dict[str, Any]]) -> bytes:
+        if codec == "msgpack+zstd":
+            import msgpack
+            return msgpack.packb(messages, use_bin_type=True)
+        return json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def train(self, samples: List[Dict[str, Any]], codec: Optional[str] = None) -> Optional[str]:
+        """用消息样本训练压缩字典，返回字典ID；样本不足时返回None"""
+        codec = codec or self.default_codec()
+        packed = [self._pack(codec, [message]) for message in samples]
+        if not packed:
+            return None
+        try:
+            if codec == "msgpack+zstd":
+                import zstandard
+                dictionary = zstandard.train_dictionary(self.dict_size, packed).as_bytes()
+            else:
+                # zlib 优先匹配字典末尾的内容，常见的内容放在最后
+                dictionary = b"".join(packed)[-self.zlib_dict_size:]
+        except Exception as e:
+            print(f"训练压缩字典失败: {e}")
+            return None
+        dict_id = hashlib.sha1(dictionary).hexdigest()[:12]
+        path = self._dict_path(codec, dict_id)
+        if not os.path.exists(path):
+            tmp_file = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(dictionary)
+            os.replace(tmp_file, path)
+        return dict_id
+
+    def encode(self, messages: List[Dict[str, Any]], raw_bytes: int = 0, dict_id: Optional[str] = None) -> bytes:
+        """编码一个分片的全部消息"""
+        codec = self.default_codec()
+        if dict_id is None:
+            dict_id = self.current_dict_id(codec)
+        dictionary = self._load_dict(codec, dict_id)
+        payload = self._pack(codec, messages)
+        if codec == "msgpack+zstd":
+            import zstandard
+            compressor = zstandard.ZstdCompressor(
+                level=self.level,
+                dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            )
+            data = compressor.compress(payload)
+        else:
+            compressor = zlib.compressobj(self.level, zdict=dictionary) if dictionary else zlib.compressobj(self.level)
+            data = compressor.compress(payload) + compressor.flush()
+        header = {"codec": codec, "dict": dict_id, "count": len(messages), "raw_bytes": raw_bytes, "created_at": time.time()}
+        return self.MAGIC + json.dumps(header).encode("utf-8") + b"\n" + data
+
+    @classmethod
+    def read_header(cls, path: str) -> Dict[str, Any]:
+        """只读取文件头"""
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"不是冷分片文件: {path}")
+            return json.loads(f.readline())
+
+    def decode(self, data: bytes) -> List[Dict[str, Any]]:
+        """解码冷分片文件内容"""
+        if not data.startswith(self.MAGIC):
+            raise ValueError("不是冷分片数据")
+        header_end = data.index(b"\n", len(self.MAGIC))
+        header = json.loads(data[len(self.MAGIC):header_end])
+        payload = data[header_end + 1:]
+        dictionary = self._load_dict(header["codec"], header.get("dict"))
+        if header["codec"] == "msgpack+zstd":
+            import msgpack, zstandard
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            )
+            return msgpack.unpackb(decompressor.decompress(payload), raw=False)
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        return json.loads((decompressor.decompress(payload) + decompressor.flush()).decode("utf-8"))
@@ -0,0 +1,70 @@
+# file_lock.py
+import os
+import threading
+from typing import Dict
+
+# === 跨进程文件锁 ===
+class FileLock:
+    """基于锁文件的互斥锁 - 同时互斥同进程内的线程和其他进程
+
+    POSIX 下使用 fcntl.flock，Windows 下使用 msvcrt.locking。锁不可重入。
+    用法：
+        with FileLock("/path/to/file.lock"):
+            ...
+    """
+
+    _thread_locks: Dict[str, threading.Lock] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, lock_path: str):
+        self.lock_path = os.path.abspath(lock_path)
+        self._fd = None
+        with FileLock._registry_lock:
+            self._thread_lock = FileLock._thread_locks.setdefault(self.lock_path, threading.Lock())
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """获取锁；blocking=False 时锁已被占用则立即返回False"""
+        if not self._thread_lock.acquire(blocking):
+            return False
+        try:
+            lock_dir = os.path.dirname(self.lock_path)
+            if lock_dir:
+                os.makedirs(lock_dir, exist_ok=True)
+            self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.name == "nt":
+                import msvcrt
+                msvcrt.locking(self._fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BaseException as e:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._thread_lock.release()
+            if blocking or not isinstance(e, OSError):
+                raise
+            return False
+
+    def release(self):
+        try:
+            if self._fd is not None:
+                if os.name == "nt":
+                    import msvcrt
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
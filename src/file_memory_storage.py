@@ -0,0 +1,472 @@
+# file_memory_storage.py
+import os, json, time, glob, threading
+from typing import Dict, Any, List, Optional
+from .memory_storage import MemoryStorage
+from .memory_chunk_manager import MemoryChunkManager
+from .memory_index_manager import MemoryIndexManager
+from .memory_chunk_cache import MemoryChunkCache
+from .file_lock import FileLock
+from .chunk_codec import ChunkCodec
+
+# === 文件存储后端 ===
+class FileMemoryStorage(MemoryStorage):
+    """文件存储后端 - 分片为 chunks/ 下的JSONL文件，摘要为 summaries/ 下的JSON文件，
+    会话索引为 {session}_index.json
+
+    已写满、且超过 cold_after 秒未写入也未读取的分片会被后台定时任务（每
+    cold_sweep_interval 秒）转为压缩编码的冷分片 *_chunk_NNN.msgz（见 ChunkCodec），
+    读取时按需解码，对调用方透明。cold_after 为None时不自动转换。
+    """
+
+    cold_after: Optional[float] = 24 * 3600
+    cold_sweep_interval: float = 600.0
+
+    # 按记忆目录+会话ID共享的写入状态
+    _sessions: Dict[tuple, Dict[str, Any]] = {}
+    _sessions_lock = threading.Lock()
+    _write_stats = {"commits": 0, "committed_messages": 0}
+    _cold_stats = {"archived_chunks": 0, "raw_bytes": 0, "stored_bytes": 0, "decodes": 0, "decode_time": 0.0}
+    _last_access: Dict[str, float] = {}
+    _sweep_timers: Dict[str, threading.Timer] = {}
+
+    def __init__(self, memory_path: str, chunk_manager: MemoryChunkManager):
+        super().__init__(chunk_manager)
+        self.memory_path = memory_path
+        os.makedirs(self.memory_path, exist_ok=True)
+        self.index_manager = MemoryIndexManager(memory_path)
+        self.codec = ChunkCodec(os.path.join(self.index_manager.chunks_path, "dicts"))
+        self._schedule_cold_sweep()
+
+    def _get_chunk_path(self, session_id: str, chunk_index: int) -> str:
+        return os.path.join(
+            self.index_manager.chunks_path,
+            self.chunk_manager.get_chunk_filename(session_id, chunk_index)
+        )
+
+    def _get_legacy_chunk_path(self, session_id: str, chunk_index: int) -> str:
+        return os.path.join(
+            self.index_manager.chunks_path,
+            self.chunk_manager.get_legacy_chunk_filename(session_id, chunk_index)
+        )
+
+    def _get_cold_chunk_path(self, session_id: str, chunk_index: int) -> str:
+        return os.path.join(
+            self.index_manager.chunks_path,
+            self.chunk_manager.get_cold_chunk_filename(session_id, chunk_index)
+        )
+
+    def _session_state(self, session_id: str) -> Dict[str, Any]:
+        """会话的写入状态：进程内写锁、待提交队列、已知的尾分片大小"""
+        key = self.index_manager._key(session_id)
+        with FileMemoryStorage._sessions_lock:
+            state = FileMemoryStorage._sessions.get(key)
+            if state is None:
+                state = {
+                    "write_lock": threading.Lock(),
+                    "queue_lock": threading.Lock(),
+                    "pending": [],
+                    "tail": None  # (分片路径, 本进程最后一次写入后的大小)
+                }
+                FileMemoryStorage._sessions[key] = state
+            return state
+
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """保存单条消息（只向分片追加一行）
+
+        同一会话的写入在进程内由会话锁串行化，跨进程由 locks/{session}.lock 文件锁互斥。
+        并发到达的消息组提交：拿到会话锁的线程把排队中的消息一起编号、一次写入，
+        其余线程拿到锁时发现自己的消息已提交，直接返回结果。
+        """
+        entry = {"message": message, "result": None, "error": None, "done": False}
+        state = self._session_state(session_id)
+        with state["queue_lock"]:
+            state["pending"].append(entry)
+
+        with state["write_lock"]:
+            if not entry["done"]:
+                with state["queue_lock"]:
+                    batch, state["pending"] = state["pending"], []
+                try:
+                    results = self._commit_batch(session_id, state, [item["message"] for item in batch])
+                    for item, result in zip(batch, results):
+                        item["result"] = result
+                except Exception as e:
+                    for item in batch:
+                        item["error"] = e
+                for item in batch:
+                    item["done"] = True
+
+        if entry["error"] is not None:
+            raise entry["error"]
+        return entry["result"]
+
+    def _sync_tail(self, session_id: str, state: Dict[str, Any], index_data: Dict[str, Any]) -> Dict[str, Any]:
+        """其他进程追加过消息时，从尾部分片恢复真实的消息数，返回最新的会话索引（调用方需持有会话文件锁）"""
+        total_messages = index_data["total_messages"]
+        chunk_index = self.chunk_manager.get_chunk_index(total_messages) if total_messages else 1
+        tail_file = self._get_chunk_path(session_id, chunk_index)
+        tail_size = os.path.getsize(tail_file) if os.path.exists(tail_file) else 0
+        next_file = self._get_chunk_path(session_id, chunk_index + 1)
+        if state["tail"] == (tail_file, tail_size) and not os.path.exists(next_file):
+            return index_data
+
+        while True:
+            chunk_file = self._get_chunk_path(session_id, chunk_index)
+            if not os.path.exists(chunk_file):
+                break
+            numbers = [msg.get("number", 0) for msg in self.chunk_manager.iter_messages(chunk_file)]
+            if numbers and max(numbers) > index_data["total_messages"]:
+                start, _ = self.chunk_manager.get_chunk_range(chunk_index)
+                self.index_manager.update_chunk_info(
+                    session_id, chunk_index, start, max(numbers), max(numbers) - start + 1
+                )
+            chunk_index += 1
+
+        index_data = self.index_manager.load_session_index(session_id)
+        total_messages = index_data["total_messages"]
+        if total_messages:
+            tail_file = self._get_chunk_path(session_id, self.chunk_manager.get_chunk_index(total_messages))
+            state["tail"] = (tail_file, os.path.getsize(tail_file)) if os.path.exists(tail_file) else None
+        return index_data
+
+    def _commit_batch(self, session_id: str, state: Dict[str, Any], messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """为一批消息分配编号并按分片写入（调用方需持有会话写锁）"""
+        lock_file = os.path.join(self.memory_path, "locks", f"{session_id}.lock")
+        with FileLock(lock_file):
+            # 加载会话索引
+            index_data = self._sync_tail(session_id, state, self.index_manager.load_session_index(session_id))
+
+            # 计算新消息编号
+            first_number = index_data["total_messages"] + 1
+            now = time.time()
+            saved_messages = [
+                {"number": first_number + offset, "timestamp": now, **message}
+                for offset, message in enumerate(messages)
+            ]
+            by_chunk: Dict[int, List[Dict[str, Any]]] = {}
+            for message_with_meta in saved_messages:
+                chunk_index = self.chunk_manager.get_chunk_index(message_with_meta["number"])
+                by_chunk.setdefault(chunk_index, []).append(message_with_meta)
+
+            for chunk_index, chunk_messages in by_chunk.items():
+                # 旧格式的分片先迁移再追加
+                chunk_file = self._get_chunk_path(session_id, chunk_index)
+                legacy_file = self._get_legacy_chunk_path(session_id, chunk_index)
+                if os.path.exists(legacy_file) and not os.path.exists(chunk_file):
+                    self.chunk_manager.migrate_chunk_file(legacy_file, chunk_file)
+                    MemoryChunkCache.invalidate(legacy_file)
+
+                # 添加消息
+                written_bytes = self.chunk_manager.append_messages(chunk_file, chunk_messages)
+                MemoryChunkCache.append(chunk_file, chunk_messages, written_bytes)
+
+                # 更新索引
+                start, end = self.chunk_manager.get_chunk_range(chunk_index)
+                actual_end = min(end, chunk_messages[-1]["number"])
+                self.index_manager.update_chunk_info(
+                    session_id, chunk_index, start, actual_end, actual_end - start + 1
+                )
+                state["tail"] = (chunk_file, os.path.getsize(chunk_file))
+
+        with FileMemoryStorage._sessions_lock:
+            FileMemoryStorage._write_stats["commits"] += 1
+            FileMemoryStorage._write_stats["committed_messages"] += len(saved_messages)
+        return saved_messages
+
+    def load_session_index(self, session_id: str) -> Dict[str, Any]:
+        return self.index_manager.load_session_index(session_id)
+
+    def load_chunk_messages(
+        self,
+        session_id: str,
+        chunk_index: int,
+        start_filter: Optional[int] = None,
+        end_filter: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """加载分片中的消息（优先使用解码缓存，兼容冷分片和旧版JSON分片）"""
+        chunk_file = self._get_chunk_path(session_id, chunk_index)
+        legacy_file = self._get_legacy_chunk_path(session_id, chunk_index)
+        cold_file = self._get_cold_chunk_path(session_id, chunk_index)
+        FileMemoryStorage._last_access[chunk_file] = time.time()
+
+        try:
+            for attempt in range(2):
+                if os.path.exists(chunk_file):
+                    path, reader = chunk_file, self.chunk_manager.iter_messages
+                elif os.path.exists(cold_file):
+                    path, reader = cold_file, self._read_cold_chunk
+                elif os.path.exists(legacy_file):
+                    path, reader = legacy_file, self.chunk_manager.iter_legacy_messages
+                else:
+                    return []
+
+                try:
+                    stat = os.stat(path)
+                    messages = MemoryChunkCache.get(path, session_id, stat)
+                    if messages is None:
+                        messages = list(reader(path))
+                        MemoryChunkCache.put(path, stat, messages)
+                    break
+                except FileNotFoundError:
+                    # 分片恰好被转换为冷分片（或迁移），重新选择文件
+                    if attempt:
+                        raise
+
+            # 应用范围过滤（返回副本，调用方修改不影响缓存）
+            filtered_messages = []
+            for msg in messages:
+                msg_num = msg.get("number", 0)
+                if start_filter is not None and msg_num < start_filter:
+                    continue
+                if end_filter is not None and msg_num > end_filter:
+                    continue
+                filtered_messages.append(dict(msg))
+            return filtered_messages
+
+        except Exception as e:
+            print(f"加载分片失败: {e}")
+            return []
+
+    def save_summary(self, session_id: str, chunk_index: int, summary_data: Dict[str, Any]):
+        summary_file = f"{session_id}_summary_{chunk_index:03d}.json"
+        summary_path = os.path.join(self.index_manager.summaries_path, summary_file)
+
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary_data, f, indent=2, ensure_ascii=False)
+
+        # 更新索引
+        fallback_attempts = summary_data.get("fallback_attempts", 1) if summary_data.get("fallback") else 0
+        self.index_manager.update_summary_info(session_id, chunk_index, summary_file, fallback_attempts)
+
+    def load_summary(self, session_id: str, chunk_index: int) -> Optional[Dict[str, Any]]:
+        summary_info = self.load_session_index(session_id).get("summaries", {}).get(str(chunk_index))
+        if not summary_info:
+            return None
+        summary_path = os.path.join(self.index_manager.summaries_path, summary_info["file"])
+        if not os.path.exists(summary_path):
+            return None
+        with open(summary_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_rollup(self, session_id: str, level: int, node_index: int, rollup_data: Dict[str, Any]):
+        rollup_file = f"{session_id}_rollup_L{level}_{node_index:03d}.json"
+        rollup_path = os.path.join(self.index_manager.summaries_path, rollup_file)
+
+        with open(rollup_path, 'w', encoding='utf-8') as f:
+            json.dump(rollup_data, f, indent=2, ensure_ascii=False)
+
+        self.index_manager.update_rollup_info(session_id, level, node_index, rollup_file)
+
+    def load_rollup(self, session_id: str, level: int, node_index: int) -> Optional[Dict[str, Any]]:
+        rollups = self.load_session_index(session_id).get("rollups", {})
+        rollup_info = rollups.get(str(level), {}).get(str(node_index))
+        if not rollup_info:
+            return None
+        rollup_path = os.path.join(self.index_manager.summaries_path, rollup_info["file"])
+        if not os.path.exists(rollup_path):
+            return None
+        with open(rollup_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list_sessions(self) -> List[str]:
+        # 先写回缓存中尚未落盘的新会话索引
+        self.index_manager.flush()
+        index_files = glob.glob(os.path.join(self.memory_path, "*_index.json"))
+        sessions = []
+        for file_path in index_files:
+            filename = os.path.basename(file_path)
+            session_id = filename.replace("_index.json", "")
+            sessions.append(session_id)
+        return sessions
+
+    def drop_chunk(self, session_id: str, chunk_index: int) -> int:
+        """先原子地写回带压实标记的索引，再删除分片文件；中途崩溃时重复执行即可回收残留文件"""
+        state = self._session_state(session_id)
+        with state["write_lock"], FileLock(os.path.join(self.memory_path, "locks", f"{session_id}.lock")):
+            self.index_manager.mark_chunk_compacted(session_id, chunk_index)
+            self.index_manager.flush(session_id)
+            reclaimed = 0
+            for path in (
+                self._get_chunk_path(session_id, chunk_index),
+                self._get_cold_chunk_path(session_id, chunk_index),
+                self._get_legacy_chunk_path(session_id, chunk_index)
+            ):
+                if os.path.exists(path):
+                    reclaimed += os.path.getsize(path)
+                    os.remove(path)
+                    MemoryChunkCache.invalidate(path)
+            return reclaimed
+
+    def get_session_size(self, session_id: str) -> int:
+        size = 0
+        for chunk_file in glob.glob(os.path.join(self.index_manager.chunks_path, f"{session_id}_chunk_*")):
+            try:
+                if chunk_file.endswith(".msgz"):
+                    size += ChunkCodec.read_header(chunk_file).get("raw_bytes", 0)
+                elif chunk_file.endswith((".jsonl", ".json")):
+                    size += os.path.getsize(chunk_file)
+            except (OSError, ValueError):
+                continue
+        return size
+
+    def flush(self):
+        self.index_manager.flush()
+
+    def get_stats(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        with FileMemoryStorage._sessions_lock:
+            write_stats = dict(FileMemoryStorage._write_stats)
+            cold = dict(FileMemoryStorage._cold_stats)
+        cold_stats = {
+            "archived_chunks": cold["archived_chunks"],
+            "bytes_saved": cold["raw_bytes"] - cold["stored_bytes"],
+            "decodes": cold["decodes"],
+            "avg_decode_ms": round(cold["decode_time"] / cold["decodes"] * 1000, 3) if cold["decodes"] else 0.0
+        }
+        if session_id:
+            # 会话当前的冷分片（含其他进程转换的）
+            session_cold = {"chunks": 0, "raw_bytes": 0, "stored_bytes": 0}
+            for cold_file in glob.glob(os.path.join(self.index_manager.chunks_path, f"{session_id}_chunk_*.msgz")):
+                try:
+                    header = ChunkCodec.read_header(cold_file)
+                except (OSError, ValueError):
+                    continue
+                session_cold["chunks"] += 1
+                session_cold["raw_bytes"] += header.get("raw_bytes", 0)
+                session_cold["stored_bytes"] += os.path.getsize(cold_file)
+            session_cold["bytes_saved"] = session_cold["raw_bytes"] - session_cold["stored_bytes"]
+            cold_stats["session"] = session_cold
+        return {
+            "storage": "file",
+            "chunk_cache": MemoryChunkCache.get_stats(session_id),
+            "writes": write_stats,
+            "cold_chunks": cold_stats
+        }
+
+    def _read_cold_chunk(self, cold_file: str) -> List[Dict[str, Any]]:
+        """解码冷分片并记录解码耗时"""
+        start_time = time.time()
+        with open(cold_file, 'rb') as f:
+            messages = self.codec.decode(f.read())
+        with FileMemoryStorage._sessions_lock:
+            FileMemoryStorage._cold_stats["decodes"] += 1
+            FileMemoryStorage._cold_stats["decode_time"] += time.time() - start_time
+        return messages
+
+    def _schedule_cold_sweep(self):
+        """每个记忆目录只安排一个定时转换任务"""
+        if self.cold_after is None:
+            return
+        key = os.path.abspath(self.memory_path)
+        with FileMemoryStorage._sessions_lock:
+            if key in FileMemoryStorage._sweep_timers:
+                return
+            timer = threading.Timer(self.cold_sweep_interval, self._on_cold_sweep)
+            timer.daemon = True
+            FileMemoryStorage._sweep_timers[key] = timer
+            timer.start()
+
+    def _on_cold_sweep(self):
+        try:
+            self.archive_cold_chunks()
+        except Exception as e:
+            print(f"冷分片转换失败: {e}")
+        with FileMemoryStorage._sessions_lock:
+            FileMemoryStorage._sweep_timers.pop(os.path.abspath(self.memory_path), None)
+        self._schedule_cold_sweep()
+
+    def archive_cold_chunks(self, session_id: Optional[str] = None, idle_seconds: Optional[float] = None) -> Dict[str, int]:
+        """将已写满、且 idle_seconds（默认 cold_after）内未写入和读取的分片转为冷分片
+
+        会话的最后一个分片（含当前消息数所在分片）不转换，追加写入不会碰到冷分片。
+        Returns:
+            {冷分片文件名: 节省的字节数}
+        """
+        if idle_seconds is None:
+            idle_seconds = self.cold_after if self.cold_after is not None else 24 * 3600
+        now = time.time()
+        candidates = []
+        for session in ([session_id] if session_id else self.list_sessions()):
+            index_data = self.index_manager.load_session_index(session)
+            total_messages = index_data["total_messages"]
+            if not total_messages:
+                continue
+            tail_chunk = self.chunk_manager.get_chunk_index(total_messages)
+            for chunk_key, chunk_info in index_data["chunks"].items():
+                chunk_index = int(chunk_key)
+                if chunk_index >= tail_chunk or chunk_info["count"] < self.chunk_manager.chunk_size:
+                    continue
+                chunk_file = self._get_chunk_path(session, chunk_index)
+                legacy_file = self._get_legacy_chunk_path(session, chunk_index)
+                path = chunk_file if os.path.exists(chunk_file) else legacy_file
+                if not os.path.exists(path):
+                    continue
+                last_used = max(os.path.getmtime(path), FileMemoryStorage._last_access.get(chunk_file, 0))
+                if now - last_used >= idle_seconds:
+                    candidates.append((session, chunk_index, path))
+        if not candidates:
+            return {}
+
+        codec_name = self.codec.default_codec()
+        dict_id = self.codec.current_dict_id(codec_name)
+        if dict_id is None:
+            # 首次转换时用待转换分片中的消息训练字典
+            samples = []
+            for _, _, path in candidates[:20]:
+                reader = self.chunk_manager.iter_messages if path.endswith(".jsonl") else self.chunk_manager.iter_legacy_messages
+                samples.extend(reader(path))
+            dict_id = self.codec.train(samples, codec_name)
+
+        archived = {}
+        for session, chunk_index, path in candidates:
+            cold_file = self._get_cold_chunk_path(session, chunk_index)
+            state = self._session_state(session)
+            try:
+                with state["write_lock"], FileLock(os.path.join(self.memory_path, "locks", f"{session}.lock")):
+                    if not os.path.exists(path):
+                        continue
+                    if path.endswith(".jsonl"):
+                        messages = list(self.chunk_manager.iter_messages(path))
+                    else:
+                        messages = list(self.chunk_manager.iter_legacy_messages(path))
+                    raw_bytes = os.path.getsize(path)
+                    data = self.codec.encode(messages, raw_bytes, dict_id)
+                    tmp_file = f"{cold_file}.{os.getpid()}.tmp"
+                    with open(tmp_file, 'wb') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_file, cold_file)
+                    os.remove(path)
+                    MemoryChunkCache.invalidate(path)
+                archived[os.path.basename(cold_file)] = raw_bytes - len(data)
+                with FileMemoryStorage._sessions_lock:
+                    FileMemoryStorage._cold_stats["archived_chunks"] += 1
+                    FileMemoryStorage._cold_stats["raw_bytes"] += raw_bytes
+                    FileMemoryStorage._cold_stats["stored_bytes"] += len(data)
+            except Exception as e:
+                print(f"转换冷分片失败 {path}: {e}")
+        if archived:
+            print(f"已转换 {len(archived)} 个冷分片，节省 {sum(archived.values())} 字节")
+        return archived
+
+    def migrate_legacy_chunks(self, session_id: Optional[str] = None) -> Dict[str, int]:
+        """将旧版 *_chunk_NNN.json 分片迁移为 JSONL 格式
+
+        Args:
+            session_id: 只迁移指定会话，为None时迁移全部
+        Returns:
+            {分片文件名: 迁移的消息数}
+        """
+        pattern = f"{session_id}_chunk_*.json" if session_id else "*_chunk_*.json"
+        migrated = {}
+        for legacy_file in sorted(glob.glob(os.path.join(self.index_manager.chunks_path, pattern))):
+            chunk_file = legacy_file + "l"
+            if os.path.exists(chunk_file):
+                print(f"跳过已存在JSONL分片的旧文件: {legacy_file}")
+                continue
+            try:
+                migrated[os.path.basename(chunk_file)] = self.chunk_manager.migrate_chunk_file(legacy_file, chunk_file)
+                MemoryChunkCache.invalidate(legacy_file)
+            except Exception as e:
+                print(f"迁移分片失败 {legacy_file}: {e}")
+        return migrated
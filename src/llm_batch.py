@@ -0,0 +1,327 @@
+# llm_batch.py
+import os, io, json, time, hashlib, asyncio, threading
+from typing import Dict, Any, List, Optional, Callable
+from .llm_config_manager import LLMConfigManager
+from .llm_caller import LLMCaller
+from .llm_response_cache import LLMResponseCache
+
+# === 批量调用 ===
+class LLMBatch:
+    """批量调用 - 一次提交多组消息，结果逐条落盘，中断后可续跑
+
+    每个请求用 custom_id 标识。结果到达后立即追加到 jobs_dir 下以 job_id 命名的
+    JSONL 文件；同一 job_id 重新运行时跳过已成功的请求，只重发未完成或失败的。
+    OpenAI 官方接口在 use_provider_batch=True 时走其 Batch API（异步执行，
+    最长24小时完成，适合离线任务）；其余服务商没有批量端点，改为在事件循环中
+    并发调用 LLMCaller.acall，并发数受 max_concurrency 和 LLMScheduler 共同约束。
+    同步的 run 把并发调用提交到一个常驻后台线程的事件循环，客户端池中的异步
+    客户端始终在同一个事件循环中使用，也可以在运行中的事件循环里调用；
+    异步代码中应直接 await arun，在当前事件循环中并发。
+    """
+
+    jobs_dir: str = "./cache/batch_jobs"
+    max_concurrency: int = 8
+    use_provider_batch: bool = False
+    poll_interval: float = 30.0
+
+    _lock = threading.Lock()
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _stats = {"jobs": 0, "requests": 0, "resumed": 0, "succeeded": 0, "failed": 0, "provider_batches": 0}
+
+    @classmethod
+    def configure(cls, **kwargs):
+        """修改批量调用参数，例如 configure(max_concurrency=4, use_provider_batch=True)"""
+        with cls._lock:
+            for key, value in kwargs.items():
+                if not hasattr(cls, key) or key.startswith("_"):
+                    raise ValueError(f"未知的批量调用参数: {key}")
+                setattr(cls, key, value)
+
+    @staticmethod
+    def make_job_id(requests: Dict[str, List[Dict[str, Any]]], model_name: str) -> str:
+        """根据模型和全部请求内容计算任务ID，相同输入重跑时自动续跑"""
+        config = LLMConfigManager.get_config(model_name)
+        digest = hashlib.sha256(model_name.encode("utf-8"))
+        for custom_id in sorted(requests):
+            digest.update(custom_id.encode("utf-8"))
+            digest.update(LLMResponseCache.make_key(requests[custom_id], config).encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    @classmethod
+    def _paths(cls, job_id: str):
+        base = os.path.join(cls.jobs_dir, job_id)
+        return base + ".jsonl", base + ".meta.json"
+
+    @classmethod
+    def load_results(cls, job_id: str) -> Dict[str, Dict[str, Any]]:
+        """读取任务已落盘的结果，同一请求以最后一条记录为准"""
+        results_file, _ = cls._paths(job_id)
+        results = {}
+        if not os.path.exists(results_file):
+            return results
+        with open(results_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时可能留下半行，忽略即可
+                    continue
+                results[record["custom_id"]] = record
+        return results
+
+    @classmethod
+    def _append_result(cls, job_id: str, record: Dict[str, Any]):
+        """追加一条结果记录"""
+        results_file, _ = cls._paths(job_id)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with cls._lock:
+            with open(results_file, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+            cls._stats["succeeded" if record["error"] is None else "failed"] += 1
+
+    @classmethod
+    def clear_job(cls, job_id: str):
+        """删除任务的结果和元数据文件"""
+        for path in cls._paths(job_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @classmethod
+    def _supports_provider_batch(cls, config: Dict[str, Any]) -> bool:
+        """目前只有 OpenAI 官方接口提供批量端点"""
+        return config["provider"] == "openai" and not config.get("base_url")
+
+    @classmethod
+    def _get_loop(cls) -> asyncio.AbstractEventLoop:
+        """获取常驻后台线程的事件循环，首次使用时启动"""
+        with cls._lock:
+            if cls._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-batch-loop", daemon=True).start()
+                cls._loop = loop
+            return cls._loop
+
+    @classmethod
+    def _start_job(
+        cls,
+        requests: Dict[str, List[Dict[str, Any]]],
+        model_name: str,
+        job_id: Optional[str],
+        on_result: Optional[Callable[[str, Dict[str, Any]], None]]
+    ):
+        """读取已落盘的结果，返回 (job_id, results, pending, record_result)"""
+        if job_id is None:
+            job_id = cls.make_job_id(requests, model_name)
+        os.makedirs(cls.jobs_dir, exist_ok=True)
+
+        results = {cid: rec for cid, rec in cls.load_results(job_id).items() if cid in requests}
+        done = {cid for cid, rec in results.items() if rec["error"] is None}
+        pending = {cid: msgs for cid, msgs in requests.items() if cid not in done}
+        with cls._lock:
+            cls._stats["jobs"] += 1
+            cls._stats["requests"] += len(requests)
+            cls._stats["resumed"] += len(done)
+        if done:
+            print(f"批量任务 {job_id}: 已完成 {len(done)}/{len(requests)}，继续剩余请求")
+
+        def record_result(custom_id: str, content: Optional[str], error: Optional[str]):
+            record = {
+                "custom_id": custom_id,
+                "content": content,
+                "error": error,
+                "model": model_name,
+                "finished_at": time.time()
+            }
+            cls._append_result(job_id, record)
+            results[custom_id] = record
+            if on_result:
+                on_result(custom_id, record)
+
+        return job_id, results, pending, record_result
+
+    @classmethod
+    def _finish_job(cls, job_id: str, results: Dict[str, Dict[str, Any]], keep_results: bool):
+        if not keep_results and all(rec["error"] is None for rec in results.values()):
+            cls.clear_job(job_id)
+
+    @classmethod
+    def run(
+        cls,
+        requests: Dict[str, List[Dict[str, Any]]],
+        model_name: str = "deepseek_chat",
+        job_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        use_cache: bool = False,
+        use_provider_batch: Optional[bool] = None,
+        keep_results: bool = False,
+        on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        max_concurrency: Optional[int] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """批量执行 {custom_id: messages}，返回 {custom_id: {"content", "error", ...}}
+
+        全部成功且 keep_results=False 时删除落盘文件；有失败时保留，
+        以同一 job_id 再次运行只会重发失败的请求。on_result 在每个结果落盘后
+        调用（可能来自工作线程）；max_concurrency 覆盖本次的并发上限。
+        """
+        job_id, results, pending, record_result = cls._start_job(requests, model_name, job_id, on_result)
+        if pending:
+            if use_provider_batch is None:
+                use_provider_batch = cls.use_provider_batch
+            config = LLMCaller._get_config(model_name, temperature)
+            if use_provider_batch and cls._supports_provider_batch(config):
+                cls._run_provider_batch(job_id, pending, config, record_result)
+            else:
+                future = asyncio.run_coroutine_threadsafe(cls._fan_out(
+                    pending, model_name, temperature, use_cache, record_result,
+                    max_concurrency or cls.max_concurrency
+                ), cls._get_loop())
+                future.result()
+
+        cls._finish_job(job_id, results, keep_results)
+        return results
+
+    @classmethod
+    async def arun(
+        cls,
+        requests: Dict[str, List[Dict[str, Any]]],
+        model_name: str = "deepseek_chat",
+        job_id: Optional[str] = None,
+        temperature: Optional[float] = None,
+        use_cache: bool = False,
+        use_provider_batch: Optional[bool] = None,
+        keep_results: bool = False,
+        on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        max_concurrency: Optional[int] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """run 的异步版本，在当前事件循环中并发调用，参数与返回值相同"""
+        job_id, results, pending, record_result = await asyncio.to_thread(
+            cls._start_job, requests, model_name, job_id, on_result
+        )
+        if pending:
+            if use_provider_batch is None:
+                use_provider_batch = cls.use_provider_batch
+            config = LLMCaller._get_config(model_name, temperature)
+            if use_provider_batch and cls._supports_provider_batch(config):
+                await asyncio.to_thread(cls._run_provider_batch, job_id, pending, config, record_result)
+            else:
+                await cls._fan_out(
+                    pending, model_name, temperature, use_cache, record_result,
+                    max_concurrency or cls.max_concurrency
+                )
+
+        await asyncio.to_thread(cls._finish_job, job_id, results, keep_results)
+        return results
+
+    @classmethod
+    async def _fan_out(
+        cls,
+        pending: Dict[str, List[Dict[str, Any]]],
+        model_name: str,
+        temperature: Optional[float],
+        use_cache: bool,
+        record_result: Callable[[str, Optional[str], Optional[str]], None],
+        max_concurrency: int
+    ):
+        """没有批量端点时，受限并发地逐个调用"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_one(custom_id: str, messages: List[Dict[str, Any]]):
+            async with semaphore:
+                try:
+                    # 批量中的相同提示词（如多版本生成）需要各自独立的结果，不做请求合并
+                    content = await LLMCaller.acall(
+                        messages, model_name, temperature=temperature,
+                        use_cache=use_cache, coalesce=False
+                    )
+                    await asyncio.to_thread(record_result, custom_id, content, None)
+                except Exception as e:
+                    print(f"批量请求 {custom_id} 失败: {e}")
+                    await asyncio.to_thread(record_result, custom_id, None, str(e))
+
+        await asyncio.gather(*(run_one(cid, msgs) for cid, msgs in pending.items()))
+
+    @classmethod
+    def _run_provider_batch(
+        cls,
+        job_id: str,
+        pending: Dict[str, List[Dict[str, Any]]],
+        config: Dict[str, Any],
+        record_result: Callable[[str, Optional[str], Optional[str]], None]
+    ):
+        """通过 OpenAI Batch API 提交并轮询，批次ID记录在元数据文件中，重启后继续轮询同一批次"""
+        from openai import OpenAI
+        client = OpenAI(api_key=config["api_key"])
+        _, meta_file = cls._paths(job_id)
+
+        meta = {}
+        if os.path.exists(meta_file):
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+
+        batch_id = meta.get("batch_id")
+        if batch_id is None or set(meta.get("custom_ids", [])) != set(pending):
+            lines = []
+            for custom_id, messages in pending.items():
+                lines.append(json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": config["model"],
+                        "temperature": config["temperature"],
+                        "messages": [
+                            {"role": "system" if msg["role"] == "system" else "user", "content": msg["content"]}
+                            for msg in messages
+                        ]
+                    }
+                }, ensure_ascii=False))
+            input_file = client.files.create(
+                file=(f"{job_id}.jsonl", io.BytesIO("\n".join(lines).encode("utf-8"))),
+                purpose="batch"
+            )
+            batch = client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            batch_id = batch.id
+            with open(meta_file, 'w', encoding='utf-8') as f:
+                json.dump({"batch_id": batch_id, "custom_ids": list(pending)}, f)
+            with cls._lock:
+                cls._stats["provider_batches"] += 1
+            print(f"批量任务 {job_id}: 已提交 OpenAI 批次 {batch_id}")
+
+        batch = client.batches.retrieve(batch_id)
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(cls.poll_interval)
+            batch = client.batches.retrieve(batch_id)
+
+        finished = set()
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                custom_id = item["custom_id"]
+                response = item.get("response") or {}
+                if response.get("status_code") == 200:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    record_result(custom_id, content, None)
+                else:
+                    record_result(custom_id, None, json.dumps(item.get("error") or response.get("body"), ensure_ascii=False))
+                finished.add(custom_id)
+
+        for custom_id in pending:
+            if custom_id not in finished:
+                record_result(custom_id, None, f"批次 {batch_id} 状态为 {batch.status}，未返回结果")
+        # 下次运行需要重新提交失败的请求
+        os.remove(meta_file)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取批量调用统计"""
+        with cls._lock:
+            return dict(cls._stats)
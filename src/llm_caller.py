@@ -1,6 +1,14 @@
 # llm_caller.py
-from typing import List, Dict, Any, Optional
+import asyncio
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
 from .llm_config_manager import LLMConfigManager
+from .llm_client_pool import LLMClientPool
+from .llm_scheduler import LLMScheduler
+from .llm_response_cache import LLMResponseCache
+from .llm_retry_policy import LLMRetryPolicy
+from .llm_rate_limiter import LLMRateLimiter
+from .llm_hedger import LLMHedger
+from .llm_single_flight import LLMSingleFlight
 
 class LLMCaller:
     @staticmethod
@@ -8,57 +16,201 @@ class LLMCaller:
         messages: List[Dict[str, str]],
         model_name: str = "deepseek_chat",
         memory: Optional[Any] = None,
-        temperature: Optional[float] = None
+        temperature: Optional[float] = None,
+        use_cache: bool = False,
+        use_fallback: Optional[bool] = None,
+        hedge: bool = False,
+        coalesce: bool = True
     ) -> str:
-        config = LLMConfigManager.get_config(model_name)
-        
-        if temperature is not None:
-            config["temperature"] = temperature
-            
-        # 根据provider创建对应的LLM实例
-        if config["provider"] == "openai":
-            from langchain_openai import ChatOpenAI
-            llm_params = {
-                "model": config["model"],
-                "api_key": config["api_key"],
-                "temperature": config["temperature"]
-            }
-            if config["base_url"]:
-                llm_params["base_url"] = config["base_url"]
-            llm = ChatOpenAI(**llm_params)
-        elif config["provider"] == "anthropic":
-            from langchain_anthropic import ChatAnthropic
-            llm = ChatAnthropic(
-                model=config["model"],
-                api_key=config["api_key"],
-                temperature=config["temperature"]
+        # 带记忆的对话链有副作用，不参与缓存和请求合并
+        request_key = None
+        if not memory and (use_cache or coalesce):
+            request_key = LLMResponseCache.make_key(messages, LLMCaller._get_config(model_name, temperature))
+
+        # 确定性调用可走响应缓存
+        if use_cache and request_key:
+            cached = LLMResponseCache.get(request_key)
+            if cached is not None:
+                return cached
+
+        # 按重试/熔断/故障转移策略调用
+        def run(name: str) -> str:
+            return LLMRetryPolicy.execute(
+                name,
+                lambda current: LLMCaller._invoke(messages, current, memory, temperature),
+                use_fallback if name == model_name else False
             )
-        elif config["provider"] == "google":
-            from langchain_google_genai import ChatGoogleGenerativeAI
-            llm = ChatGoogleGenerativeAI(
-                model=config["model"],
-                google_api_key=config["api_key"],
-                temperature=config["temperature"]
+
+        def execute() -> str:
+            # 对冲请求会重复发送，带记忆的对话链有副作用，不做对冲
+            if hedge and not memory:
+                content = LLMHedger.call(model_name, run)
+            else:
+                content = run(model_name)
+            if use_cache and request_key:
+                LLMResponseCache.put(request_key, model_name, content)
+            return content
+
+        # 相同的在途请求合并为一次调用
+        if coalesce and request_key:
+            return LLMSingleFlight.do(request_key, execute)
+        return execute()
+
+    @staticmethod
+    def stream(
+        messages: List[Dict[str, str]],
+        model_name: str = "deepseek_chat",
+        temperature: Optional[float] = None
+    ) -> Iterator[str]:
+        """流式调用LLM，逐段产出生成的文本"""
+        config = LLMCaller._get_config(model_name, temperature)
+        llm = LLMClientPool.get_client(config)
+        limits = LLMConfigManager.get_rate_limit(model_name)
+        reserved_tokens = LLMRateLimiter.acquire(config, limits, messages)
+
+        parts = []
+        for chunk in llm.stream(LLMCaller._to_lang_messages(messages)):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        LLMRateLimiter.release(config, limits, messages, "".join(parts), reserved_tokens)
+
+    @staticmethod
+    async def astream(
+        messages: List[Dict[str, str]],
+        model_name: str = "deepseek_chat",
+        temperature: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """stream 的异步版本，受 LLMScheduler 并发上限约束"""
+        config = LLMCaller._get_config(model_name, temperature)
+        llm = LLMClientPool.get_client(config)
+        limits = LLMConfigManager.get_rate_limit(model_name)
+
+        parts = []
+        async with LLMScheduler.slot(config["provider"], model_name):
+            reserved_tokens = await LLMRateLimiter.aacquire(config, limits, messages)
+            async for chunk in llm.astream(LLMCaller._to_lang_messages(messages)):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+        await asyncio.to_thread(LLMRateLimiter.release, config, limits, messages, "".join(parts), reserved_tokens)
+
+    @staticmethod
+    async def acall(
+        messages: List[Dict[str, str]],
+        model_name: str = "deepseek_chat",
+        memory: Optional[Any] = None,
+        temperature: Optional[float] = None,
+        use_cache: bool = False,
+        use_fallback: Optional[bool] = None,
+        hedge: bool = False,
+        coalesce: bool = True
+    ) -> str:
+        """call 的异步版本，基于 ainvoke，并受 LLMScheduler 并发上限约束"""
+        request_key = None
+        if not memory and (use_cache or coalesce):
+            request_key = LLMResponseCache.make_key(messages, LLMCaller._get_config(model_name, temperature))
+
+        if use_cache and request_key:
+            cached = await asyncio.to_thread(LLMResponseCache.get, request_key)
+            if cached is not None:
+                return cached
+
+        async def arun(name: str) -> str:
+            return await LLMRetryPolicy.aexecute(
+                name,
+                lambda current: LLMCaller._ainvoke(messages, current, memory, temperature),
+                use_fallback if name == model_name else False
             )
-        else:
-            raise ValueError(f"Unsupported provider: {config['provider']}")
-        
+
+        async def aexecute() -> str:
+            if hedge and not memory:
+                content = await LLMHedger.acall(model_name, arun)
+            else:
+                content = await arun(model_name)
+            if use_cache and request_key:
+                await asyncio.to_thread(LLMResponseCache.put, request_key, model_name, content)
+            return content
+
+        if coalesce and request_key:
+            return await LLMSingleFlight.ado(request_key, aexecute)
+        return await aexecute()
+
+    @staticmethod
+    def _invoke(
+        messages: List[Dict[str, str]],
+        model_name: str,
+        memory: Optional[Any] = None,
+        temperature: Optional[float] = None
+    ) -> str:
+        """对单个模型发起一次同步调用"""
+        config = LLMCaller._get_config(model_name, temperature)
+
+        # 从进程级客户端池获取LLM实例（复用HTTP连接）
+        llm = LLMClientPool.get_client(config)
+
+        # 按API密钥限流，排队等待额度
+        limits = LLMConfigManager.get_rate_limit(model_name)
+        reserved_tokens = LLMRateLimiter.acquire(config, limits, messages)
+
         # 如果有记忆，使用对话链
         if memory:
             from langchain.chains import ConversationChain
             chain = ConversationChain(llm=llm, memory=memory, verbose=False)
             # 将messages转换为单个输入
             user_input = messages[-1]["content"] if messages else ""
-            return chain.predict(input=user_input)
+            content = chain.predict(input=user_input)
         else:
             # 直接调用LLM
-            from langchain_core.messages import HumanMessage, SystemMessage
-            lang_messages = []
-            for msg in messages:
-                if msg["role"] == "system":
-                    lang_messages.append(SystemMessage(content=msg["content"]))
-                else:
-                    lang_messages.append(HumanMessage(content=msg["content"]))
-            
-            response = llm.invoke(lang_messages)
-            return response.content
\ No newline at end of file
+            response = llm.invoke(LLMCaller._to_lang_messages(messages))
+            content = response.content
+
+        LLMRateLimiter.release(config, limits, messages, content, reserved_tokens)
+        return content
+
+    @staticmethod
+    async def _ainvoke(
+        messages: List[Dict[str, str]],
+        model_name: str,
+        memory: Optional[Any] = None,
+        temperature: Optional[float] = None
+    ) -> str:
+        """对单个模型发起一次异步调用"""
+        config = LLMCaller._get_config(model_name, temperature)
+        llm = LLMClientPool.get_client(config)
+        limits = LLMConfigManager.get_rate_limit(model_name)
+
+        async with LLMScheduler.slot(config["provider"], model_name):
+            reserved_tokens = await LLMRateLimiter.aacquire(config, limits, messages)
+            if memory:
+                from langchain.chains import ConversationChain
+                chain = ConversationChain(llm=llm, memory=memory, verbose=False)
+                user_input = messages[-1]["content"] if messages else ""
+                content = await chain.apredict(input=user_input)
+            else:
+                response = await llm.ainvoke(LLMCaller._to_lang_messages(messages))
+                content = response.content
+
+        await asyncio.to_thread(LLMRateLimiter.release, config, limits, messages, content, reserved_tokens)
+        return content
+
+    @staticmethod
+    def _get_config(model_name: str, temperature: Optional[float] = None) -> Dict[str, Any]:
+        """获取模型配置，可覆盖温度"""
+        config = LLMConfigManager.get_config(model_name)
+
+        if temperature is not None:
+            config["temperature"] = temperature
+        return config
+
+    @staticmethod
+    def _to_lang_messages(messages: List[Dict[str, str]]) -> List[Any]:
+        """将字典消息转换为 langchain 消息对象"""
+        from langchain_core.messages import HumanMessage, SystemMessage
+        lang_messages = []
+        for msg in messages:
+            if msg["role"] == "system":
+                lang_messages.append(SystemMessage(content=msg["content"]))
+            else:
+                lang_messages.append(HumanMessage(content=msg["content"]))
+        return lang_messages
@@ -0,0 +1,126 @@
+# llm_client_pool.py
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Tuple, Optional
+
+# === LLM客户端池 ===
+class LLMClientPool:
+    """进程级LLM客户端池 - 复用已创建的模型实例及其HTTP连接
+
+    按 (provider, model, base_url, api_key, temperature) 缓存客户端，
+    超过容量时按LRU淘汰。所有访问都在同一把锁内完成，可在多线程下共享。
+    """
+
+    max_size: int = 16
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 60.0
+
+    _clients: "OrderedDict[Tuple, Any]" = OrderedDict()
+    _http_clients: Dict[Optional[str], Any] = {}
+    _lock = threading.RLock()
+    _stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(config: Dict[str, Any]) -> Tuple:
+        """生成客户端缓存键"""
+        return (
+            config["provider"],
+            config["model"],
+            config.get("base_url"),
+            config.get("api_key"),
+            config.get("temperature")
+        )
+
+    @classmethod
+    def get_client(cls, config: Dict[str, Any]) -> Any:
+        """获取（或创建）与配置对应的LLM客户端"""
+        key = cls.make_key(config)
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is not None:
+                cls._clients.move_to_end(key)
+                cls._stats["hits"] += 1
+                return client
+
+            cls._stats["misses"] += 1
+            client = cls._create_client(config)
+            cls._clients[key] = client
+            while len(cls._clients) > cls.max_size:
+                # 被淘汰的客户端不主动关闭，可能仍有线程在使用它；
+                # 底层HTTP连接池按base_url共享，不会因淘汰而泄漏
+                cls._clients.popitem(last=False)
+                cls._stats["evictions"] += 1
+            return client
+
+    @classmethod
+    def _get_http_client(cls, base_url: Optional[str]) -> Any:
+        """按base_url获取共享的keep-alive HTTP客户端（调用方需持有锁）"""
+        http_client = cls._http_clients.get(base_url)
+        if http_client is None:
+            import httpx
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=cls.max_connections,
+                    max_keepalive_connections=cls.max_keepalive_connections,
+                    keepalive_expiry=cls.keepalive_expiry
+                ),
+                timeout=httpx.Timeout(600.0, connect=10.0)
+            )
+            cls._http_clients[base_url] = http_client
+        return http_client
+
+    @classmethod
+    def _create_client(cls, config: Dict[str, Any]) -> Any:
+        """根据provider创建对应的LLM实例"""
+        if config["provider"] == "openai":
+            from langchain_openai import ChatOpenAI
+            llm_params = {
+                "model": config["model"],
+                "api_key": config["api_key"],
+                "temperature": config["temperature"],
+                "http_client": cls._get_http_client(config["base_url"])
+            }
+            if config["base_url"]:
+                llm_params["base_url"] = config["base_url"]
+            return ChatOpenAI(**llm_params)
+        elif config["provider"] == "anthropic":
+            # Anthropic/Google SDK 客户端内部自带连接池，复用实例即可复用连接
+            from langchain_anthropic import ChatAnthropic
+            return ChatAnthropic(
+                model=config["model"],
+                api_key=config["api_key"],
+                temperature=config["temperature"]
+            )
+        elif config["provider"] == "google":
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            return ChatGoogleGenerativeAI(
+                model=config["model"],
+                google_api_key=config["api_key"],
+                temperature=config["temperature"]
+            )
+        else:
+            raise ValueError(f"Unsupported provider: {config['provider']}")
+
+    @classmethod
+    def clear(cls):
+        """清空客户端池并关闭共享的HTTP连接"""
+        with cls._lock:
+            cls._clients.clear()
+            for http_client in cls._http_clients.values():
+                try:
+                    http_client.close()
+                except Exception as e:
+                    print(f"关闭HTTP客户端失败: {e}")
+            cls._http_clients.clear()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取客户端池统计信息"""
+        with cls._lock:
+            return {
+                "size": len(cls._clients),
+                "max_size": cls.max_size,
+                "http_pools": len(cls._http_clients),
+                **cls._stats
+            }
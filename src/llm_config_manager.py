@@ -1,11 +1,40 @@
 # llm_config_manager.py
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class LLMConfigManager:
+    # 故障转移链：主模型不可用时按顺序尝试的备用模型
+    FALLBACK_CHAINS: Dict[str, List[str]] = {
+        "deepseek_chat": ["dsf5", "openai_gpt4"],
+        "deepseek_reasoner": ["deepseek_chat", "dsf5"],
+        "dsf5": ["deepseek_chat", "openai_gpt4"],
+        "openai_gpt4": ["deepseek_chat"],
+        "openai_gpt35": ["deepseek_chat"],
+    }
+
+    # 客户端限流额度（按API密钥共享）：rpm=每分钟请求数，tpm=每分钟估算token数，None表示不限
+    RATE_LIMITS: Dict[str, Dict[str, Any]] = {
+        "deepseek_chat": {"rpm": 60, "tpm": 300000},
+        "deepseek_reasoner": {"rpm": 60, "tpm": 300000},
+        "dsf5": {"rpm": 30, "tpm": 200000},
+        "openai_gpt4": {"rpm": 60, "tpm": 40000},
+        "openai_gpt35": {"rpm": 60, "tpm": 90000},
+    }
+
+    # 上下文窗口预算：context_window=模型上下文长度，reserved_output=为输出预留的token数
+    CONTEXT_BUDGETS: Dict[str, Dict[str, int]] = {
+        "deepseek_chat": {"context_window": 64000, "reserved_output": 8192},
+        "deepseek_reasoner": {"context_window": 64000, "reserved_output": 16384},
+        "dsf5": {"context_window": 1000000, "reserved_output": 16384},
+        "openai_gpt4": {"context_window": 8192, "reserved_output": 2048},
+        "openai_gpt35": {"context_window": 16385, "reserved_output": 4096},
+        "anthropic_claude": {"context_window": 200000, "reserved_output": 4096},
+        "google_gemini": {"context_window": 32760, "reserved_output": 4096},
+    }
+
     @staticmethod
     def get_config(model_name: str) -> Dict[str, Any]:
         configs = {
@@ -60,3 +89,26 @@ class LLMConfigManager:
             }
         }
         return configs.get(model_name, configs["deepseek_chat"])
+
+    @staticmethod
+    def get_fallback_chain(model_name: str) -> List[str]:
+        """获取包含主模型在内的有序故障转移链，跳过未配置API密钥的备用模型"""
+        chain = [model_name]
+        for fallback in LLMConfigManager.FALLBACK_CHAINS.get(model_name, []):
+            if fallback in chain:
+                continue
+            if LLMConfigManager.get_config(fallback).get("api_key"):
+                chain.append(fallback)
+        return chain
+
+    @staticmethod
+    def get_rate_limit(model_name: str) -> Dict[str, Any]:
+        """获取模型的限流额度"""
+        return dict(LLMConfigManager.RATE_LIMITS.get(model_name, {"rpm": None, "tpm": None}))
+
+    @staticmethod
+    def get_context_budget(model_name: str) -> Dict[str, int]:
+        """获取模型的上下文窗口预算"""
+        return dict(LLMConfigManager.CONTEXT_BUDGETS.get(
+            model_name, LLMConfigManager.CONTEXT_BUDGETS["deepseek_chat"]
+        ))
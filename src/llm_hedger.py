@@ -0,0 +1,142 @@
+# llm_hedger.py
+import asyncio, threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FutureTimeout, wait
+from typing import Dict, Any, Optional, Callable, Awaitable
+from .llm_config_manager import LLMConfigManager
+from .llm_retry_policy import LLMRetryPolicy
+
+# === 对冲请求 ===
+class LLMHedger:
+    """对冲请求 - 首个请求超过近期耗时的某个百分位仍未返回时，再发一个副本
+
+    副本发往同一模型或故障转移链中的下一个模型，先成功返回的结果胜出，
+    另一个被取消（异步任务直接取消并等待其结束；同步线程中已发出的请求结果会被丢弃）。
+    """
+
+    hedge_percentile: float = 95.0
+    min_samples: int = 10
+    default_delay: float = 10.0
+    min_delay: float = 1.0
+    use_fallback_model: bool = False
+    max_workers: int = 32
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _lock = threading.Lock()
+    _stats = {"calls": 0, "fired": 0, "hedge_won": 0, "primary_won": 0}
+
+    @classmethod
+    def configure(cls, **kwargs):
+        """修改对冲参数，例如 configure(hedge_percentile=90, use_fallback_model=True)"""
+        with cls._lock:
+            for key, value in kwargs.items():
+                if not hasattr(cls, key) or key.startswith("_"):
+                    raise ValueError(f"未知的对冲参数: {key}")
+                setattr(cls, key, value)
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=cls.max_workers, thread_name_prefix="llm-hedge")
+            return cls._executor
+
+    @classmethod
+    def _count(cls, field: str):
+        with cls._lock:
+            cls._stats[field] += 1
+
+    @classmethod
+    def get_hedge_model(cls, model_name: str) -> str:
+        """确定对冲副本使用的模型"""
+        if cls.use_fallback_model:
+            chain = LLMConfigManager.get_fallback_chain(model_name)
+            if len(chain) > 1:
+                return chain[1]
+        return model_name
+
+    @classmethod
+    def get_hedge_delay(cls, model_name: str) -> float:
+        """按近期成功耗时的百分位数确定发出副本前的等待时间"""
+        delay = None
+        if LLMRetryPolicy.get_sample_count(model_name) >= cls.min_samples:
+            delay = LLMRetryPolicy.get_latency_percentile(model_name, cls.hedge_percentile)
+        if delay is None:
+            delay = cls.default_delay
+        return max(cls.min_delay, delay)
+
+    @classmethod
+    def call(cls, model_name: str, run: Callable[[str], Any]) -> Any:
+        """以对冲方式执行 run(model_name)"""
+        cls._count("calls")
+        executor = cls._get_executor()
+        primary = executor.submit(run, model_name)
+        try:
+            return primary.result(timeout=cls.get_hedge_delay(model_name))
+        except FutureTimeout:
+            pass
+
+        hedge_model = cls.get_hedge_model(model_name)
+        cls._count("fired")
+        print(f"LLM对冲请求: {model_name} 超时未返回，发出副本 -> {hedge_model}")
+        hedge = executor.submit(run, hedge_model)
+
+        pending = {primary, hedge}
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    for other in pending:
+                        other.cancel()
+                    cls._count("hedge_won" if future is hedge else "primary_won")
+                    return future.result()
+                if first_error is None:
+                    first_error = error
+        raise first_error
+
+    @classmethod
+    async def acall(cls, model_name: str, arun: Callable[[str], Awaitable[Any]]) -> Any:
+        """call 的异步版本，落败的任务会被真正取消"""
+        cls._count("calls")
+        primary = asyncio.ensure_future(arun(model_name))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=cls.get_hedge_delay(model_name))
+            if done:
+                return primary.result()
+
+            hedge_model = cls.get_hedge_model(model_name)
+            cls._count("fired")
+            print(f"LLM对冲请求: {model_name} 超时未返回，发出副本 -> {hedge_model}")
+            hedge = asyncio.ensure_future(arun(hedge_model))
+            tasks.add(hedge)
+
+            pending = set(tasks)
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        cls._count("hedge_won" if task is hedge else "primary_won")
+                        return task.result()
+                    if first_error is None:
+                        first_error = error
+            raise first_error
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                # 等落败的任务处理完取消再返回，重试策略借此释放熔断器半开状态的试探名额
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取对冲统计：触发次数及副本胜出（对冲见效）次数"""
+        with cls._lock:
+            stats = dict(cls._stats)
+        stats["fire_rate"] = stats["fired"] / stats["calls"] if stats["calls"] else 0.0
+        stats["payoff_rate"] = stats["hedge_won"] / stats["fired"] if stats["fired"] else 0.0
+        return stats
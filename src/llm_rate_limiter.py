@@ -0,0 +1,192 @@
+# llm_rate_limiter.py
+import os, json, time, hashlib, asyncio, threading
+from typing import Dict, Any, List, Optional, Tuple
+from .file_lock import FileLock
+from .token_budgeter import TokenBudgeter
+
+# === 客户端限流器 ===
+class LLMRateLimiter:
+    """按API密钥的双令牌桶限流器（请求数/分钟 + token数/分钟）
+
+    采用预约式令牌桶（GCRA）：每个调用者在文件锁内原子地预约下一个可用时刻，
+    然后睡眠到该时刻再发请求。预约顺序即放行顺序，因此多线程、多进程的
+    调用者按先来后到排队，而不是同时醒来冲击服务端。
+    状态保存在 state_dir 下以密钥哈希命名的小JSON文件中，多个worker进程共享。
+    """
+
+    state_dir: str = "./cache/rate_limits"
+    burst_seconds: float = 10.0
+    expected_output_tokens: int = 1500
+    enabled: bool = True
+
+    _lock = threading.Lock()
+    _stats = {"acquired": 0, "waited": 0, "total_wait": 0.0}
+
+    @classmethod
+    def configure(
+        cls,
+        state_dir: Optional[str] = None,
+        burst_seconds: Optional[float] = None,
+        expected_output_tokens: Optional[int] = None,
+        enabled: Optional[bool] = None
+    ):
+        """修改限流器配置"""
+        with cls._lock:
+            if state_dir is not None:
+                cls.state_dir = state_dir
+            if burst_seconds is not None:
+                cls.burst_seconds = burst_seconds
+            if expected_output_tokens is not None:
+                cls.expected_output_tokens = expected_output_tokens
+            if enabled is not None:
+                cls.enabled = enabled
+
+    @staticmethod
+    def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+        """粗略估算消息的token数（本地估算，不加载分词器）"""
+        return sum(
+            TokenBudgeter.estimate(str(msg.get("content", ""))) + TokenBudgeter.MESSAGE_OVERHEAD
+            for msg in messages
+        )
+
+    @staticmethod
+    def _bucket_id(api_key: Optional[str], base_url: Optional[str]) -> str:
+        """API密钥不以明文落盘，只用其哈希标识限流桶"""
+        raw = f"{base_url or ''}|{api_key or ''}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def _paths(cls, bucket_id: str) -> Tuple[str, str]:
+        state_file = os.path.join(cls.state_dir, f"{bucket_id}.json")
+        return state_file, state_file + ".lock"
+
+    @classmethod
+    def _update_state(cls, bucket_id: str, update) -> Any:
+        """在文件锁内读取、修改并写回限流状态"""
+        state_file, lock_file = cls._paths(bucket_id)
+        with FileLock(lock_file):
+            state = {"request_tat": 0.0, "token_tat": 0.0}
+            if os.path.exists(state_file):
+                try:
+                    with open(state_file, 'r', encoding='utf-8') as f:
+                        state.update(json.load(f))
+                except (ValueError, OSError) as e:
+                    print(f"读取限流状态失败，已重置: {e}")
+            result = update(state)
+            tmp_file = f"{state_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_file, state_file)
+            return result
+
+    @classmethod
+    def reserve(
+        cls,
+        api_key: Optional[str],
+        base_url: Optional[str],
+        rpm: Optional[int],
+        tpm: Optional[int],
+        tokens: int
+    ) -> float:
+        """预约一次调用，返回需要等待的秒数"""
+        if not cls.enabled or (not rpm and not tpm):
+            return 0.0
+
+        def update(state):
+            now = time.time()
+            start = now
+            if rpm:
+                interval = 60.0 / rpm
+                tat = max(state["request_tat"], now) + interval
+                start = max(start, tat - max(interval, cls.burst_seconds))
+                state["request_tat"] = tat
+            if tpm:
+                interval = 60.0 / tpm
+                tat = max(state["token_tat"], now) + tokens * interval
+                # 容量至少容纳本次请求，超大请求在空闲时不必等待
+                start = max(start, tat - max(cls.burst_seconds, tokens * interval))
+                state["token_tat"] = tat
+            return max(0.0, start - now)
+
+        return cls._update_state(cls._bucket_id(api_key, base_url), update)
+
+    @classmethod
+    def settle(
+        cls,
+        api_key: Optional[str],
+        base_url: Optional[str],
+        tpm: Optional[int],
+        token_delta: int
+    ):
+        """调用结束后按实际token数修正预约（token_delta = 实际 - 预估）"""
+        if not cls.enabled or not tpm or token_delta == 0:
+            return
+
+        def update(state):
+            state["token_tat"] = max(time.time(), state["token_tat"] + token_delta * 60.0 / tpm)
+
+        cls._update_state(cls._bucket_id(api_key, base_url), update)
+
+    @classmethod
+    def _record_wait(cls, wait: float):
+        with cls._lock:
+            cls._stats["acquired"] += 1
+            if wait > 0:
+                cls._stats["waited"] += 1
+                cls._stats["total_wait"] += wait
+
+    @classmethod
+    def acquire(cls, config: Dict[str, Any], limits: Dict[str, Any], messages: List[Dict[str, Any]]) -> int:
+        """阻塞直到允许发起调用，返回本次预估的token数"""
+        tokens = cls.estimate_tokens(messages) + cls.expected_output_tokens
+        try:
+            wait = cls.reserve(config.get("api_key"), config.get("base_url"), limits.get("rpm"), limits.get("tpm"), tokens)
+        except OSError as e:
+            print(f"限流状态不可用，跳过限流: {e}")
+            wait = 0.0
+        cls._record_wait(wait)
+        if wait > 0:
+            time.sleep(wait)
+        return tokens
+
+    @classmethod
+    async def aacquire(cls, config: Dict[str, Any], limits: Dict[str, Any], messages: List[Dict[str, Any]]) -> int:
+        """acquire 的异步版本"""
+        tokens = cls.estimate_tokens(messages) + cls.expected_output_tokens
+        try:
+            wait = await asyncio.to_thread(
+                cls.reserve, config.get("api_key"), config.get("base_url"),
+                limits.get("rpm"), limits.get("tpm"), tokens
+            )
+        except OSError as e:
+            print(f"限流状态不可用，跳过限流: {e}")
+            wait = 0.0
+        cls._record_wait(wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return tokens
+
+    @classmethod
+    def release(
+        cls,
+        config: Dict[str, Any],
+        limits: Dict[str, Any],
+        messages: List[Dict[str, Any]],
+        response: str,
+        reserved_tokens: int
+    ):
+        """按实际输入输出修正token预约"""
+        actual = cls.estimate_tokens(messages) + cls.estimate_tokens([{"content": response}])
+        try:
+            cls.settle(config.get("api_key"), config.get("base_url"), limits.get("tpm"), actual - reserved_tokens)
+        except OSError as e:
+            print(f"修正限流状态失败: {e}")
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取限流统计信息"""
+        with cls._lock:
+            stats = dict(cls._stats)
+        stats["avg_wait"] = stats["total_wait"] / stats["waited"] if stats["waited"] else 0.0
+        stats["enabled"] = cls.enabled
+        return stats
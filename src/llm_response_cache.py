@@ -0,0 +1,178 @@
+# llm_response_cache.py
+import os, json, time, hashlib, sqlite3, threading, zlib
+from typing import Dict, Any, List, Optional
+
+# === LLM响应缓存 ===
+class LLMResponseCache:
+    """内容寻址的LLM响应磁盘缓存
+
+    以规范化消息列表、模型和温度的哈希为键，响应文本经zlib压缩后存入SQLite。
+    支持TTL过期和按总字节数的LRU淘汰，可在多线程下共享。
+    """
+
+    cache_path: str = "./cache/llm_response_cache.db"
+    ttl: float = 7 * 24 * 3600
+    max_bytes: int = 64 * 1024 * 1024
+
+    _conn: Optional[sqlite3.Connection] = None
+    _lock = threading.Lock()
+    _stats = {"hits": 0, "misses": 0, "expired": 0, "puts": 0, "evictions": 0}
+
+    @classmethod
+    def configure(
+        cls,
+        cache_path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None
+    ):
+        """修改缓存配置，更换路径时会重新打开数据库"""
+        with cls._lock:
+            if cache_path is not None and cache_path != cls.cache_path:
+                if cls._conn is not None:
+                    cls._conn.close()
+                    cls._conn = None
+                cls.cache_path = cache_path
+            if ttl is not None:
+                cls.ttl = ttl
+            if max_bytes is not None:
+                cls.max_bytes = max_bytes
+
+    @classmethod
+    def _get_conn(cls) -> sqlite3.Connection:
+        """获取数据库连接（调用方需持有锁）"""
+        if cls._conn is None:
+            cache_dir = os.path.dirname(cls.cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            conn = sqlite3.connect(cls.cache_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response BLOB,
+                    size INTEGER,
+                    created_at REAL,
+                    last_access REAL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+            conn.commit()
+            cls._conn = conn
+        return cls._conn
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, Any]], config: Dict[str, Any]) -> str:
+        """根据规范化后的消息、模型和温度计算缓存键
+
+        只保留 role/content，去掉记忆中附带的编号、时间戳等元数据，
+        统一换行符并去掉首尾空白，保证相同提示词得到相同的键。
+        """
+        normalized = [
+            {
+                "role": msg.get("role", ""),
+                "content": str(msg.get("content", "")).replace("\r\n", "\n").strip()
+            }
+            for msg in messages
+        ]
+        payload = json.dumps({
+            "provider": config.get("provider"),
+            "model": config.get("model"),
+            "base_url": config.get("base_url"),
+            "temperature": config.get("temperature"),
+            "messages": normalized
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期返回None"""
+        now = time.time()
+        try:
+            with cls._lock:
+                conn = cls._get_conn()
+                row = conn.execute(
+                    "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    cls._stats["misses"] += 1
+                    return None
+                if now - row[1] > cls.ttl:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    cls._stats["expired"] += 1
+                    cls._stats["misses"] += 1
+                    return None
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+                cls._stats["hits"] += 1
+                return zlib.decompress(row[0]).decode("utf-8")
+        except Exception as e:
+            print(f"读取LLM缓存失败: {e}")
+            return None
+
+    @classmethod
+    def put(cls, key: str, model: str, response: str):
+        """写入缓存，并在超出容量时按最近访问时间淘汰"""
+        now = time.time()
+        data = zlib.compress(response.encode("utf-8"))
+        try:
+            with cls._lock:
+                conn = cls._get_conn()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, data, len(data), now, now)
+                )
+                cls._stats["puts"] += 1
+                cls._evict(conn, now)
+                conn.commit()
+        except Exception as e:
+            print(f"写入LLM缓存失败: {e}")
+
+    @classmethod
+    def _evict(cls, conn: sqlite3.Connection, now: float):
+        """删除过期条目，再按LRU淘汰直到总大小不超过上限（调用方需持有锁）"""
+        cursor = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - cls.ttl,))
+        cls._stats["expired"] += cursor.rowcount
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= cls.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT key, size FROM llm_cache ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= cls.max_bytes:
+                break
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+            cls._stats["evictions"] += 1
+
+    @classmethod
+    def clear(cls):
+        """清空缓存"""
+        with cls._lock:
+            conn = cls._get_conn()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取缓存统计信息（命中/未命中计数、条目数和占用字节）"""
+        with cls._lock:
+            stats = dict(cls._stats)
+            try:
+                entries, total = cls._get_conn().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+                ).fetchone()
+            except Exception as e:
+                print(f"读取LLM缓存统计失败: {e}")
+                entries, total = 0, 0
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": cls.max_bytes,
+            "ttl": cls.ttl,
+            "hit_rate": stats["hits"] / lookups if lookups else 0.0
+        })
+        return stats
@@ -0,0 +1,329 @@
+# llm_retry_policy.py
+import time, random, asyncio, threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from .llm_config_manager import LLMConfigManager
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，拒绝调用"""
+    pass
+
+
+# === 熔断器 ===
+class CircuitBreaker:
+    """单个模型的熔断器 - 连续失败达到阈值后打开，冷却后半开试探"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """判断当前是否允许发起请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            # 半开状态只放行一个试探请求
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def release_trial(self):
+        """请求未得出结果就结束（如被取消）时释放试探名额，状态保持不变"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def get_state(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "opened_at": self.opened_at
+            }
+
+
+# === 重试与故障转移策略 ===
+class LLMRetryPolicy:
+    """LLM调用的弹性层 - 指数退避重试、Retry-After、熔断和故障转移链
+
+    每个模型先按退避策略重试可恢复的错误（429/5xx/超时/连接错误），
+    仍失败或熔断打开时，按 LLMConfigManager.get_fallback_chain 依次尝试备用模型。
+    每次尝试的耗时和结果都会记录下来，用于调优。
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    max_retry_after: float = 60.0
+    failure_threshold: int = 5
+    recovery_timeout: float = 30.0
+    use_fallback: bool = True
+    metrics_window: int = 200
+
+    _breakers: Dict[str, CircuitBreaker] = {}
+    _metrics: Dict[str, deque] = {}
+    _counters: Dict[str, Dict[str, int]] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, **kwargs):
+        """修改策略参数，例如 configure(max_attempts=5, base_delay=0.5)"""
+        with cls._lock:
+            for key, value in kwargs.items():
+                if not hasattr(cls, key) or key.startswith("_"):
+                    raise ValueError(f"未知的重试策略参数: {key}")
+                setattr(cls, key, value)
+            cls._breakers = {}
+
+    @staticmethod
+    def _get_status_code(error: Exception) -> Optional[int]:
+        status = getattr(error, "status_code", None)
+        if status is None:
+            response = getattr(error, "response", None)
+            status = getattr(response, "status_code", None)
+        return status if isinstance(status, int) else None
+
+    @classmethod
+    def is_retryable(cls, error: Exception) -> bool:
+        """判断错误是否值得重试"""
+        if isinstance(error, CircuitOpenError):
+            return False
+        status = cls._get_status_code(error)
+        if status is not None:
+            return status in RETRYABLE_STATUS_CODES
+        if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+            return True
+        name = type(error).__name__
+        return any(word in name for word in ("Timeout", "Connection", "RateLimit", "Overloaded"))
+
+    @classmethod
+    def get_retry_after(cls, error: Exception) -> Optional[float]:
+        """从错误响应头中解析 Retry-After（秒数或HTTP日期）"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        value = headers.get("retry-after-ms")
+        if value:
+            try:
+                return float(value) / 1000.0
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except Exception:
+                return None
+
+    @classmethod
+    def compute_delay(cls, attempt: int, error: Exception) -> float:
+        """计算第 attempt 次失败后的等待时间（full jitter 指数退避）"""
+        retry_after = cls.get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, cls.max_retry_after)
+        return random.uniform(0, min(cls.max_delay, cls.base_delay * (2 ** (attempt - 1))))
+
+    @classmethod
+    def get_breaker(cls, model_name: str) -> CircuitBreaker:
+        with cls._lock:
+            breaker = cls._breakers.get(model_name)
+            if breaker is None:
+                breaker = CircuitBreaker(cls.failure_threshold, cls.recovery_timeout)
+                cls._breakers[model_name] = breaker
+            return breaker
+
+    @classmethod
+    def record_attempt(cls, model_name: str, latency: float, success: bool):
+        """记录单次尝试的耗时和结果"""
+        with cls._lock:
+            window = cls._metrics.setdefault(model_name, deque(maxlen=cls.metrics_window))
+            window.append((latency, success))
+            counters = cls._counters.setdefault(
+                model_name, {"attempts": 0, "successes": 0, "failures": 0, "retries": 0, "fallbacks": 0}
+            )
+            counters["attempts"] += 1
+            counters["successes" if success else "failures"] += 1
+
+    @classmethod
+    def _count(cls, model_name: str, field: str):
+        with cls._lock:
+            counters = cls._counters.setdefault(
+                model_name, {"attempts": 0, "successes": 0, "failures": 0, "retries": 0, "fallbacks": 0}
+            )
+            counters[field] += 1
+
+    @classmethod
+    def _get_chain(cls, model_name: str, use_fallback: Optional[bool]) -> List[str]:
+        if use_fallback is None:
+            use_fallback = cls.use_fallback
+        return LLMConfigManager.get_fallback_chain(model_name) if use_fallback else [model_name]
+
+    @classmethod
+    def execute(
+        cls,
+        model_name: str,
+        fn: Callable[[str], Any],
+        use_fallback: Optional[bool] = None
+    ) -> Any:
+        """按重试与故障转移策略执行 fn(model_name)"""
+        last_error: Optional[Exception] = None
+        for index, current_model in enumerate(cls._get_chain(model_name, use_fallback)):
+            if index > 0:
+                cls._count(model_name, "fallbacks")
+                print(f"LLM故障转移: {model_name} -> {current_model}")
+            breaker = cls.get_breaker(current_model)
+            for attempt in range(1, cls.max_attempts + 1):
+                if not breaker.allow_request():
+                    last_error = CircuitOpenError(f"模型 {current_model} 熔断中")
+                    break
+                started = time.perf_counter()
+                try:
+                    result = fn(current_model)
+                except Exception as e:
+                    cls.record_attempt(current_model, time.perf_counter() - started, False)
+                    last_error = e
+                    if not cls.is_retryable(e):
+                        # 请求本身有误（如400/401），服务端可达，不计入熔断
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    if attempt < cls.max_attempts:
+                        delay = cls.compute_delay(attempt, e)
+                        cls._count(current_model, "retries")
+                        print(f"LLM调用失败({current_model}, 第{attempt}次): {e}，{delay:.1f}秒后重试")
+                        time.sleep(delay)
+                    continue
+                except BaseException:
+                    # 被取消或中断：没有结果，不计入熔断，但要释放半开状态的试探名额
+                    breaker.release_trial()
+                    raise
+                cls.record_attempt(current_model, time.perf_counter() - started, True)
+                breaker.record_success()
+                return result
+        raise last_error
+
+    @classmethod
+    async def aexecute(
+        cls,
+        model_name: str,
+        afn: Callable[[str], Awaitable[Any]],
+        use_fallback: Optional[bool] = None
+    ) -> Any:
+        """execute 的异步版本"""
+        last_error: Optional[Exception] = None
+        for index, current_model in enumerate(cls._get_chain(model_name, use_fallback)):
+            if index > 0:
+                cls._count(model_name, "fallbacks")
+                print(f"LLM故障转移: {model_name} -> {current_model}")
+            breaker = cls.get_breaker(current_model)
+            for attempt in range(1, cls.max_attempts + 1):
+                if not breaker.allow_request():
+                    last_error = CircuitOpenError(f"模型 {current_model} 熔断中")
+                    break
+                started = time.perf_counter()
+                try:
+                    result = await afn(current_model)
+                except Exception as e:
+                    cls.record_attempt(current_model, time.perf_counter() - started, False)
+                    last_error = e
+                    if not cls.is_retryable(e):
+                        # 请求本身有误（如400/401），服务端可达，不计入熔断
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    if attempt < cls.max_attempts:
+                        delay = cls.compute_delay(attempt, e)
+                        cls._count(current_model, "retries")
+                        print(f"LLM调用失败({current_model}, 第{attempt}次): {e}，{delay:.1f}秒后重试")
+                        await asyncio.sleep(delay)
+                    continue
+                except BaseException:
+                    # 被取消或中断：没有结果，不计入熔断，但要释放半开状态的试探名额
+                    breaker.release_trial()
+                    raise
+                cls.record_attempt(current_model, time.perf_counter() - started, True)
+                breaker.record_success()
+                return result
+        raise last_error
+
+    @staticmethod
+    def _percentile(values: List[float], percent: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    @classmethod
+    def get_sample_count(cls, model_name: str) -> int:
+        """获取模型最近记录的尝试次数"""
+        with cls._lock:
+            return len(cls._metrics.get(model_name, ()))
+
+    @classmethod
+    def get_latency_percentile(cls, model_name: str, percent: float, success_only: bool = True) -> Optional[float]:
+        """获取模型最近尝试耗时的百分位数，无数据时返回None"""
+        with cls._lock:
+            window = list(cls._metrics.get(model_name, ()))
+        latencies = [latency for latency, ok in window if ok or not success_only]
+        if not latencies:
+            return None
+        return cls._percentile(latencies, percent)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取每个模型的尝试计数、耗时分布和熔断状态"""
+        with cls._lock:
+            metrics = {name: list(window) for name, window in cls._metrics.items()}
+            counters = {name: dict(values) for name, values in cls._counters.items()}
+            breakers = dict(cls._breakers)
+
+        stats = {}
+        for name in set(metrics) | set(counters) | set(breakers):
+            latencies = [latency for latency, _ in metrics.get(name, [])]
+            stats[name] = {
+                **counters.get(name, {}),
+                "latency_p50": cls._percentile(latencies, 50),
+                "latency_p95": cls._percentile(latencies, 95),
+                "latency_max": max(latencies) if latencies else 0.0,
+                "circuit": breakers[name].get_state() if name in breakers else None
+            }
+        return stats
@@ -0,0 +1,103 @@
+# llm_scheduler.py
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+# === 异步LLM并发调度器 ===
+class LLMScheduler:
+    """异步调用并发调度器 - 按provider和model限制同时在途的请求数
+
+    信号量按事件循环分别创建（asyncio原语不能跨事件循环共享），
+    限额与统计数据为进程级共享。
+    """
+
+    default_provider_limit: int = 16
+    default_model_limit: int = 8
+    provider_limits: Dict[str, int] = {}
+    model_limits: Dict[str, int] = {}
+
+    _loop_semaphores: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+    _stats: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def configure(
+        cls,
+        provider_limits: Optional[Dict[str, int]] = None,
+        model_limits: Optional[Dict[str, int]] = None,
+        default_provider_limit: Optional[int] = None,
+        default_model_limit: Optional[int] = None
+    ):
+        """配置并发上限（仅对之后新建的事件循环生效）"""
+        with cls._lock:
+            if provider_limits is not None:
+                cls.provider_limits = dict(provider_limits)
+            if model_limits is not None:
+                cls.model_limits = dict(model_limits)
+            if default_provider_limit is not None:
+                cls.default_provider_limit = default_provider_limit
+            if default_model_limit is not None:
+                cls.default_model_limit = default_model_limit
+            cls._loop_semaphores = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def _get_semaphore(cls, kind: str, name: str) -> asyncio.Semaphore:
+        """获取当前事件循环中对应的信号量"""
+        loop = asyncio.get_running_loop()
+        with cls._lock:
+            semaphores = cls._loop_semaphores.setdefault(loop, {})
+            key = (kind, name)
+            if key not in semaphores:
+                if kind == "provider":
+                    limit = cls.provider_limits.get(name, cls.default_provider_limit)
+                else:
+                    limit = cls.model_limits.get(name, cls.default_model_limit)
+                semaphores[key] = asyncio.Semaphore(limit)
+            return semaphores[key]
+
+    @classmethod
+    def _update_stats(cls, name: str, field: str, delta: int):
+        with cls._lock:
+            stats = cls._stats.setdefault(name, {"waiting": 0, "in_flight": 0, "completed": 0})
+            stats[field] += delta
+
+    @classmethod
+    @asynccontextmanager
+    async def slot(cls, provider: str, model_name: str):
+        """占用一个调用名额，先取provider名额再取model名额"""
+        provider_sem = cls._get_semaphore("provider", provider)
+        model_sem = cls._get_semaphore("model", model_name)
+
+        cls._update_stats(model_name, "waiting", 1)
+        try:
+            await provider_sem.acquire()
+            try:
+                await model_sem.acquire()
+            except BaseException:
+                provider_sem.release()
+                raise
+        finally:
+            cls._update_stats(model_name, "waiting", -1)
+
+        cls._update_stats(model_name, "in_flight", 1)
+        try:
+            yield
+        finally:
+            model_sem.release()
+            provider_sem.release()
+            cls._update_stats(model_name, "in_flight", -1)
+            cls._update_stats(model_name, "completed", 1)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取调度统计信息"""
+        with cls._lock:
+            return {
+                "default_provider_limit": cls.default_provider_limit,
+                "default_model_limit": cls.default_model_limit,
+                "provider_limits": dict(cls.provider_limits),
+                "model_limits": dict(cls.model_limits),
+                "models": {name: dict(stats) for name, stats in cls._stats.items()}
+            }
@@ -0,0 +1,89 @@
+# llm_single_flight.py
+import asyncio, threading, weakref
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+class _InFlightCall:
+    """一个正在进行的同步调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+# === 请求合并 ===
+class LLMSingleFlight:
+    """请求合并（single-flight）- 相同的在途调用只向服务端发送一次
+
+    以规范化消息哈希为键：第一个调用者真正发起请求，其余相同的并发调用
+    等待并共享同一个结果（或异常）。同步调用跨线程共享；异步调用在
+    同一事件循环内共享，且单个等待者被取消不会影响其他等待者。
+    """
+
+    _calls: Dict[str, _InFlightCall] = {}
+    _loop_tasks: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+    _stats = {"leaders": 0, "followers": 0}
+
+    @classmethod
+    def do(cls, key: str, fn: Callable[[], Any]) -> Any:
+        """执行 fn()，若已有相同键的调用在途则等待其结果"""
+        with cls._lock:
+            call = cls._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                cls._stats["followers"] += 1
+                leader = False
+            else:
+                call = _InFlightCall()
+                cls._calls[key] = call
+                cls._stats["leaders"] += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with cls._lock:
+                cls._calls.pop(key, None)
+            call.event.set()
+
+    @classmethod
+    async def ado(cls, key: str, afn: Callable[[], Awaitable[Any]]) -> Any:
+        """do 的异步版本"""
+        loop = asyncio.get_running_loop()
+        with cls._lock:
+            tasks = cls._loop_tasks.setdefault(loop, {})
+            task = tasks.get(key)
+            if task is not None:
+                cls._stats["followers"] += 1
+            else:
+                task = asyncio.ensure_future(afn())
+                tasks[key] = task
+                cls._stats["leaders"] += 1
+
+                def _forget(_, key=key, tasks=tasks, task=task):
+                    with cls._lock:
+                        if tasks.get(key) is task:
+                            del tasks[key]
+
+                task.add_done_callback(_forget)
+        return await asyncio.shield(task)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取合并统计：发起请求数与搭车共享结果数"""
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["in_flight"] = len(cls._calls)
+        return stats
@@ -0,0 +1,143 @@
+# memory_chunk_cache.py
+import os, threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+# === 分片解码缓存 ===
+class MemoryChunkCache:
+    """已解码分片的进程级LRU缓存
+
+    以分片文件路径为键，缓存解析后的消息列表，并记录解析时文件的
+    mtime 和大小；读取时两者任一变化即视为失效重新解析。写路径追加消息时
+    直接更新缓存，最近的分片不会因为刚写入一条消息就被重新解析。
+    总量按消息数和文件字节数两个上限约束，超出时淘汰最久未用的分片。
+    """
+
+    max_messages: int = 5000
+    max_bytes: int = 32 * 1024 * 1024
+
+    _entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    _total_messages = 0
+    _total_bytes = 0
+    _lock = threading.Lock()
+    _stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+    _session_stats: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def configure(cls, max_messages: Optional[int] = None, max_bytes: Optional[int] = None):
+        """修改缓存上限，缩小时立即淘汰"""
+        with cls._lock:
+            if max_messages is not None:
+                cls.max_messages = max_messages
+            if max_bytes is not None:
+                cls.max_bytes = max_bytes
+            cls._evict()
+
+    @staticmethod
+    def _signature(stat: os.stat_result) -> tuple:
+        return (stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def _count(cls, session_id: str, field: str):
+        cls._stats[field] += 1
+        session = cls._session_stats.setdefault(session_id, {"hits": 0, "misses": 0})
+        session[field] += 1
+
+    @classmethod
+    def _remove(cls, path: str):
+        """移除一个条目（调用方需持有锁）"""
+        entry = cls._entries.pop(path, None)
+        if entry is not None:
+            cls._total_messages -= len(entry["messages"])
+            cls._total_bytes -= entry["signature"][1]
+
+    @classmethod
+    def _evict(cls):
+        """按LRU淘汰到上限以内（调用方需持有锁）"""
+        while cls._entries and (cls._total_messages > cls.max_messages or cls._total_bytes > cls.max_bytes):
+            path = next(iter(cls._entries))
+            cls._remove(path)
+            cls._stats["evictions"] += 1
+
+    @classmethod
+    def get(cls, path: str, session_id: str, stat: os.stat_result) -> Optional[List[Dict[str, Any]]]:
+        """获取缓存的消息列表，文件已变化或未缓存时返回None"""
+        with cls._lock:
+            entry = cls._entries.get(path)
+            if entry is not None and entry["signature"] != cls._signature(stat):
+                cls._remove(path)
+                cls._stats["invalidations"] += 1
+                entry = None
+            if entry is None:
+                cls._count(session_id, "misses")
+                return None
+            cls._entries.move_to_end(path)
+            cls._count(session_id, "hits")
+            return entry["messages"]
+
+    @classmethod
+    def put(cls, path: str, stat: os.stat_result, messages: List[Dict[str, Any]]):
+        """缓存解析结果，stat 应在解析前获取"""
+        with cls._lock:
+            cls._remove(path)
+            cls._entries[path] = {"signature": cls._signature(stat), "messages": messages}
+            cls._total_messages += len(messages)
+            cls._total_bytes += stat.st_size
+            cls._evict()
+
+    @classmethod
+    def append(cls, path: str, messages: List[Dict[str, Any]], written_bytes: int):
+        """写路径追加消息（一次写入的一批）后同步更新缓存
+
+        只有缓存内容恰好对应追加前的文件时才就地追加，否则直接失效。
+        """
+        with cls._lock:
+            entry = cls._entries.get(path)
+            if entry is None:
+                return
+            try:
+                stat = os.stat(path)
+            except OSError:
+                cls._remove(path)
+                return
+            if entry["signature"][1] + written_bytes != stat.st_size:
+                cls._remove(path)
+                cls._stats["invalidations"] += 1
+                return
+            entry["messages"].extend(messages)
+            entry["signature"] = cls._signature(stat)
+            cls._total_messages += len(messages)
+            cls._total_bytes += written_bytes
+            cls._entries.move_to_end(path)
+            cls._evict()
+
+    @classmethod
+    def invalidate(cls, path: str):
+        """使某个分片的缓存失效"""
+        with cls._lock:
+            cls._remove(path)
+
+    @classmethod
+    def clear(cls):
+        """清空缓存"""
+        with cls._lock:
+            cls._entries.clear()
+            cls._total_messages = 0
+            cls._total_bytes = 0
+
+    @classmethod
+    def get_stats(cls, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """获取缓存统计，指定会话时附带该会话的命中情况"""
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["cached_chunks"] = len(cls._entries)
+            stats["cached_messages"] = cls._total_messages
+            stats["cached_bytes"] = cls._total_bytes
+            session = dict(cls._session_stats.get(session_id, {"hits": 0, "misses": 0})) if session_id else None
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        if session is not None:
+            lookups = session["hits"] + session["misses"]
+            session["hit_rate"] = session["hits"] / lookups if lookups else 0.0
+            stats["session"] = session
+        return stats
@@ -1,30 +1,97 @@
 # memory_chunk_manager.py
-import os
-from typing import List
+import os, json
+from typing import List, Dict, Any, Iterator
 
 # === 记忆分片存储管理器 ===
 class MemoryChunkManager:
-    """分片存储管理器 - 处理消息的分片存储和索引"""
-    
-    def __init__(self, chunk_size: int = 100):
+    """分片存储管理器 - 处理消息的分片存储和索引
+
+    分片文件为追加写的 JSONL 格式（每行一条消息），保存消息只追加一行，
+    不再读取和重写整个分片。旧版的整文件 JSON 分片（*_chunk_NNN.json）
+    仍可读取，并可通过 migrate_chunk_file 转换。
+    """
+
+    def __init__(self, chunk_size: int = 100, fsync: bool = False):
         self.chunk_size = chunk_size
-    
+        # 为True时每次追加后fsync，断电也不丢消息；默认只flush到操作系统
+        self.fsync = fsync
+
     def get_chunk_index(self, message_number: int) -> int:
         """获取消息所属的分片索引"""
         return (message_number - 1) // self.chunk_size + 1
-    
+
     def get_chunk_range(self, chunk_index: int) -> tuple:
         """获取分片的消息范围 (start, end)"""
         start = (chunk_index - 1) * self.chunk_size + 1
         end = chunk_index * self.chunk_size
         return start, end
-    
+
     def get_chunk_filename(self, session_id: str, chunk_index: int) -> str:
         """生成分片文件名"""
+        return f"{session_id}_chunk_{chunk_index:03d}.jsonl"
+
+    def get_legacy_chunk_filename(self, session_id: str, chunk_index: int) -> str:
+        """旧版整文件JSON分片的文件名"""
         return f"{session_id}_chunk_{chunk_index:03d}.json"
-    
+
+    def get_cold_chunk_filename(self, session_id: str, chunk_index: int) -> str:
+        """压缩后的冷分片文件名"""
+        return f"{session_id}_chunk_{chunk_index:03d}.msgz"
+
     def calculate_required_chunks(self, start_msg: int, end_msg: int) -> List[int]:
         """计算需要读取的分片索引列表"""
         start_chunk = self.get_chunk_index(start_msg)
         end_chunk = self.get_chunk_index(end_msg)
-        return list(range(start_chunk, end_chunk + 1))
\ No newline at end of file
+        return list(range(start_chunk, end_chunk + 1))
+
+    def append_message(self, chunk_file: str, message: Dict[str, Any]) -> int:
+        """向分片追加一条消息，返回写入的字节数"""
+        return self.append_messages(chunk_file, [message])
+
+    def append_messages(self, chunk_file: str, messages: List[Dict[str, Any]]) -> int:
+        """向分片一次性追加多条消息（一次写入、至多一次fsync），返回写入的字节数"""
+        line = "".join(json.dumps(message, ensure_ascii=False) + "\n" for message in messages).encode("utf-8")
+        with open(chunk_file, 'ab+') as f:
+            # 上次写入中途崩溃会留下不完整的行，先换行隔开，避免新消息被一起损坏
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        return len(line)
+
+    def iter_messages(self, chunk_file: str) -> Iterator[Dict[str, Any]]:
+        """逐行读取分片中的消息，跳过损坏的行"""
+        with open(chunk_file, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    print(f"跳过损坏的分片行: {chunk_file}:{line_number}")
+
+    def iter_legacy_messages(self, legacy_file: str) -> Iterator[Dict[str, Any]]:
+        """读取旧版整文件JSON分片中的消息"""
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            chunk_data = json.load(f)
+        yield from chunk_data.get("messages", [])
+
+    def migrate_chunk_file(self, legacy_file: str, chunk_file: str) -> int:
+        """将旧版JSON分片转换为JSONL分片，返回迁移的消息数
+
+        先写临时文件再原子替换，转换成功后删除旧文件。
+        """
+        messages = list(self.iter_legacy_messages(legacy_file))
+        tmp_file = chunk_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for message in messages:
+                f.write(json.dumps(message, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, chunk_file)
+        os.remove(legacy_file)
+        return len(messages)
@@ -0,0 +1,218 @@
+# memory_compactor.py
+import os, json, time, threading
+from typing import Dict, Any, List, Optional
+
+# === 记忆压实 ===
+class MemoryCompactor:
+    """记忆压实 - 按保留策略删除已有摘要分片的原始消息，只保留摘要
+
+    保留策略（满足任一条件的分片被压实）：
+        keep_recent_messages: 只保留最近N条原始消息
+        max_age_seconds: 分片最后写入时间早于该秒数
+        max_bytes: 会话原始消息超过该字节数时，从最早的分片开始压实
+    只处理已写满、不是最后一个分片、且摘要覆盖全部消息的分片；没有最新摘要
+    或只有降级摘要（LLM压缩失败时生成）的分片跳过（可先批量压缩）。
+    后台任务每 interval 秒运行一次，每次至多处理 max_chunks_per_run 个分片，
+    最近一次报告写入 {memory_path}/compaction_report.json。
+    每个记忆目录共享一个实例（for_manager）。
+    """
+
+    POLICY_KEYS = ("keep_recent_messages", "max_age_seconds", "max_bytes")
+
+    interval: float = 3600.0
+    max_chunks_per_run: int = 20
+
+    _registry: Dict[str, "MemoryCompactor"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, manager, report_path: str):
+        self.manager = manager
+        self.report_path = report_path
+        self.policy: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._stats = {"runs": 0, "compacted_chunks": 0, "reclaimed_bytes": 0}
+        self._last_report: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def for_manager(cls, manager) -> "MemoryCompactor":
+        """获取记忆目录对应的压实任务"""
+        report_path = os.path.abspath(os.path.join(manager.memory_path, "compaction_report.json"))
+        with cls._registry_lock:
+            compactor = cls._registry.get(report_path)
+            if compactor is None:
+                compactor = cls(manager, report_path)
+                cls._registry[report_path] = compactor
+            return compactor
+
+    @classmethod
+    def validate_policy(cls, policy: Dict[str, Any]) -> Dict[str, Any]:
+        for key in policy:
+            if key not in cls.POLICY_KEYS:
+                raise ValueError(f"未知的保留策略参数: {key}")
+        return {key: value for key, value in policy.items() if value is not None}
+
+    def start(self, policy: Dict[str, Any]):
+        """设置保留策略并启动后台定时压实"""
+        policy = self.validate_policy(policy)
+        with self._lock:
+            self.policy = policy
+            if self._timer is None and policy:
+                self._schedule()
+
+    def stop(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _schedule(self):
+        """安排下一次运行（调用方需持有锁）"""
+        self._timer = threading.Timer(self.interval, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        try:
+            self.run_once()
+        except Exception as e:
+            print(f"记忆压实失败: {e}")
+        with self._lock:
+            if self._timer is not None:
+                self._schedule()
+
+    def plan(self, session_id: str, policy: Dict[str, Any]) -> Dict[str, Any]:
+        """按策略列出会话中应压实的分片（从旧到新）
+
+        Returns:
+            {"chunks": [chunk_index], "skipped_without_summary": [chunk_index]}
+        """
+        manager = self.manager
+        index_data = manager.storage.load_session_index(session_id)
+        total_messages = index_data["total_messages"]
+        result = {"chunks": [], "skipped_without_summary": []}
+        if not total_messages:
+            return result
+        tail_chunk = manager.chunk_manager.get_chunk_index(total_messages)
+        compacted = index_data.get("compacted", {})
+        now = time.time()
+
+        keep_recent = policy.get("keep_recent_messages")
+        max_age = policy.get("max_age_seconds")
+        max_bytes = policy.get("max_bytes")
+        over_bytes = 0
+        bytes_per_message = 0.0
+        if max_bytes is not None:
+            entry = manager.catalog.get(session_id)
+            session_bytes = entry["bytes"] if entry else manager.storage.get_session_size(session_id)
+            over_bytes = session_bytes - max_bytes
+            live_messages = total_messages - sum(info.get("count") or 0 for info in compacted.values())
+            bytes_per_message = session_bytes / live_messages if live_messages else 0.0
+
+        for chunk_index in sorted(int(key) for key in index_data["chunks"]):
+            chunk_info = index_data["chunks"][str(chunk_index)]
+            if str(chunk_index) in compacted or chunk_index >= tail_chunk:
+                continue
+            if chunk_info["count"] < manager.chunk_size:
+                continue
+            selected = (
+                (keep_recent is not None and chunk_info["end"] <= total_messages - keep_recent)
+                or (max_age is not None and now - (chunk_info.get("updated_at") or now) >= max_age)
+                or (max_bytes is not None and over_bytes > 0)
+            )
+            if not selected:
+                continue
+            summary_data = manager.storage.load_summary(session_id, chunk_index)
+            # 降级摘要不能代替原始消息
+            if (
+                not summary_data
+                or summary_data.get("fallback")
+                or summary_data.get("original_count") != chunk_info["count"]
+            ):
+                result["skipped_without_summary"].append(chunk_index)
+                continue
+            result["chunks"].append(chunk_index)
+            over_bytes -= bytes_per_message * chunk_info["count"]
+        return result
+
+    def compact_session(
+        self,
+        session_id: str,
+        policy: Optional[Dict[str, Any]] = None,
+        dry_run: bool = False,
+        max_chunks: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """按策略压实一个会话，返回报告"""
+        manager = self.manager
+        policy = self.validate_policy(policy if policy is not None else self.policy)
+        plan = self.plan(session_id, policy) if policy else {"chunks": [], "skipped_without_summary": []}
+        chunks = plan["chunks"][:max_chunks] if max_chunks is not None else plan["chunks"]
+        report = {
+            "session_id": session_id,
+            "compacted_chunks": [],
+            "compacted_ranges": [],
+            "skipped_without_summary": plan["skipped_without_summary"],
+            "pending_chunks": len(plan["chunks"]) - len(chunks),
+            "reclaimed_bytes": 0,
+            "dry_run": dry_run
+        }
+        for chunk_index in chunks:
+            start, end = manager.chunk_manager.get_chunk_range(chunk_index)
+            report["compacted_ranges"].append([start, end])
+            report["compacted_chunks"].append(chunk_index)
+            if dry_run:
+                continue
+            report["reclaimed_bytes"] += manager.storage.drop_chunk(session_id, chunk_index)
+            numbers = list(range(start, end + 1))
+            try:
+                manager.search_index.remove_messages(session_id, numbers)
+                if manager.vector_index is not None:
+                    manager.vector_index.delete_messages(session_id, numbers)
+            except Exception as e:
+                print(f"更新检索索引失败: {e}")
+
+        if report["compacted_chunks"] and not dry_run:
+            if manager.vector_index is not None:
+                manager.vector_index.compact(session_id)
+            manager.refresh_catalog_entry(session_id)
+        return report
+
+    def run_once(self, policy: Optional[Dict[str, Any]] = None, max_chunks: Optional[int] = None) -> Dict[str, Any]:
+        """对所有会话执行一轮增量压实（总共至多 max_chunks 个分片），保存并返回报告"""
+        if max_chunks is None:
+            max_chunks = self.max_chunks_per_run
+        report = {"started_at": time.time(), "sessions": [], "compacted_chunks": 0, "reclaimed_bytes": 0}
+        remaining = max_chunks
+        for session_id in self.manager.list_sessions():
+            if remaining <= 0:
+                break
+            session_report = self.compact_session(session_id, policy, max_chunks=remaining)
+            if session_report["compacted_chunks"] or session_report["skipped_without_summary"]:
+                report["sessions"].append(session_report)
+            remaining -= len(session_report["compacted_chunks"])
+            report["compacted_chunks"] += len(session_report["compacted_chunks"])
+            report["reclaimed_bytes"] += session_report["reclaimed_bytes"]
+        report["finished_at"] = time.time()
+
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["compacted_chunks"] += report["compacted_chunks"]
+            self._stats["reclaimed_bytes"] += report["reclaimed_bytes"]
+            self._last_report = report
+        tmp_file = f"{self.report_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.report_path)
+        except OSError as e:
+            print(f"保存压实报告失败: {e}")
+        if report["compacted_chunks"]:
+            print(f"记忆压实: {report['compacted_chunks']} 个分片，回收 {report['reclaimed_bytes']} 字节")
+        return report
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["policy"] = dict(self.policy)
+            stats["last_report"] = self._last_report
+        return stats
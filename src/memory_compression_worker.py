@@ -0,0 +1,197 @@
+# memory_compression_worker.py
+import os, re, json, time, threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from .file_lock import FileLock
+
+# === 后台压缩队列 ===
+class MemoryCompressionWorker:
+    """后台压缩队列 - 分片压缩在后台线程中执行，不占用生成请求的耗时
+
+    每个记忆目录共享一个队列（for_manager 按目录返回同一实例）。
+    同一分片在排队或执行中时重复提交会被去重；未完成的任务（含执行中的）
+    持久化在每个进程自己的 {memory_path}/compression_queue.{pid}.json 中，
+    进程存活期间持有对应的 locks/compression_queue.{pid}.lock。队列启动时接管
+    锁已释放（进程已退出）的其他队列文件及旧版的 compression_queue.json，
+    因此多个进程共用一个记忆目录时互不覆盖，进程重启后任务自动继续。
+    LLM调用失败、只保存了降级摘要的分片计入 failed。
+    """
+
+    workers: int = 1
+
+    _registry: Dict[str, "MemoryCompressionWorker"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, manager, queue_path: str):
+        self.manager = manager
+        self.queue_path = queue_path
+        self.queue_dir = os.path.dirname(queue_path)
+        self.owner_path = self._queue_file(os.getpid())
+        # 进程存活期间一直持有，其他进程据此判断队列文件是否无主
+        self._owner_lock = FileLock(self._owner_lock_file(os.getpid()))
+        self._owner_lock.acquire()
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._running: Dict[tuple, Dict[str, Any]] = {}
+        self._threads: List[threading.Thread] = []
+        self._stats = {"enqueued": 0, "deduped": 0, "completed": 0, "failed": 0, "total_time": 0.0}
+        self._started_at = time.time()
+
+        self._load_queue()
+        if self._pending:
+            print(f"恢复 {len(self._pending)} 个未完成的压缩任务")
+            with self._cond:
+                self._ensure_threads()
+
+    @classmethod
+    def for_manager(cls, manager) -> "MemoryCompressionWorker":
+        """获取记忆目录对应的压缩队列"""
+        queue_path = os.path.abspath(os.path.join(manager.memory_path, "compression_queue.json"))
+        with cls._registry_lock:
+            worker = cls._registry.get(queue_path)
+            if worker is None:
+                worker = cls(manager, queue_path)
+                cls._registry[queue_path] = worker
+            return worker
+
+    def _queue_file(self, pid: Optional[int] = None) -> str:
+        base, ext = os.path.splitext(self.queue_path)
+        return self.queue_path if pid is None else f"{base}.{pid}{ext}"
+
+    def _owner_lock_file(self, pid: int) -> str:
+        base = os.path.splitext(os.path.basename(self.queue_path))[0]
+        return os.path.join(self.queue_dir, "locks", f"{base}.{pid}.lock")
+
+    def _load_queue(self):
+        """接管无主的队列文件（含旧版共享文件），写入本进程的队列后删除原文件"""
+        base, ext = os.path.splitext(os.path.basename(self.queue_path))
+        pattern = re.compile(rf"^{re.escape(base)}(?:\.(\d+))?{re.escape(ext)}$")
+        adopted = []  # [(队列文件, 所属进程的锁)]
+        with FileLock(os.path.join(self.queue_dir, "locks", f"{base}.lock")):
+            try:
+                for name in sorted(os.listdir(self.queue_dir)):
+                    match = pattern.match(name)
+                    if not match:
+                        continue
+                    pid = int(match.group(1)) if match.group(1) else None
+                    owner_lock = None
+                    if pid is not None and pid != os.getpid():
+                        owner_lock = FileLock(self._owner_lock_file(pid))
+                        if not owner_lock.acquire(blocking=False):
+                            # 所属进程仍在运行
+                            continue
+                    adopted.append((os.path.join(self.queue_dir, name), owner_lock))
+
+                for path, _ in adopted:
+                    try:
+                        with open(path, 'r', encoding='utf-8') as f:
+                            for job in json.load(f):
+                                self._pending.setdefault((job["session_id"], job["chunk_index"]), job)
+                    except (ValueError, OSError, KeyError) as e:
+                        print(f"读取压缩队列失败: {e}")
+
+                # 先写入本进程的队列再删除原文件，中途崩溃也不会丢任务
+                with self._cond:
+                    self._persist()
+                for path, _ in adopted:
+                    if path != self.owner_path:
+                        try:
+                            os.remove(path)
+                        except OSError as e:
+                            print(f"删除压缩队列文件失败: {e}")
+            finally:
+                for _, owner_lock in adopted:
+                    if owner_lock is not None:
+                        owner_lock.release()
+
+    def _persist(self):
+        """将排队和执行中的任务写入本进程的队列文件（调用方需持有锁）"""
+        jobs = list(self._running.values()) + list(self._pending.values())
+        tmp_file = f"{self.owner_path}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(jobs, f, ensure_ascii=False)
+            os.replace(tmp_file, self.owner_path)
+        except OSError as e:
+            print(f"保存压缩队列失败: {e}")
+
+    def _ensure_threads(self):
+        """按需启动工作线程（调用方需持有锁）"""
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name="memory-compression", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(
+        self,
+        session_id: str,
+        chunk_index: int,
+        model_name: str = "deepseek_chat",
+        compression_prompt: str = ""
+    ) -> bool:
+        """提交一个分片压缩任务，已在排队或执行中时返回False"""
+        key = (session_id, chunk_index)
+        with self._cond:
+            if key in self._pending or key in self._running:
+                self._stats["deduped"] += 1
+                return False
+            self._pending[key] = {
+                "session_id": session_id,
+                "chunk_index": chunk_index,
+                "model_name": model_name,
+                "compression_prompt": compression_prompt,
+                "enqueued_at": time.time()
+            }
+            self._stats["enqueued"] += 1
+            self._persist()
+            self._ensure_threads()
+            self._cond.notify()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, job = self._pending.popitem(last=False)
+                self._running[key] = job
+
+            start = time.time()
+            try:
+                success = self.manager.compress_chunk(
+                    job["session_id"], job["chunk_index"], job["model_name"], job["compression_prompt"]
+                )
+            except Exception as e:
+                print(f"后台压缩分片失败: {e}")
+                success = False
+
+            with self._cond:
+                del self._running[key]
+                self._stats["completed" if success else "failed"] += 1
+                self._stats["total_time"] += time.time() - start
+                self._persist()
+                self._cond.notify_all()
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """等待队列清空，超时返回False"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._pending or self._running:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列深度和吞吐统计"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._pending)
+            stats["running"] = len(self._running)
+        finished = stats["completed"] + stats["failed"]
+        elapsed_minutes = (time.time() - self._started_at) / 60
+        stats["avg_duration"] = stats.pop("total_time") / finished if finished else 0.0
+        stats["throughput_per_minute"] = stats["completed"] / elapsed_minutes if elapsed_minutes > 0 else 0.0
+        return stats
@@ -1,5 +1,6 @@
 import os, json, time, glob
 from typing import Dict, Any, List, Optional
+from .llm_caller import LLMCaller
 
 class MemoryCompressor:
     """记忆压缩器 - 独立的压缩模块"""
@@ -11,12 +12,34 @@ class MemoryCompressor:
         self, 
         messages: List[Dict[str, Any]], 
         model_name: str = "deepseek_chat",
-        compression_prompt: str = ""
-    ) -> str:
-        """压缩消息列表为摘要文本"""
+        compression_prompt: str = "",
+        return_fallback: bool = False
+    ):
+        """压缩消息列表为摘要文本
+
+        LLM调用失败时返回降级摘要；return_fallback=True 时返回 (摘要, 是否为降级摘要)。
+        """
         if not messages:
-            return ""
+            return ("", False) if return_fallback else ""
+        
+        # 调用LLM进行压缩
+        compress_messages = self.build_compression_messages(messages, compression_prompt)
         
+        try:
+            compressed_summary = LLMCaller.call(compress_messages, model_name, use_cache=True)
+            fallback = False
+        except Exception as e:
+            print(f"压缩失败: {e}")
+            compressed_summary = self._fallback_compression(messages)
+            fallback = True
+        return (compressed_summary, fallback) if return_fallback else compressed_summary
+    
+    def build_compression_messages(
+        self,
+        messages: List[Dict[str, Any]],
+        compression_prompt: str = ""
+    ) -> List[Dict[str, str]]:
+        """构建压缩请求的消息列表"""
         # 构建压缩提示词
         if not compression_prompt:
             compression_prompt = """请将以下对话历史压缩为简洁的摘要，保留关键信息和上下文：
@@ -29,17 +52,41 @@ class MemoryCompressor:
         # 格式化历史记录
         history_text = self._format_messages_for_compression(messages)
         
-        # 调用LLM进行压缩
-        compress_messages = [
+        return [
             {"role": "user", "content": compression_prompt.format(history=history_text)}
         ]
+    
+    def compress_summaries(
+        self,
+        summaries: List[str],
+        model_name: str = "deepseek_chat",
+        return_fallback: bool = False
+    ):
+        """将若干段按时间顺序排列的摘要合并为一份更精炼的上层摘要
+
+        LLM调用失败时返回各段开头拼接的降级摘要；return_fallback=True 时返回 (摘要, 是否为降级摘要)。
+        """
+        if not summaries:
+            return ("", False) if return_fallback else ""
+        
+        sections = "\n\n".join(f"第{i}段：{summary}" for i, summary in enumerate(summaries, 1))
+        rollup_messages = [
+            {"role": "user", "content": f"""以下是按时间顺序排列的若干段对话摘要，请将它们合并为一份更精炼的摘要，保留主线情节、关键人物变化和尚未解决的线索：
+
+{sections}
+
+请返回合并后的摘要："""}
+        ]
         
         try:
-            compressed_summary = LLMCaller.call(compress_messages, model_name)
-            return compressed_summary
+            merged_summary = LLMCaller.call(rollup_messages, model_name, use_cache=True)
+            fallback = False
         except Exception as e:
-            print(f"压缩失败: {e}")
-            return self._fallback_compression(messages)
+            print(f"汇总摘要失败: {e}")
+            # 降级：截取每段摘要的开头拼接
+            merged_summary = " ".join(summary[:200] for summary in summaries)
+            fallback = True
+        return (merged_summary, fallback) if return_fallback else merged_summary
     
     def _format_messages_for_compression(self, messages: List[Dict[str, Any]]) -> str:
         """格式化消息用于压缩"""
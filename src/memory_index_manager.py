@@ -1,71 +1,287 @@
 import os,time
 import json
+import atexit, threading
 from typing import Dict, Any, List, Optional
+from .file_lock import FileLock
 
 class MemoryIndexManager:
-    """记忆索引管理器 - 处理会话索引和元数据"""
-    
+    """记忆索引管理器 - 处理会话索引和元数据
+
+    会话索引缓存在进程级的共享字典中（按记忆目录+会话ID区分），同一进程内的
+    多个实例看到的是同一份数据。更新只修改内存，累计 flush_every 次更新、
+    距上次写盘超过 flush_interval 秒或进程退出时，才以“临时文件+原子替换”
+    的方式写回 {session}_index.json。
+
+    多个进程共用一个记忆目录时：写盘在 locks/{session}.index.lock 文件锁内
+    先读取磁盘上的索引与缓存合并（分片取消息数较大者，摘要、汇总摘要和压实
+    记录取并集），不会覆盖其他进程写入的条目；读取时发现索引文件被其他进程
+    修改过，也会合并到缓存。load_session_index 返回缓存的副本。
+    """
+
+    flush_every: int = 20
+    flush_interval: float = 2.0
+
+    _indexes: Dict[tuple, Dict[str, Any]] = {}
+    _dirty: Dict[tuple, int] = {}
+    _mtimes: Dict[tuple, int] = {}  # 最近一次读取或写入后索引文件的 mtime
+    _timer: Optional[threading.Timer] = None
+    _lock = threading.RLock()
+    _stats = {"loads": 0, "cache_hits": 0, "reloads": 0, "updates": 0, "flushes": 0}
+
     def __init__(self, memory_path: str):
         self.memory_path = memory_path
         self.chunks_path = os.path.join(memory_path, "chunks")
         self.summaries_path = os.path.join(memory_path, "summaries")
         os.makedirs(self.chunks_path, exist_ok=True)
         os.makedirs(self.summaries_path, exist_ok=True)
-    
-    def load_session_index(self, session_id: str) -> Dict[str, Any]:
-        """加载会话索引"""
-        print("MemoryIndexManager|load_session_index| 1")
-        index_file = os.path.join(self.memory_path, f"{session_id}_index.json")
-        if os.path.exists(index_file):
+
+    @classmethod
+    def configure(cls, flush_every: Optional[int] = None, flush_interval: Optional[float] = None):
+        """修改写回策略"""
+        with cls._lock:
+            if flush_every is not None:
+                cls.flush_every = flush_every
+            if flush_interval is not None:
+                cls.flush_interval = flush_interval
+
+    def _key(self, session_id: str) -> tuple:
+        return (os.path.abspath(self.memory_path), session_id)
+
+    @staticmethod
+    def _index_file(key: tuple) -> str:
+        return os.path.join(key[0], f"{key[1]}_index.json")
+
+    @staticmethod
+    def _lock_file(key: tuple) -> str:
+        return os.path.join(key[0], "locks", f"{key[1]}.index.lock")
+
+    @staticmethod
+    def _copy_index(index_data: Dict[str, Any]) -> Dict[str, Any]:
+        """复制索引（各条目也复制，调用方修改不影响缓存）"""
+        copied = dict(index_data)
+        for field in ("chunks", "summaries", "compacted"):
+            copied[field] = {key: dict(value) for key, value in index_data.get(field, {}).items()}
+        copied["rollups"] = {
+            level: {key: dict(value) for key, value in nodes.items()}
+            for level, nodes in index_data.get("rollups", {}).items()
+        }
+        return copied
+
+    @staticmethod
+    def _merge_index(target: Dict[str, Any], other: Dict[str, Any]):
+        """把另一份索引（通常来自磁盘）合并进 target：分片取消息数较大者，其余条目取较新者"""
+        target["total_messages"] = max(target.get("total_messages", 0), other.get("total_messages", 0))
+        for chunk_key, chunk_info in other.get("chunks", {}).items():
+            current = target.setdefault("chunks", {}).get(chunk_key)
+            if current is None or chunk_info.get("end", 0) > current.get("end", 0):
+                target["chunks"][chunk_key] = dict(chunk_info)
+        for field in ("summaries", "compacted"):
+            entries = target.setdefault(field, {})
+            time_field = "compacted_at" if field == "compacted" else "created_at"
+            for entry_key, entry in other.get(field, {}).items():
+                current = entries.get(entry_key)
+                if current is None or (entry.get(time_field) or 0) > (current.get(time_field) or 0):
+                    entries[entry_key] = dict(entry)
+        for level, nodes in other.get("rollups", {}).items():
+            target_nodes = target.setdefault("rollups", {}).setdefault(level, {})
+            for node_key, node in nodes.items():
+                current = target_nodes.get(node_key)
+                if current is None or (node.get("created_at") or 0) > (current.get("created_at") or 0):
+                    target_nodes[node_key] = dict(node)
+        if other.get("created_at"):
+            target["created_at"] = min(target.get("created_at") or other["created_at"], other["created_at"])
+        target["last_updated"] = max(target.get("last_updated") or 0, other.get("last_updated") or 0)
+
+    @classmethod
+    def _read_index_file(cls, key: tuple) -> Optional[Dict[str, Any]]:
+        """读取磁盘上的索引并记录其 mtime（调用方需持有锁），文件不存在时返回None"""
+        index_file = cls._index_file(key)
+        try:
+            stat = os.stat(index_file)
             with open(index_file, 'r', encoding='utf-8') as f:
-                print("MemoryIndexManager|load_session_index| 2")
-                return json.load(f)
-        else:
-            print("MemoryIndexManager|load_session_index| 3")
+                index_data = json.load(f)
+        except FileNotFoundError:
+            return None
+        cls._mtimes[key] = stat.st_mtime_ns
+        return index_data
+
+    def _cached_index(self, session_id: str) -> Dict[str, Any]:
+        """获取进程内共享的缓存索引，索引文件被其他进程修改过时先合并（调用方需持有锁）"""
+        key = self._key(session_id)
+        index_data = self._indexes.get(key)
+        if index_data is not None:
+            try:
+                mtime = os.stat(self._index_file(key)).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is None or mtime == self._mtimes.get(key):
+                self._stats["cache_hits"] += 1
+                return index_data
+            disk_data = self._read_index_file(key)
+            if disk_data is not None:
+                self._merge_index(index_data, disk_data)
+                self._stats["reloads"] += 1
+            return index_data
+
+        self._stats["loads"] += 1
+        index_data = self._read_index_file(key)
+        if index_data is None:
             # 创建新索引
-            return {
+            index_data = {
                 "session_id": session_id,
                 "total_messages": 0,
                 "chunks": {},  # {chunk_index: {"start": 1, "end": 100, "count": 100}}
                 "summaries": {},  # {chunk_index: {"file": "summary_001.json", "created_at": "..."}}
+                "rollups": {},  # {level: {node_index: {"file": "rollup_L2_001.json", "created_at": "..."}}}
+                "compacted": {},  # {chunk_index: {"start", "end", "count", "compacted_at"}} 原始消息已删除、只保留摘要的分片
                 "created_at": time.time(),
                 "last_updated": time.time()
             }
-    
+        self._indexes[key] = index_data
+        return index_data
+
+    def load_session_index(self, session_id: str) -> Dict[str, Any]:
+        """加载会话索引（返回缓存的副本）"""
+        with self._lock:
+            return self._copy_index(self._cached_index(session_id))
+
     def save_session_index(self, session_id: str, index_data: Dict[str, Any]):
-        """保存会话索引"""
-        index_data["last_updated"] = time.time()
-        index_file = os.path.join(self.memory_path, f"{session_id}_index.json")
-        with open(index_file, 'w', encoding='utf-8') as f:
-            json.dump(index_data, f, indent=2, ensure_ascii=False)
-    
+        """保存会话索引（写入缓存，按写回策略落盘）"""
+        key = self._key(session_id)
+        with self._lock:
+            index_data["last_updated"] = time.time()
+            self._indexes[key] = index_data
+            self._mark_dirty(key)
+
+    def _touch(self, session_id: str):
+        """缓存索引已就地修改，记录更新（调用方需持有锁）"""
+        key = self._key(session_id)
+        self._indexes[key]["last_updated"] = time.time()
+        self._mark_dirty(key)
+
+    @classmethod
+    def _mark_dirty(cls, key: tuple):
+        """记录一次更新，达到次数阈值立即写盘，否则确保定时写盘已安排"""
+        cls._stats["updates"] += 1
+        cls._dirty[key] = cls._dirty.get(key, 0) + 1
+        if cls._dirty[key] >= cls.flush_every:
+            cls._flush_key(key)
+        elif cls._timer is None:
+            cls._timer = threading.Timer(cls.flush_interval, cls._on_timer)
+            cls._timer.daemon = True
+            cls._timer.start()
+
+    @classmethod
+    def _on_timer(cls):
+        with cls._lock:
+            cls._timer = None
+        cls.flush_all()
+
+    @classmethod
+    def _flush_key(cls, key: tuple):
+        """在索引文件锁内合并磁盘上的索引，再原子地写回（调用方需持有锁）"""
+        index_data = cls._indexes.get(key)
+        if index_data is None or key not in cls._dirty:
+            return
+        index_file = cls._index_file(key)
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        try:
+            with FileLock(cls._lock_file(key)):
+                disk_data = cls._read_index_file(key)
+                if disk_data is not None:
+                    cls._merge_index(index_data, disk_data)
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(index_data, f, indent=2, ensure_ascii=False)
+                # 替换不改变 mtime，先记录临时文件的 mtime
+                cls._mtimes[key] = os.stat(tmp_file).st_mtime_ns
+                os.replace(tmp_file, index_file)
+            del cls._dirty[key]
+            cls._stats["flushes"] += 1
+        except (OSError, ValueError) as e:
+            print(f"写入会话索引失败: {e}")
+
+    def flush(self, session_id: Optional[str] = None):
+        """立即写回本目录下的会话索引（可指定会话）"""
+        with self._lock:
+            for key in list(self._dirty):
+                if key[0] == os.path.abspath(self.memory_path) and session_id in (None, key[1]):
+                    self._flush_key(key)
+
+    @classmethod
+    def flush_all(cls):
+        """立即写回所有未落盘的会话索引"""
+        with cls._lock:
+            for key in list(cls._dirty):
+                cls._flush_key(key)
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        """获取索引缓存统计"""
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["cached_sessions"] = len(cls._indexes)
+            stats["dirty_sessions"] = len(cls._dirty)
+        return stats
+
     def update_chunk_info(self, session_id: str, chunk_index: int, start: int, end: int, count: int):
         """更新分片信息"""
-        index_data = self.load_session_index(session_id)
-        index_data["chunks"][str(chunk_index)] = {
-            "start": start,
-            "end": end, 
-            "count": count,
-            "updated_at": time.time()
-        }
-        index_data["total_messages"] = max(index_data["total_messages"], end)
-        self.save_session_index(session_id, index_data)
-    
-    def update_summary_info(self, session_id: str, chunk_index: int, summary_file: str):
-        """更新摘要信息"""
-        index_data = self.load_session_index(session_id)
-        index_data["summaries"][str(chunk_index)] = {
-            "file": summary_file,
-            "created_at": time.time()
-        }
-        self.save_session_index(session_id, index_data)
-    
+        with self._lock:
+            index_data = self._cached_index(session_id)
+            index_data["chunks"][str(chunk_index)] = {
+                "start": start,
+                "end": end,
+                "count": count,
+                "updated_at": time.time()
+            }
+            index_data["total_messages"] = max(index_data["total_messages"], end)
+            self._touch(session_id)
+
+    def update_summary_info(self, session_id: str, chunk_index: int, summary_file: str, fallback_attempts: int = 0):
+        """更新摘要信息，降级摘要记录连续降级的次数"""
+        with self._lock:
+            index_data = self._cached_index(session_id)
+            summary_info = {
+                "file": summary_file,
+                "created_at": time.time()
+            }
+            if fallback_attempts:
+                summary_info["fallback_attempts"] = fallback_attempts
+            index_data["summaries"][str(chunk_index)] = summary_info
+            self._touch(session_id)
+
+    def update_rollup_info(self, session_id: str, level: int, node_index: int, rollup_file: str):
+        """更新多层汇总摘要信息"""
+        with self._lock:
+            index_data = self._cached_index(session_id)
+            index_data.setdefault("rollups", {}).setdefault(str(level), {})[str(node_index)] = {
+                "file": rollup_file,
+                "created_at": time.time()
+            }
+            self._touch(session_id)
+
+    def mark_chunk_compacted(self, session_id: str, chunk_index: int):
+        """记录分片已压实（原始消息删除、只保留摘要）"""
+        with self._lock:
+            index_data = self._cached_index(session_id)
+            chunk_info = index_data["chunks"].get(str(chunk_index), {})
+            index_data.setdefault("compacted", {})[str(chunk_index)] = {
+                "start": chunk_info.get("start"),
+                "end": chunk_info.get("end"),
+                "count": chunk_info.get("count"),
+                "compacted_at": time.time()
+            }
+            self._touch(session_id)
+
     def get_chunk_info(self, session_id: str, chunk_index: int) -> Optional[Dict[str, Any]]:
         """获取分片信息"""
         index_data = self.load_session_index(session_id)
         return index_data["chunks"].get(str(chunk_index))
-    
+
     def list_available_chunks(self, session_id: str) -> List[int]:
         """列出可用的分片索引"""
         index_data = self.load_session_index(session_id)
-        return [int(k) for k in index_data["chunks"].keys()]
\ No newline at end of file
+        return [int(k) for k in index_data["chunks"].keys()]
+
+
+# 进程退出时写回未落盘的索引
+atexit.register(MemoryIndexManager.flush_all)
@@ -1,65 +1,120 @@
 # memory_manager.py
-import os, json, time, glob
-from typing import Dict, Any, List, Optional
+import os, json, time, glob, threading
+from typing import Dict, Any, List, Optional, Callable
 from .memory_chunk_manager import MemoryChunkManager
 from .memory_compressor import MemoryCompressor
-from .memory_index_manager import MemoryIndexManager
+from .memory_storage import MemoryStorage
+from .file_memory_storage import FileMemoryStorage
+from .sqlite_memory_storage import SQLiteMemoryStorage
+from .llm_batch import LLMBatch
+from .memory_compression_worker import MemoryCompressionWorker
+from .token_budgeter import TokenBudgeter
+from .memory_search_index import MemorySearchIndex
+from .memory_vector_index import MemoryVectorIndex
+from .text_embedder import TextEmbedder
+from .session_catalog import SessionCatalog
+from .memory_compactor import MemoryCompactor
 
 
 class MemoryManager:
-    """增强的记忆管理器 - 支持分片存储、索引和压缩"""
+    """增强的记忆管理器 - 支持分片存储、索引和压缩
+
+    读写通过可替换的存储后端完成：backend="file"（默认，JSONL分片文件）
+    或 backend="sqlite"（{memory_path}/memory.db），也可直接传入 storage。
+
+    分片摘要按 rollup_factor 逐层汇总成摘要树：每 K 个分片摘要汇总为一个
+    第2层摘要，每 K 个第2层摘要再汇总为第3层，依此类推。
+
+    消息写入时同时更新全文检索索引；use_vectors=True 且安装了 NumPy 时
+    还会更新语义向量索引（embedder 默认由 TextEmbedder.create 创建）。
+
+    retention_policy 不为空时按保留策略在后台定期压实旧分片（见 MemoryCompactor），
+    压实后的分片只保留摘要，也可以用 compact_sessions 手动执行。
+    """
+
+    # recall_messages 中最近消息最多占用的预算比例
+    recent_budget_share: float = 0.5
+    # 降级摘要的分片由 enqueue_finished_chunks 重新提交的次数上限，
+    # 第n次重试至少在上次降级 compression_retry_delay * 2^(n-1) 秒之后
+    max_compression_retries: int = 3
+    compression_retry_delay: float = 300.0
     
-    def __init__(self, memory_path: str = "./memory", chunk_size: int = 100):
+    def __init__(
+        self,
+        memory_path: str = "./memory",
+        chunk_size: int = 100,
+        fsync: bool = False,
+        backend: str = "file",
+        storage: Optional[MemoryStorage] = None,
+        rollup_factor: int = 10,
+        summary_token_budget: int = 4000,
+        use_vectors: bool = True,
+        embedder: Optional[TextEmbedder] = None,
+        retention_policy: Optional[Dict[str, Any]] = None
+    ):
         self.memory_path = memory_path
         self.chunk_size = chunk_size
+        self.rollup_factor = rollup_factor
+        self.summary_token_budget = summary_token_budget
         os.makedirs(self.memory_path, exist_ok=True)
 
         # 初始化子模块
-        self.chunk_manager = MemoryChunkManager(chunk_size)
+        self.chunk_manager = MemoryChunkManager(chunk_size, fsync=fsync)
         self.compressor = MemoryCompressor()
-        self.index_manager = MemoryIndexManager(memory_path)
+        if storage is None:
+            if backend == "sqlite":
+                storage = SQLiteMemoryStorage(os.path.join(memory_path, "memory.db"), self.chunk_manager, fsync=fsync)
+            elif backend == "file":
+                storage = FileMemoryStorage(memory_path, self.chunk_manager)
+            else:
+                raise ValueError(f"不支持的记忆存储后端: {backend}")
+        self.storage = storage
+        self.search_index = MemorySearchIndex(memory_path, self.storage)
+        self.vector_index = None
+        if use_vectors and TextEmbedder.available():
+            self.vector_index = MemoryVectorIndex(memory_path, self.storage, embedder)
+        
+        # 会话目录（首次使用时从已有数据建立）
+        self.catalog = SessionCatalog(os.path.join(memory_path, "catalog.db"))
+        if self.catalog.is_empty():
+            self.rebuild_catalog()
+        
+        # 后台压缩队列（会恢复上次未完成的任务）
+        self.compression_worker = MemoryCompressionWorker.for_manager(self)
+
+        # 按保留策略压实旧分片
+        self.compactor = MemoryCompactor.for_manager(self)
+        if retention_policy:
+            self.compactor.start(retention_policy)
     
     def save_message(self, session_id: str, message: Dict[str, Any]) -> int:
         """保存单条消息，返回消息编号"""
-        # 加载会话索引
-        index_data = self.index_manager.load_session_index(session_id)
-        
-        # 计算新消息编号
-        message_number = index_data["total_messages"] + 1
-        chunk_index = self.chunk_manager.get_chunk_index(message_number)
-        
-        # 加载或创建分片
-        chunk_file = os.path.join(
-            self.index_manager.chunks_path,
-            self.chunk_manager.get_chunk_filename(session_id, chunk_index)
-        )
-        
-        if os.path.exists(chunk_file):
-            with open(chunk_file, 'r', encoding='utf-8') as f:
-                chunk_data = json.load(f)
-        else:
-            chunk_data = {"messages": []}
-        
-        # 添加消息
-        message_with_meta = {
-            "number": message_number,
-            "timestamp": time.time(),
-            **message
-        }
-        chunk_data["messages"].append(message_with_meta)
-        
-        # 保存分片
-        with open(chunk_file, 'w', encoding='utf-8') as f:
-            json.dump(chunk_data, f, indent=2, ensure_ascii=False)
-        
-        # 更新索引
-        start, end = self.chunk_manager.get_chunk_range(chunk_index)
-        actual_end = min(end, message_number)
-        self.index_manager.update_chunk_info(
-            session_id, chunk_index, start, actual_end, len(chunk_data["messages"])
-        )
-        
-        return message_number
+        saved_message = self.storage.append_message(session_id, message)
+        try:
+            self.catalog.record_write(
+                session_id,
+                saved_message["number"],
+                self.chunk_manager.get_chunk_index(saved_message["number"]),
+                len(json.dumps(saved_message, ensure_ascii=False).encode("utf-8")) + 1
+            )
+        except Exception as e:
+            print(f"更新会话目录失败: {e}")
+        try:
+            self.search_index.add_message(session_id, saved_message)
+            if self.vector_index is not None:
+                self.vector_index.add_message(session_id, saved_message)
+        except Exception as e:
+            # 检索索引缺失的消息会在下次查询前补齐
+            print(f"更新检索索引失败: {e}")
+        return saved_message["number"]
+    
+    def search_messages(self, session_id: str, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+        """全文检索会话消息，返回按相关度排序的 [{"number", "score", "role", "snippet"}]"""
+        return self.search_index.search(session_id, query, top_k)
+    
+    def load_session_index(self, session_id: str) -> Dict[str, Any]:
+        """加载会话索引"""
+        return self.storage.load_session_index(session_id)
     
     def load_messages_by_range(
         self,
@@ -79,6 +134,9 @@ class MemoryManager:
             use_compression: 是否实时压缩（读取时临时压缩）
             compression_model: 压缩使用的模型
             read_compressed: 是否读取已压缩的记忆（从summaries读取）
+
+        范围内已压实的分片（原始消息已按保留策略删除）以该分片的摘要代替，
+        摘要消息的 compression_type 为 "compacted"，message_range 为其覆盖的消息编号。
         """
         # 如果要读取已压缩的记忆
         print("=01")
@@ -86,7 +144,7 @@ class MemoryManager:
             return self._load_compressed_summaries(session_id, start_msg, end_msg)
         
         # 获取会话总消息数
-        index_data = self.index_manager.load_session_index(session_id)
+        index_data = self.storage.load_session_index(session_id)
         total_messages = index_data["total_messages"]
         
         if total_messages == 0:
@@ -100,13 +158,9 @@ class MemoryManager:
         if start_msg > end_msg:
             return []
         print("=012")
-        # 计算需要的分片
-        required_chunks = self.chunk_manager.calculate_required_chunks(start_msg, end_msg)
-        
-        all_messages = []
-        for chunk_index in required_chunks:
-            chunk_messages = self._load_chunk_messages(session_id, chunk_index, start_msg, end_msg)
-            all_messages.extend(chunk_messages)
+        all_messages = self.storage.load_messages(session_id, start_msg, end_msg)
+        if index_data.get("compacted"):
+            all_messages = self._fill_compacted_ranges(session_id, index_data, all_messages, start_msg, end_msg)
         
         # 可选实时压缩
         if use_compression and all_messages:
@@ -123,55 +177,223 @@ class MemoryManager:
         print("=03")
         return all_messages
 
+    def _fill_compacted_ranges(
+        self,
+        session_id: str,
+        index_data: Dict[str, Any],
+        messages: List[Dict[str, Any]],
+        start_msg: int,
+        end_msg: int
+    ) -> List[Dict[str, Any]]:
+        """在已压实分片的位置插入分片摘要"""
+        placed = [(msg.get("number", 0), msg) for msg in messages]
+        for key, info in index_data["compacted"].items():
+            first, last = self.chunk_manager.get_chunk_range(int(key))
+            if last < start_msg or first > end_msg:
+                continue
+            for summary in self._render_summary_node(session_id, 1, int(key), start_msg, end_msg):
+                summary["compression_type"] = "compacted"
+                summary["message_range"] = [info.get("start") or first, info.get("end") or last]
+                placed.append((first, summary))
+        placed.sort(key=lambda item: item[0])
+        return [msg for _, msg in placed]
+
     def _load_compressed_summaries(
         self,
         session_id: str,
         start_msg: int = 1,
-        end_msg: Optional[int] = None
+        end_msg: Optional[int] = None,
+        token_budget: Optional[int] = None
     ) -> List[Dict[str, Any]]:
-        """加载已压缩的记忆摘要"""
-        index_data = self.index_manager.load_session_index(session_id)
-        summaries = index_data.get("summaries", {})
+        """加载已压缩的记忆摘要
+        
+        先用摘要树中可用的最粗节点覆盖整个范围，再从最近的历史开始逐个
+        展开为更细的节点，直到超出 token_budget（默认 summary_token_budget）。
+        这样较早的历史以高层摘要呈现，最近的历史保留分片级摘要。
+        尚无摘要的分片（如仍在后台压缩队列中）返回原始消息。
+        """
+        index_data = self.storage.load_session_index(session_id)
         
-        if not summaries:
+        if index_data["total_messages"] == 0:
             return []
         
         # 计算需要的分片范围
         start_chunk = self.chunk_manager.get_chunk_index(start_msg)
-        if end_msg:
-            end_chunk = self.chunk_manager.get_chunk_index(end_msg)
-        else:
-            # 获取最大的chunk索引
-            available_chunks = [int(k) for k in summaries.keys()]
-            end_chunk = max(available_chunks) if available_chunks else start_chunk
+        if not end_msg:
+            end_msg = index_data["total_messages"]
+        end_chunk = self.chunk_manager.get_chunk_index(end_msg)
+        if token_budget is None:
+            token_budget = self.summary_token_budget
         
-        compressed_messages = []
+        levels = self._get_summary_levels(index_data)
+        rendered = {}
         
-        for chunk_index in range(start_chunk, end_chunk + 1):
-            if str(chunk_index) in summaries:
-                summary_info = summaries[str(chunk_index)]
-                summary_file = summary_info["file"]
-                summary_path = os.path.join(self.index_manager.summaries_path, summary_file)
-                
-                if os.path.exists(summary_path):
-                    try:
-                        with open(summary_path, 'r', encoding='utf-8') as f:
-                            summary_data = json.load(f)
-                        
-                        compressed_messages.append({
-                            "role": "system",
-                            "content": f"[压缩记忆-分片{chunk_index}] {summary_data['compressed_summary']}",
-                            "is_compressed": True,
-                            "compression_type": "stored",
-                            "chunk_index": chunk_index,
-                            "original_count": summary_data.get("original_count", 0),
-                            "compression_model": summary_data.get("compression_model", "unknown")
-                        })
-                    except Exception as e:
-                        print(f"加载压缩摘要失败: {e}")
+        def render(node):
+            if node not in rendered:
+                rendered[node] = self._render_summary_node(session_id, node[0], node[1], start_msg, end_msg)
+            return rendered[node]
+        
+        def cost(nodes):
+            return sum(
+                TokenBudgeter.estimate(str(msg.get("content", ""))) + TokenBudgeter.MESSAGE_OVERHEAD
+                for node in nodes for msg in render(node)
+            )
+        
+        cover = self._build_summary_cover(levels, start_chunk, end_chunk, max(levels))
+        total = cost(cover)
+        
+        # 从最近的节点开始展开，展不开时停止，保证越近的历史越细
+        position = len(cover) - 1
+        while position >= 0:
+            level, node_index = cover[position]
+            if level < 2:
+                position -= 1
+                continue
+            first, last = self._get_node_chunk_range(level, node_index)
+            children = self._build_summary_cover(levels, first, last, level - 1)
+            new_total = total - cost([cover[position]]) + cost(children)
+            if new_total > token_budget:
+                break
+            cover[position:position + 1] = children
+            total = new_total
+            position += len(children) - 1
         
+        compressed_messages = []
+        for node in cover:
+            compressed_messages.extend(render(node))
         return compressed_messages
+    
+    def _get_summary_levels(self, index_data: Dict[str, Any]) -> Dict[int, set]:
+        """摘要树中每层已有的节点：第1层为分片摘要，更高层为汇总摘要"""
+        levels = {1: {int(k) for k in index_data.get("summaries", {})}}
+        for level, nodes in index_data.get("rollups", {}).items():
+            levels[int(level)] = {int(k) for k in nodes}
+        return levels
+    
+    def _get_node_chunk_range(self, level: int, node_index: int) -> tuple:
+        """摘要树节点覆盖的分片范围 (first, last)"""
+        span = self.rollup_factor ** (level - 1)
+        return (node_index - 1) * span + 1, node_index * span
+    
+    def _build_summary_cover(self, levels: Dict[int, set], start_chunk: int, end_chunk: int, max_level: int) -> List[tuple]:
+        """从左到右用不超过 max_level 的最粗可用节点覆盖分片区间
+        
+        返回 [(level, node_index)]，level=0 表示没有摘要、使用原始消息的分片。
+        """
+        cover = []
+        chunk = start_chunk
+        while chunk <= end_chunk:
+            for level in range(max_level, 0, -1):
+                span = self.rollup_factor ** (level - 1)
+                node_index = (chunk - 1) // span + 1
+                # 节点必须从当前分片开始，且整体落在区间内
+                if (chunk - 1) % span == 0 and chunk + span - 1 <= end_chunk and node_index in levels.get(level, ()):
+                    cover.append((level, node_index))
+                    chunk += span
+                    break
+            else:
+                cover.append((0, chunk))
+                chunk += 1
+        return cover
+    
+    def _render_summary_node(
+        self,
+        session_id: str,
+        level: int,
+        node_index: int,
+        start_msg: int,
+        end_msg: int
+    ) -> List[Dict[str, Any]]:
+        """将摘要树节点转换为消息"""
+        try:
+            if level == 1:
+                summary_data = self.storage.load_summary(session_id, node_index)
+                if summary_data:
+                    return [{
+                        "role": "system",
+                        "content": f"[压缩记忆-分片{node_index}] {summary_data['compressed_summary']}",
+                        "is_compressed": True,
+                        "compression_type": "stored",
+                        "chunk_index": node_index,
+                        "original_count": summary_data.get("original_count", 0),
+                        "compression_model": summary_data.get("compression_model", "unknown")
+                    }]
+            elif level >= 2:
+                rollup_data = self.storage.load_rollup(session_id, level, node_index)
+                if rollup_data:
+                    first, last = self._get_node_chunk_range(level, node_index)
+                    return [{
+                        "role": "system",
+                        "content": f"[压缩记忆-分片{first}~{last}] {rollup_data['compressed_summary']}",
+                        "is_compressed": True,
+                        "compression_type": "rollup",
+                        "level": level,
+                        "chunk_range": [first, last],
+                        "original_count": rollup_data.get("original_count", 0),
+                        "compression_model": rollup_data.get("compression_model", "unknown")
+                    }]
+        except Exception as e:
+            print(f"加载压缩摘要失败: {e}")
+        
+        # 摘要尚未生成（如仍在后台压缩队列中）时使用原始消息
+        first, last = self._get_node_chunk_range(max(level, 1), node_index)
+        messages = []
+        for chunk_index in range(first, last + 1):
+            messages.extend(self._load_chunk_messages(session_id, chunk_index, start_msg, end_msg))
+        return messages
+    
+    def _update_rollups(self, session_id: str, chunk_index: int, model_name: str = "deepseek_chat"):
+        """分片摘要生成后，逐层检查父节点：子节点齐全时生成或重建汇总
 
+        父节点已有非降级汇总且不早于所有子节点时视为最新并停止；子节点重新压缩后
+        父节点及其祖先随之重建。任一子节点是降级摘要时不生成汇总；汇总本身的
+        LLM调用失败时保存带 "fallback": True 的降级汇总，下次更新时重建。
+        """
+        level, node_index = 1, chunk_index
+        while True:
+            parent_level = level + 1
+            parent_index = (node_index - 1) // self.rollup_factor + 1
+            levels = self._get_summary_levels(self.storage.load_session_index(session_id))
+            children = range((parent_index - 1) * self.rollup_factor + 1, parent_index * self.rollup_factor + 1)
+            if not all(child in levels.get(level, ()) for child in children):
+                return
+            
+            if level == 1:
+                child_data = [self.storage.load_summary(session_id, child) for child in children]
+            else:
+                child_data = [self.storage.load_rollup(session_id, level, child) for child in children]
+            if not all(child_data) or any(data.get("fallback") for data in child_data):
+                return
+            
+            if parent_index in levels.get(parent_level, ()):
+                parent_data = self.storage.load_rollup(session_id, parent_level, parent_index)
+                if (
+                    parent_data
+                    and not parent_data.get("fallback")
+                    and parent_data.get("created_at", 0) >= max(data.get("created_at", 0) for data in child_data)
+                ):
+                    return
+            
+            compressed_summary, fallback = self.compressor.compress_summaries(
+                [data["compressed_summary"] for data in child_data], model_name, return_fallback=True
+            )
+            rollup_data = {
+                "level": parent_level,
+                "node_index": parent_index,
+                "original_count": sum(data.get("original_count", 0) for data in child_data),
+                "compressed_summary": compressed_summary,
+                "compression_model": model_name,
+                "created_at": time.time()
+            }
+            if fallback:
+                rollup_data["fallback"] = True
+            self.storage.save_rollup(session_id, parent_level, parent_index, rollup_data)
+            if fallback:
+                # 降级汇总不再向上汇总
+                return
+            print(f"已生成第{parent_level}层汇总摘要 {parent_index}")
+            level, node_index = parent_level, parent_index
+    
     def load_recent_messages(
         self,
         session_id: str,
@@ -190,7 +412,7 @@ class MemoryManager:
             read_compressed: 是否读取已压缩的记忆
         """
         print("=1")
-        index_data = self.index_manager.load_session_index(session_id)
+        index_data = self.storage.load_session_index(session_id)
         total_messages = index_data["total_messages"]
         print("=12")
         if total_messages == 0:
@@ -201,6 +423,91 @@ class MemoryManager:
             session_id, start_msg, total_messages, use_compression, compression_model, read_compressed
         )
     
+    def recall_messages(
+        self,
+        session_id: str,
+        query: str,
+        token_budget: Optional[int] = None,
+        recent_count: int = 5,
+        top_k: int = 20
+    ) -> List[Dict[str, Any]]:
+        """按与查询的相关性召回记忆，并保留少量最近消息
+        
+        候选为全文检索命中的前 top_k 条消息（按最高分归一化）和与查询有词项重合的
+        分片摘要；有向量索引时再合并语义最相近的前 top_k 条消息，消息分数取
+        全文检索与语义相似度两者归一化分数的平均。
+        候选按分数从高到低放入 token_budget（默认 summary_token_budget）。
+        最近 recent_count 条消息计入预算，但最多占用 recent_budget_share 比例的预算
+        （从最新的消息往前保留），以免较长的最近消息挤掉全部召回结果。
+        返回顺序：召回的摘要、召回的消息（均按时间先后），最后是最近消息。
+        """
+        index_data = self.storage.load_session_index(session_id)
+        total_messages = index_data["total_messages"]
+        if total_messages == 0:
+            return []
+        if token_budget is None:
+            token_budget = self.summary_token_budget
+        
+        def cost(msg):
+            return TokenBudgeter.estimate(str(msg.get("content", ""))) + TokenBudgeter.MESSAGE_OVERHEAD
+        
+        recent_start = max(1, total_messages - recent_count + 1) if recent_count > 0 else total_messages + 1
+        recent_messages = self.storage.load_messages(session_id, recent_start, total_messages) if recent_count > 0 else []
+        used = 0
+        kept = 0
+        for msg in reversed(recent_messages):
+            if used + cost(msg) > token_budget * self.recent_budget_share:
+                break
+            used += cost(msg)
+            kept += 1
+        # 放不下的较早消息仍可作为召回候选
+        recent_messages = recent_messages[len(recent_messages) - kept:]
+        recent_start = recent_messages[0]["number"] if recent_messages else total_messages + 1
+        
+        # 候选：(分数, 排序键, 消息)
+        candidates = []
+        rankings = [self.search_index.rank(session_id, query, top_k)]
+        if self.vector_index is not None:
+            try:
+                rankings.append(self.vector_index.rank(session_id, query, top_k))
+            except Exception as e:
+                print(f"语义检索失败: {e}")
+        message_scores: Dict[int, float] = {}
+        for hits in rankings:
+            max_score = max((score for _, score in hits), default=0.0)
+            if max_score <= 0:
+                continue
+            for number, score in hits:
+                if score > 0:
+                    message_scores[number] = message_scores.get(number, 0.0) + score / max_score / len(rankings)
+        for number, score in message_scores.items():
+            if number >= recent_start:
+                continue
+            messages = self.storage.load_messages(session_id, number, number)
+            if messages:
+                candidates.append((score, (1, number), {**messages[0], "is_recalled": True}))
+        for chunk_key in index_data.get("summaries", {}):
+            chunk_index = int(chunk_key)
+            _, chunk_end = self.chunk_manager.get_chunk_range(chunk_index)
+            if chunk_end >= recent_start:
+                continue
+            summary_messages = self._render_summary_node(session_id, 1, chunk_index, 1, chunk_end)
+            if not summary_messages or not summary_messages[0].get("is_compressed"):
+                continue
+            relevance = TokenBudgeter.relevance(summary_messages[0]["content"], query)
+            if relevance > 0:
+                candidates.append((relevance, (0, chunk_index), {**summary_messages[0], "is_recalled": True}))
+        
+        selected = []
+        for score, order, msg in sorted(candidates, key=lambda item: item[0], reverse=True):
+            msg_cost = cost(msg)
+            if used + msg_cost > token_budget:
+                continue
+            used += msg_cost
+            selected.append((order, {**msg, "recall_score": round(score, 4)}))
+        
+        return [msg for _, msg in sorted(selected, key=lambda item: item[0])] + recent_messages
+    
     def compress_chunk(
         self,
         session_id: str,
@@ -208,7 +515,10 @@ class MemoryManager:
         model_name: str = "deepseek_chat",
         compression_prompt: str = ""
     ) -> bool:
-        """压缩指定分片"""
+        """压缩指定分片
+
+        LLM压缩失败时仍保存降级摘要（不会被压实），但返回False。
+        """
         try:
             # 加载分片消息
             chunk_messages = self._load_chunk_messages(session_id, chunk_index)
@@ -216,47 +526,198 @@ class MemoryManager:
                 return False
             
             # 执行压缩
-            compressed_summary = self.compressor.compress_messages(
-                chunk_messages, model_name, compression_prompt
+            compressed_summary, fallback = self.compressor.compress_messages(
+                chunk_messages, model_name, compression_prompt, return_fallback=True
             )
             
-            # 保存压缩结果
-            summary_file = f"{session_id}_summary_{chunk_index:03d}.json"
-            summary_path = os.path.join(self.index_manager.summaries_path, summary_file)
-            
-            summary_data = {
-                "chunk_index": chunk_index,
-                "original_count": len(chunk_messages),
-                "compressed_summary": compressed_summary,
-                "compression_model": model_name,
-                "created_at": time.time()
-            }
-            
-            with open(summary_path, 'w', encoding='utf-8') as f:
-                json.dump(summary_data, f, indent=2, ensure_ascii=False)
+            # 保存压缩结果（降级摘要带 fallback 标记）
+            self._save_summary(
+                session_id, chunk_index, len(chunk_messages), compressed_summary, model_name, fallback=fallback
+            )
             
-            # 更新索引
-            self.index_manager.update_summary_info(session_id, chunk_index, summary_file)
+            # 增量更新上层汇总摘要（降级摘要不参与汇总）
+            if not fallback:
+                try:
+                    self._update_rollups(session_id, chunk_index, model_name)
+                except Exception as e:
+                    print(f"汇总摘要失败: {e}")
             
-            return True
+            return not fallback
             
         except Exception as e:
             print(f"压缩分片失败: {e}")
             return False
     
-    def batch_compress_chunks(
+    def _save_summary(
+        self,
+        session_id: str,
+        chunk_index: int,
+        original_count: int,
+        compressed_summary: str,
+        model_name: str,
+        fallback: bool = False
+    ):
+        """保存分片摘要并更新索引
+
+        fallback=True 表示LLM压缩失败后的降级摘要，摘要中记录 "fallback": True
+        和连续降级的次数 "fallback_attempts"，这类分片不会被压实。
+        """
+        summary_data = {
+            "chunk_index": chunk_index,
+            "original_count": original_count,
+            "compressed_summary": compressed_summary,
+            "compression_model": model_name,
+            "created_at": time.time()
+        }
+        if fallback:
+            previous = self.storage.load_summary(session_id, chunk_index)
+            summary_data["fallback"] = True
+            summary_data["fallback_attempts"] = (
+                previous.get("fallback_attempts", 1) + 1 if previous and previous.get("fallback") else 1
+            )
+        self.storage.save_summary(session_id, chunk_index, summary_data)
+        try:
+            compressed_chunks = len(self.storage.load_session_index(session_id)["summaries"])
+            self.catalog.record_compression(session_id, compressed_chunks)
+        except Exception as e:
+            print(f"更新会话目录失败: {e}")
+    
+    def enqueue_compression(
+        self,
+        session_id: str,
+        chunk_index: int,
+        model_name: str = "deepseek_chat",
+        compression_prompt: str = ""
+    ) -> bool:
+        """提交分片到后台压缩队列，已在队列中时返回False"""
+        return self.compression_worker.enqueue(session_id, chunk_index, model_name, compression_prompt)
+    
+    def enqueue_finished_chunks(
         self,
         session_id: str,
-        chunk_indices: List[int],
         model_name: str = "deepseek_chat",
         compression_prompt: str = ""
+    ) -> List[int]:
+        """将已写满且尚未压缩的分片提交到后台压缩队列，返回新提交的分片索引
+
+        只有降级摘要的分片按指数退避重新提交，至多 max_compression_retries 次。
+        """
+        index_data = self.storage.load_session_index(session_id)
+        now = time.time()
+        enqueued = []
+        for chunk_key, chunk_info in sorted(index_data["chunks"].items(), key=lambda item: int(item[0])):
+            if chunk_info["count"] < self.chunk_size:
+                continue
+            summary_info = index_data["summaries"].get(chunk_key)
+            if summary_info is not None:
+                attempts = summary_info.get("fallback_attempts", 0)
+                if not attempts or attempts > self.max_compression_retries:
+                    continue
+                if now < (summary_info.get("created_at") or 0) + self.compression_retry_delay * 2 ** (attempts - 1):
+                    continue
+            if self.enqueue_compression(session_id, int(chunk_key), model_name, compression_prompt):
+                enqueued.append(int(chunk_key))
+        return enqueued
+    
+    def batch_compress_chunks(
+        self,
+        session_id: str,
+        chunk_indices: Optional[List[int]] = None,
+        model_name: str = "deepseek_chat",
+        compression_prompt: str = "",
+        max_workers: int = 4,
+        force: bool = False,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
     ) -> Dict[int, bool]:
-        """批量压缩分片"""
-        results = {}
+        """批量并行压缩分片
+
+        chunk_indices 为None时处理会话的全部分片。压缩请求通过 LLMBatch 并发提交，
+        同时进行的请求不超过 max_workers 个；每个结果返回后立即保存摘要。
+        单个分片失败只影响自身：不保存摘要，结果为False，重新调用时会重试。
+        已有摘要（降级摘要除外）且消息数与分片一致的分片视为最新并跳过
+        （force=True 时重新压缩且不使用响应缓存），
+        因此中断后以相同参数重新调用只会处理剩余的分片。
+        progress_callback 每处理完一个分片调用一次，参数为
+        {"chunk_index", "success", "skipped", "completed", "total"}。
+        """
+        if chunk_indices is None:
+            chunk_indices = sorted(int(k) for k in self.storage.load_session_index(session_id)["chunks"])
+        
+        results = {chunk_index: False for chunk_index in chunk_indices}
+        progress = {"completed": 0, "total": len(chunk_indices)}
+        progress_lock = threading.Lock()
+        
+        def report(chunk_index: int, success: bool, skipped: bool = False):
+            with progress_lock:
+                results[chunk_index] = success
+                progress["completed"] += 1
+                event = {
+                    "chunk_index": chunk_index,
+                    "success": success,
+                    "skipped": skipped,
+                    "completed": progress["completed"],
+                    "total": progress["total"]
+                }
+            if progress_callback:
+                try:
+                    progress_callback(event)
+                except Exception as e:
+                    print(f"进度回调失败: {e}")
+        
+        chunks = {}
         for chunk_index in chunk_indices:
-            results[chunk_index] = self.compress_chunk(
-                session_id, chunk_index, model_name, compression_prompt
+            chunk_messages = self._load_chunk_messages(session_id, chunk_index)
+            if not chunk_messages:
+                report(chunk_index, False)
+                continue
+            if not force:
+                summary_data = self.storage.load_summary(session_id, chunk_index)
+                if (
+                    summary_data
+                    and not summary_data.get("fallback")
+                    and summary_data.get("original_count") == len(chunk_messages)
+                ):
+                    report(chunk_index, True, skipped=True)
+                    continue
+            chunks[chunk_index] = chunk_messages
+        
+        if chunks:
+            requests = {
+                str(chunk_index): self.compressor.build_compression_messages(chunk_messages, compression_prompt)
+                for chunk_index, chunk_messages in chunks.items()
+            }
+            
+            def on_result(custom_id: str, record: Dict[str, Any]):
+                chunk_index = int(custom_id)
+                chunk_messages = chunks[chunk_index]
+                if record["error"] is not None:
+                    # 不保存降级摘要，下次调用时重试
+                    print(f"压缩分片{chunk_index}失败: {record['error']}")
+                    report(chunk_index, False)
+                    return
+                try:
+                    self._save_summary(session_id, chunk_index, len(chunk_messages), record["content"], model_name)
+                    report(chunk_index, True)
+                except Exception as e:
+                    print(f"压缩分片失败: {e}")
+                    report(chunk_index, False)
+            
+            job_id = f"{session_id}_compress_{LLMBatch.make_job_id(requests, model_name)}"
+            LLMBatch.run(
+                requests, model_name, job_id=job_id, use_cache=not force,
+                on_result=on_result, max_concurrency=max_workers
             )
+            # 摘要已逐个保存，续跑依赖已有摘要判断，批量结果不再需要
+            LLMBatch.clear_job(job_id)
+            
+            # 增量更新上层汇总摘要
+            for chunk_index in sorted(chunks):
+                if results[chunk_index]:
+                    try:
+                        self._update_rollups(session_id, chunk_index, model_name)
+                    except Exception as e:
+                        print(f"汇总摘要失败: {e}")
+        
         return results
     
     def _load_chunk_messages(
@@ -267,59 +728,93 @@ class MemoryManager:
         end_filter: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """加载分片中的消息"""
-        chunk_file = os.path.join(
-            self.index_manager.chunks_path,
-            self.chunk_manager.get_chunk_filename(session_id, chunk_index)
-        )
-        
-        if not os.path.exists(chunk_file):
-            return []
-        
-        try:
-            with open(chunk_file, 'r', encoding='utf-8') as f:
-                chunk_data = json.load(f)
-            
-            messages = chunk_data.get("messages", [])
-            
-            # 应用范围过滤
-            if start_filter is not None or end_filter is not None:
-                filtered_messages = []
-                for msg in messages:
-                    msg_num = msg.get("number", 0)
-                    if start_filter is not None and msg_num < start_filter:
-                        continue
-                    if end_filter is not None and msg_num > end_filter:
-                        continue
-                    filtered_messages.append(msg)
-                return filtered_messages
-            
-            return messages
-            
-        except Exception as e:
-            print(f"加载分片失败: {e}")
-            return []
+        return self.storage.load_chunk_messages(session_id, chunk_index, start_filter, end_filter)
+    
+    def archive_cold_chunks(self, session_id: Optional[str] = None, idle_seconds: Optional[float] = None) -> Dict[str, int]:
+        """立即将长期未访问的已满分片转为压缩编码（文件存储后端），返回 {冷分片文件名: 节省的字节数}"""
+        return self.storage.archive_cold_chunks(session_id, idle_seconds)
+    
+    def compact_sessions(
+        self,
+        policy: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+        dry_run: bool = False
+    ) -> Dict[str, Any]:
+        """按保留策略压实分片（默认使用 retention_policy），返回压实报告
+
+        Args:
+            policy: {"keep_recent_messages", "max_age_seconds", "max_bytes"}，满足任一条件的分片被压实
+            session_id: 只压实该会话；为空时对所有会话增量执行一轮
+            dry_run: 只列出将被压实的分片，不删除
+        """
+        if session_id or dry_run:
+            sessions = [session_id] if session_id else self.list_sessions()
+            reports = [self.compactor.compact_session(sid, policy, dry_run=dry_run) for sid in sessions]
+            return {
+                "sessions": [report for report in reports if report["compacted_chunks"] or report["skipped_without_summary"]],
+                "compacted_chunks": sum(len(report["compacted_chunks"]) for report in reports),
+                "reclaimed_bytes": sum(report["reclaimed_bytes"] for report in reports),
+                "dry_run": dry_run
+            }
+        return self.compactor.run_once(policy)
     
     def get_session_stats(self, session_id: str) -> Dict[str, Any]:
         """获取会话统计信息"""
-        index_data = self.index_manager.load_session_index(session_id)
-        available_chunks = self.index_manager.list_available_chunks(session_id)
+        index_data = self.storage.load_session_index(session_id)
 
-        return {
+        stats = {
             "session_id": session_id,
             "total_messages": index_data["total_messages"],
-            "total_chunks": len(available_chunks),
+            "total_chunks": len(index_data["chunks"]),
             "compressed_chunks": len(index_data["summaries"]),
             "chunk_size": self.chunk_size,
             "created_at": index_data["created_at"],
             "last_updated": index_data["last_updated"]
         }
+        stats.update(self.storage.get_stats(session_id))
+        stats["compression_queue"] = self.compression_worker.get_stats()
+        compacted = index_data.get("compacted", {})
+        stats["compaction"] = {
+            "compacted_chunks": len(compacted),
+            "compacted_messages": sum(info.get("count") or 0 for info in compacted.values()),
+            "last_compacted_at": max((info.get("compacted_at") or 0 for info in compacted.values()), default=None)
+        }
+        stats["search_index"] = self.search_index.get_stats(session_id)
+        if self.vector_index is not None:
+            stats["vector_index"] = self.vector_index.get_stats(session_id)
+        return stats
     
     def list_sessions(self) -> List[str]:
         """列出所有会话"""
-        index_files = glob.glob(os.path.join(self.memory_path, "*_index.json"))
-        sessions = []
-        for file_path in index_files:
-            filename = os.path.basename(file_path)
-            session_id = filename.replace("_index.json", "")
-            sessions.append(session_id)
-        return sessions
+        listing = self.catalog.list(limit=None, sort_by="session_id", descending=False)
+        return [entry["session_id"] for entry in listing["sessions"]]
+    
+    def list_session_summaries(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = 50,
+        sort_by: str = "last_updated",
+        descending: bool = True
+    ) -> Dict[str, Any]:
+        """分页列出会话汇总信息（消息数、分片数、压缩覆盖率、字节数、更新时间）"""
+        return self.catalog.list(offset, limit, sort_by, descending)
+    
+    def rebuild_catalog(self) -> int:
+        """从存储重新统计全部会话写入目录，返回会话数"""
+        sessions = self.storage.list_sessions()
+        for session_id in sessions:
+            self.refresh_catalog_entry(session_id)
+        return len(sessions)
+    
+    def refresh_catalog_entry(self, session_id: str):
+        """从存储重新统计一个会话写入目录"""
+        index_data = self.storage.load_session_index(session_id)
+        self.catalog.upsert({
+            "session_id": session_id,
+            "total_messages": index_data["total_messages"],
+            "chunk_count": len(index_data["chunks"]),
+            "compressed_chunks": len(index_data["summaries"]),
+            "bytes": self.storage.get_session_size(session_id),
+            "created_at": index_data.get("created_at"),
+            "last_updated": index_data.get("last_updated")
+        })
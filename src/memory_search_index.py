@@ -0,0 +1,239 @@
+# memory_search_index.py
+import os, re, json, math, heapq, threading
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+from .memory_storage import MemoryStorage
+
+# === 记忆全文检索 ===
+class MemorySearchIndex:
+    """记忆消息的倒排索引（BM25评分）
+
+    中文按字二元组切分（单字片段保留单字），英文和数字按单词切分。
+    每个会话的词频记录追加写入 {memory_path}/search/{session}_postings.jsonl，
+    首次查询时读入内存构建倒排表，之后 save_message 增量更新；
+    索引落后于存储时（如索引建立前的旧消息）查询前自动补齐。
+    倒排表按记忆目录+会话ID在进程内共享。
+    """
+
+    k1: float = 1.2
+    b: float = 0.75
+    snippet_chars: int = 60
+
+    _sessions: Dict[tuple, Dict[str, Any]] = {}
+    _lock = threading.RLock()
+    _stats = {"indexed": 0, "queries": 0, "rebuilds": 0}
+
+    def __init__(self, memory_path: str, storage: MemoryStorage):
+        self.memory_path = memory_path
+        self.storage = storage
+        self.search_path = os.path.join(memory_path, "search")
+        os.makedirs(self.search_path, exist_ok=True)
+
+    @classmethod
+    def configure(cls, **kwargs):
+        """修改BM25参数，例如 configure(k1=1.5, b=0.6)"""
+        with cls._lock:
+            for key, value in kwargs.items():
+                if not hasattr(cls, key) or key.startswith("_"):
+                    raise ValueError(f"未知的检索参数: {key}")
+                setattr(cls, key, value)
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """切分词项（保留重复，用于词频统计）"""
+        terms = []
+        for segment in re.findall(r"[\u3400-\u9fff]+|[A-Za-z0-9_]+", text.lower()):
+            if "\u3400" <= segment[0] <= "\u9fff":
+                if len(segment) == 1:
+                    terms.append(segment)
+                terms.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+            else:
+                terms.append(segment)
+        return terms
+
+    def _key(self, session_id: str) -> tuple:
+        return (os.path.abspath(self.memory_path), session_id)
+
+    def _postings_file(self, session_id: str) -> str:
+        return os.path.join(self.search_path, f"{session_id}_postings.jsonl")
+
+    @staticmethod
+    def _add_document(session: Dict[str, Any], number: int, term_freqs: Dict[str, int]):
+        """将一条消息的词频并入倒排表（调用方需持有锁）"""
+        if number in session["lengths"]:
+            return
+        length = sum(term_freqs.values())
+        session["lengths"][number] = length
+        session["total_length"] += length
+        for term, freq in term_freqs.items():
+            session["postings"].setdefault(term, {})[number] = freq
+
+    @staticmethod
+    def _remove_documents(session: Dict[str, Any], numbers: set):
+        """从倒排表中批量移除消息（调用方需持有锁）"""
+        session["removed"].update(numbers)
+        present = numbers & session["lengths"].keys()
+        if not present:
+            return
+        for number in present:
+            session["total_length"] -= session["lengths"].pop(number)
+        for term in list(session["postings"]):
+            postings = session["postings"][term]
+            for number in present & postings.keys():
+                del postings[number]
+            if not postings:
+                del session["postings"][term]
+
+    def _load_session(self, session_id: str) -> Dict[str, Any]:
+        """取得会话的倒排表，不在内存时从词频记录文件构建（调用方需持有锁）"""
+        key = self._key(session_id)
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+
+        session = {"postings": {}, "lengths": {}, "total_length": 0, "removed": set()}
+        removed = set()
+        postings_file = self._postings_file(session_id)
+        if os.path.exists(postings_file):
+            with open(postings_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时可能留下半行，缺失的消息会在查询前补齐
+                        continue
+                    if record.get("removed"):
+                        removed.add(record["number"])
+                    else:
+                        self._add_document(session, record["number"], record["tf"])
+        self._remove_documents(session, removed)
+        self._sessions[key] = session
+        self._stats["rebuilds"] += 1
+        return session
+
+    def add_message(self, session_id: str, message: Dict[str, Any]):
+        """索引一条已保存的消息（需带 number）"""
+        self.add_messages(session_id, [message])
+
+    def add_messages(self, session_id: str, messages: List[Dict[str, Any]]):
+        """批量索引已保存的消息，已索引的编号跳过，词频记录一次写入"""
+        documents = []
+        for message in messages:
+            number = message.get("number")
+            if number is not None:
+                documents.append((number, dict(Counter(self.tokenize(str(message.get("content", "")))))))
+        with self._lock:
+            session = self._load_session(session_id)
+            documents = [(number, tf) for number, tf in documents if number not in session["lengths"]]
+            if not documents:
+                return
+            with open(self._postings_file(session_id), 'a', encoding='utf-8') as f:
+                f.write("".join(
+                    json.dumps({"number": number, "tf": tf}, ensure_ascii=False) + "\n"
+                    for number, tf in documents
+                ))
+            for number, tf in documents:
+                self._add_document(session, number, tf)
+            self._stats["indexed"] += len(documents)
+
+    def _catch_up(self, session_id: str, session: Dict[str, Any]):
+        """补齐存储中已有但尚未索引的消息"""
+        total_messages = self.storage.load_session_index(session_id)["total_messages"]
+        if len(session["lengths"]) + len(session["removed"]) >= total_messages:
+            return
+        missing_from = 1
+        while missing_from in session["lengths"] or missing_from in session["removed"]:
+            missing_from += 1
+        self.add_messages(session_id, self.storage.load_messages(session_id, missing_from, total_messages))
+
+    def rank(self, session_id: str, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """按BM25相关度排序，返回 [(消息编号, 分数)]"""
+        query_terms = set(self.tokenize(query))
+        if not query_terms:
+            return []
+
+        with self._lock:
+            session = self._load_session(session_id)
+        self._catch_up(session_id, session)
+
+        with self._lock:
+            self._stats["queries"] += 1
+            doc_count = len(session["lengths"])
+            if doc_count == 0:
+                return []
+            avg_length = session["total_length"] / doc_count or 1.0
+            scores: Dict[int, float] = {}
+            for term in query_terms:
+                postings = session["postings"].get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for number, freq in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * session["lengths"][number] / avg_length)
+                    scores[number] = scores.get(number, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+            return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def search(self, session_id: str, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+        """按BM25相关度检索消息
+
+        Returns:
+            [{"number", "score", "role", "snippet"}]，按分数从高到低
+        """
+        query_terms = set(self.tokenize(query))
+        results = []
+        for number, score in self.rank(session_id, query, top_k):
+            messages = self.storage.load_messages(session_id, number, number)
+            message = messages[0] if messages else {}
+            content = str(message.get("content", ""))
+            results.append({
+                "number": number,
+                "score": round(score, 4),
+                "role": message.get("role"),
+                "snippet": self._make_snippet(content, query_terms)
+            })
+        return results
+
+    def _make_snippet(self, content: str, query_terms: set) -> str:
+        """截取第一个命中词项附近的片段"""
+        lowered = content.lower()
+        positions = [pos for pos in (lowered.find(term) for term in query_terms) if pos >= 0]
+        if not positions:
+            return content[:self.snippet_chars]
+        start = max(0, min(positions) - self.snippet_chars // 3)
+        end = start + self.snippet_chars
+        snippet = content[start:end]
+        if start > 0:
+            snippet = "..." + snippet
+        if end < len(content):
+            snippet = snippet + "..."
+        return snippet
+
+    def remove_messages(self, session_id: str, numbers: List[int]):
+        """移除消息（如被压实的分片），之后不会再被补齐"""
+        if not numbers:
+            return
+        with self._lock:
+            session = self._load_session(session_id)
+            self._remove_documents(session, set(numbers))
+            with open(self._postings_file(session_id), 'a', encoding='utf-8') as f:
+                f.write("".join(
+                    json.dumps({"number": number, "removed": True}) + "\n" for number in sorted(set(numbers))
+                ))
+
+    def drop_session(self, session_id: str):
+        """删除会话的索引（内存和词频记录文件）"""
+        with self._lock:
+            self._sessions.pop(self._key(session_id), None)
+            postings_file = self._postings_file(session_id)
+            if os.path.exists(postings_file):
+                os.remove(postings_file)
+
+    def get_stats(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """获取检索索引统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            session = self._sessions.get(self._key(session_id)) if session_id else None
+            if session is not None:
+                stats["indexed_messages"] = len(session["lengths"])
+                stats["terms"] = len(session["postings"])
+        return stats
@@ -0,0 +1,91 @@
+# memory_storage.py
+import json
+from typing import Dict, Any, List, Optional
+from .memory_chunk_manager import MemoryChunkManager
+
+# === 记忆存储接口 ===
+class MemoryStorage:
+    """记忆存储接口 - MemoryManager 通过它读写消息、摘要和会话索引
+
+    消息按编号连续存放，并按 chunk_manager 的分片大小归入分片；
+    会话索引的结构与原 {session}_index.json 保持一致：
+    {"session_id", "total_messages", "chunks", "summaries", "created_at", "last_updated"}，
+    另有 "rollups": {level: {node_index: {...}}} 记录多层汇总摘要，
+    "compacted": {chunk_index: {"start", "end", "count", "compacted_at"}} 记录原始消息
+    已删除、只保留摘要的分片（旧索引可能没有这两个键）。
+    "summaries" 中降级摘要的条目带 "fallback_attempts"（连续降级的次数）。
+    """
+
+    def __init__(self, chunk_manager: MemoryChunkManager):
+        self.chunk_manager = chunk_manager
+
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """分配编号并保存一条消息，返回带 number/timestamp 的完整消息"""
+        raise NotImplementedError
+
+    def load_session_index(self, session_id: str) -> Dict[str, Any]:
+        """加载会话索引"""
+        raise NotImplementedError
+
+    def load_chunk_messages(
+        self,
+        session_id: str,
+        chunk_index: int,
+        start_filter: Optional[int] = None,
+        end_filter: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """加载分片中的消息（可按编号过滤）"""
+        raise NotImplementedError
+
+    def load_messages(self, session_id: str, start_msg: int, end_msg: int) -> List[Dict[str, Any]]:
+        """按编号范围加载消息，默认逐个分片读取"""
+        messages = []
+        for chunk_index in self.chunk_manager.calculate_required_chunks(start_msg, end_msg):
+            messages.extend(self.load_chunk_messages(session_id, chunk_index, start_msg, end_msg))
+        return messages
+
+    def save_summary(self, session_id: str, chunk_index: int, summary_data: Dict[str, Any]):
+        """保存分片摘要并记入会话索引"""
+        raise NotImplementedError
+
+    def load_summary(self, session_id: str, chunk_index: int) -> Optional[Dict[str, Any]]:
+        """加载分片摘要，不存在时返回None"""
+        raise NotImplementedError
+
+    def save_rollup(self, session_id: str, level: int, node_index: int, rollup_data: Dict[str, Any]):
+        """保存上层汇总摘要（level>=2，第 node_index 个节点）并记入会话索引的 rollups"""
+        raise NotImplementedError
+
+    def load_rollup(self, session_id: str, level: int, node_index: int) -> Optional[Dict[str, Any]]:
+        """加载上层汇总摘要，不存在时返回None"""
+        raise NotImplementedError
+
+    def get_session_size(self, session_id: str) -> int:
+        """会话消息的字节数（按未压缩的JSON计），默认逐条序列化统计"""
+        total_messages = self.load_session_index(session_id)["total_messages"]
+        if not total_messages:
+            return 0
+        return sum(
+            len(json.dumps(msg, ensure_ascii=False).encode("utf-8")) + 1
+            for msg in self.load_messages(session_id, 1, total_messages)
+        )
+
+    def drop_chunk(self, session_id: str, chunk_index: int) -> int:
+        """删除分片的原始消息并在索引中标记为已压实（摘要保留），返回回收的字节数"""
+        raise NotImplementedError
+
+    def list_sessions(self) -> List[str]:
+        """列出所有会话"""
+        raise NotImplementedError
+
+    def flush(self):
+        """将缓冲中的数据写入持久存储"""
+        pass
+
+    def archive_cold_chunks(self, session_id: Optional[str] = None, idle_seconds: Optional[float] = None) -> Dict[str, int]:
+        """将已写满且长期未访问的分片转为压缩编码，不支持的后端不做处理"""
+        return {}
+
+    def get_stats(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """获取存储后端的统计信息"""
+        return {}
@@ -0,0 +1,87 @@
+# memory_vector_index.py
+import os, threading
+from typing import Dict, Any, List, Optional, Tuple
+from .memory_storage import MemoryStorage
+from .text_embedder import TextEmbedder
+from .vector_store import VectorStore
+
+# === 记忆向量检索 ===
+class MemoryVectorIndex:
+    """记忆消息的语义向量索引
+
+    每个会话一个 VectorStore，位于 {memory_path}/vectors/{session}，ID为消息编号。
+    save_message 时增量添加；索引落后于存储时查询前批量补齐。
+    依赖 NumPy，未安装时 MemoryManager 不创建该索引。
+    """
+
+    def __init__(self, memory_path: str, storage: MemoryStorage, embedder: Optional[TextEmbedder] = None):
+        self.memory_path = memory_path
+        self.storage = storage
+        self.embedder = embedder or TextEmbedder.create()
+        self.vectors_path = os.path.join(memory_path, "vectors")
+        os.makedirs(self.vectors_path, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _store(self, session_id: str) -> VectorStore:
+        return VectorStore.open(os.path.join(self.vectors_path, session_id), self.embedder.dim, self.embedder.name)
+
+    def add_messages(self, session_id: str, messages: List[Dict[str, Any]]):
+        """向量化并添加已保存的消息（需带 number），已存在的编号跳过"""
+        store = self._store(session_id)
+        messages = [
+            msg for msg in messages
+            if msg.get("number") is not None and not store.contains(str(msg["number"]))
+        ]
+        if not messages:
+            return
+        vectors = self.embedder.embed([str(msg.get("content", "")) for msg in messages])
+        store.add([str(msg["number"]) for msg in messages], vectors)
+
+    def add_message(self, session_id: str, message: Dict[str, Any]):
+        self.add_messages(session_id, [message])
+
+    def _catch_up(self, session_id: str, store: VectorStore):
+        """补齐存储中已有但尚未向量化的消息（删除过的消息不再补）"""
+        total_messages = self.storage.load_session_index(session_id)["total_messages"]
+        if len(store) + store.get_stats()["deleted_ids"] >= total_messages:
+            return
+        with self._lock:
+            missing = [
+                number for number in range(1, total_messages + 1)
+                if not store.contains(str(number)) and not store.is_deleted(str(number))
+            ]
+            batch_size = 256
+            for position in range(0, len(missing), batch_size):
+                batch = missing[position:position + batch_size]
+                messages = self.storage.load_messages(session_id, batch[0], batch[-1])
+                wanted = set(batch)
+                self.add_messages(session_id, [msg for msg in messages if msg.get("number") in wanted])
+
+    def rank(self, session_id: str, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """按与查询的余弦相似度排序，返回 [(消息编号, 相似度)]"""
+        if not query.strip():
+            return []
+        store = self._store(session_id)
+        self._catch_up(session_id, store)
+        query_vector = self.embedder.embed([query])[0]
+        return [(int(item_id), score) for item_id, score in store.search(query_vector, top_k)]
+
+    def delete_messages(self, session_id: str, numbers: List[int]):
+        """删除指定消息的向量"""
+        self._store(session_id).delete([str(number) for number in numbers])
+
+    def compact(self, session_id: str):
+        """回收会话中已删除向量占用的空间"""
+        store = self._store(session_id)
+        if store.get_stats()["deleted_rows"]:
+            store.compact()
+
+    def drop_session(self, session_id: str):
+        """清空会话的向量"""
+        self._store(session_id).clear()
+
+    def get_stats(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        stats = {"embedder": self.embedder.name}
+        if session_id:
+            stats.update(self._store(session_id).get_stats())
+        return stats
@@ -1,16 +1,32 @@
 # novel_generator.py
-import os, json, time
-from typing import List, Dict, Any, Optional
+import os, json, time, asyncio
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Union, Tuple, Callable
 from .state_manager import StateManager
 from .memory_manager import MemoryManager
 from .llm_caller import LLMCaller
 from .chapter_state import ChapterState
+from .token_budgeter import TokenBudgeter
+from .llm_batch import LLMBatch
+
+DEFAULT_UPDATE_STATE_PROMPT = """
+你是一个精确的数据分析助手。你的任务是比较一个旧的JSON状态和一段新的小说章节内容，然后生成一个更新后的JSON对象。
+**规则:**
+1.  **以旧JSON为基础**: 完全基于我提供的旧JSON状态进行修改。
+2.  **从新章节提取变化**: 阅读新的小说章节，找出所有导致状态变化的事件，例如：主角等级、属性提升；获得或失去了新物品；学会了新技能或功法；人际关系发生变化；解锁了新的任务或目标。
+3.  **更新数值与描述**: 精确地更新JSON文件中的数值和描述文字。例如，"level"字段要根据小说内容合理提升。
+4.  **添加新条目**: 如果有新物品或新人物关系，就在对应的数组中添加新的对象。
+5.  **更新剧情总结**: 修改 `current_plot_summary` 字段，简要概括本章发生的核心事件。
+6.  **严格遵守格式**: 你的输出必须严格遵循下面提供的JSON格式，不包含任何解释性文字或代码块标记。
+"""
 
 # === 小说生成器 ===
 class NovelGenerator:
-    def __init__(self, chunk_size: int = 100):
+    # memory_mode="relevant" 时保留的最近消息数（近期章节很长，窗口过大会占满召回预算）
+    recall_recent_count: int = 5
+
+    def __init__(self, chunk_size: int = 100, memory_backend: str = "file"):
         self.state_manager = StateManager()
-        self.memory_manager = MemoryManager(chunk_size=chunk_size)
+        self.memory_manager = MemoryManager(chunk_size=chunk_size, backend=memory_backend)
 
     def generate_chapter(
         self,
@@ -28,17 +44,223 @@ class NovelGenerator:
         compression_model: str = "deepseek_chat",
         read_compressed: bool = False,
         novel_id: Optional[str] = None,
-        use_novel_outline : bool = True
-    ) -> str:
-        messages = []
+        use_novel_outline : bool = True,
+        stream: bool = False,
+        use_cache: bool = False,
+        return_token_report: bool = False,
+        memory_mode: str = "recent",
+        recall_token_budget: Optional[int] = None
+    ) -> Union[str, Iterator[str], Tuple[Any, Dict[str, Any]]]:
+        """生成章节
+
+        stream=True 时返回逐段产出文本的生成器，记忆保存、章节保存和状态更新
+        在生成器迭代结束后执行。use_cache=True 时相同提示词直接复用缓存的响应
+        （流式模式不走缓存）。return_token_report=True 时返回 (结果, token_report)，
+        token_report 为按模型上下文预算裁剪后的各部分token统计。
+        memory_mode="relevant" 时按章节细纲和关键词从全部记忆中召回相关消息和摘要
+        （不超过 recall_token_budget），只保留最近 recall_recent_count 条消息（不超过 recent_count），
+        世界设定也会补充语义相近的条目；
+        默认 "recent" 只加载最近 recent_count 条消息。
+        """
+        messages, token_report = self._prepare_chapter_messages(
+            chapter_outline, outline_key_words, system_prompt, use_memory, session_id,
+            use_state, use_world_bible, recent_count, use_compression, compression_model,
+            read_compressed, novel_id, use_novel_outline, model_name,
+            memory_mode=memory_mode, recall_token_budget=recall_token_budget
+        )
+        
+        if stream:
+            token_stream = self._stream_chapter(
+                messages, chapter_outline, model_name, use_memory, session_id, use_state,
+                update_state, use_compression, compression_model, novel_id
+            )
+            return (token_stream, token_report) if return_token_report else token_stream
+        
+        # 调用LLM
+        response = LLMCaller.call(messages, model_name, use_cache=use_cache)
+        #response = "".join(msg['content'] for msg in messages if 'content' in msg)
+        print(response)
+        self._finish_chapter(
+            response, chapter_outline, use_memory, session_id, use_compression,
+            compression_model, novel_id
+        )
+        
+        #状态更新 - 如果启用状态更新且使用了状态
+        if update_state and use_state:
+            self._update_state_after_chapter(response, model_name, novel_id)
+        
+        return (response, token_report) if return_token_report else response
+
+    def _stream_chapter(
+        self,
+        messages: List[Dict[str, Any]],
+        chapter_outline: str,
+        model_name: str,
+        use_memory: bool,
+        session_id: str,
+        use_state: bool,
+        update_state: bool,
+        use_compression: bool,
+        compression_model: str,
+        novel_id: Optional[str]
+    ) -> Iterator[str]:
+        """流式生成章节，流结束后再执行收尾处理"""
+        parts = []
+        for token in LLMCaller.stream(messages, model_name):
+            parts.append(token)
+            yield token
+        
+        response = "".join(parts)
+        self._finish_chapter(
+            response, chapter_outline, use_memory, session_id, use_compression,
+            compression_model, novel_id
+        )
+        
+        if update_state and use_state:
+            self._update_state_after_chapter(response, model_name, novel_id)
+
+    async def agenerate_chapter(
+        self,
+        chapter_outline: str,
+        outline_key_words:list[str] = [""],
+        model_name: str = "deepseek_chat",
+        system_prompt: str = "",
+        use_memory: bool = False,
+        session_id: str = "default",
+        use_state: bool = True,
+        use_world_bible: bool = True,
+        update_state: bool = False,
+        recent_count: int = 20,
+        use_compression: bool = False,
+        compression_model: str = "deepseek_chat",
+        read_compressed: bool = False,
+        novel_id: Optional[str] = None,
+        use_novel_outline : bool = True,
+        stream: bool = False,
+        use_cache: bool = False,
+        return_token_report: bool = False,
+        memory_mode: str = "recent",
+        recall_token_budget: Optional[int] = None
+    ) -> Union[str, AsyncIterator[str], Tuple[Any, Dict[str, Any]]]:
+        """generate_chapter 的异步版本，本地文件读写放到线程中执行
+
+        stream=True 时返回异步生成器，收尾处理在迭代结束后执行；
+        return_token_report=True 时返回 (结果, token_report)，与同步版本一致。
+        """
+        messages, token_report = await asyncio.to_thread(
+            self._prepare_chapter_messages,
+            chapter_outline, outline_key_words, system_prompt, use_memory, session_id,
+            use_state, use_world_bible, recent_count, use_compression, compression_model,
+            read_compressed, novel_id, use_novel_outline, model_name,
+            memory_mode=memory_mode, recall_token_budget=recall_token_budget
+        )
+        
+        if stream:
+            token_stream = self._astream_chapter(
+                messages, chapter_outline, model_name, use_memory, session_id, use_state,
+                update_state, use_compression, compression_model, novel_id
+            )
+            return (token_stream, token_report) if return_token_report else token_stream
+        
+        response = await LLMCaller.acall(messages, model_name, use_cache=use_cache)
+        await asyncio.to_thread(
+            self._finish_chapter,
+            response, chapter_outline, use_memory, session_id, use_compression,
+            compression_model, novel_id
+        )
+        
+        if update_state and use_state:
+            await self._aupdate_state_after_chapter(response, model_name, novel_id)
+        
+        return (response, token_report) if return_token_report else response
+
+    async def _astream_chapter(
+        self,
+        messages: List[Dict[str, Any]],
+        chapter_outline: str,
+        model_name: str,
+        use_memory: bool,
+        session_id: str,
+        use_state: bool,
+        update_state: bool,
+        use_compression: bool,
+        compression_model: str,
+        novel_id: Optional[str]
+    ) -> AsyncIterator[str]:
+        """_stream_chapter 的异步版本"""
+        parts = []
+        async for token in LLMCaller.astream(messages, model_name):
+            parts.append(token)
+            yield token
+        
+        response = "".join(parts)
+        await asyncio.to_thread(
+            self._finish_chapter,
+            response, chapter_outline, use_memory, session_id, use_compression,
+            compression_model, novel_id
+        )
+        
+        if update_state and use_state:
+            await self._aupdate_state_after_chapter(response, model_name, novel_id)
+
+    async def _aupdate_state_after_chapter(self, response: str, model_name: str, novel_id: Optional[str]):
+        """_update_state_after_chapter 的异步版本"""
+        current_state = await asyncio.to_thread(self.state_manager.load_latest_state, novel_id)
+        if current_state:
+            print(f"正在更新状态...")
+            try:
+                await self.aupdate_state(
+                    chapter_content=response,
+                    current_state=current_state,
+                    model_name=model_name,
+                    novel_id=novel_id,
+                    system_prompt=self._load_update_state_prompt()
+                )
+                print(f"状态更新完成，新状态已保存")
+            except Exception as e:
+                print(f"状态更新失败: {e}")
+
+    def _prepare_chapter_messages(
+        self,
+        chapter_outline: str,
+        outline_key_words: list[str],
+        system_prompt: str,
+        use_memory: bool,
+        session_id: str,
+        use_state: bool,
+        use_world_bible: bool,
+        recent_count: int,
+        use_compression: bool,
+        compression_model: str,
+        read_compressed: bool,
+        novel_id: Optional[str],
+        use_novel_outline: bool,
+        model_name: str = "deepseek_chat",
+        memory_mode: str = "recent",
+        recall_token_budget: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """组装章节生成的消息列表（按模型上下文预算裁剪），并将用户消息写入记忆
+
+        返回 (messages, token_report)
+        """
+        system_messages = []
         #print("get Key Words:" + "，".join(outline_key_words))
         #print("1")
         # 添加系统提示
         if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
+            system_messages.append({"role": "system", "content": system_prompt})
         #print("12")
         # 加载历史记录
-        if use_memory and recent_count > 0:
+        history_messages = []
+        recall_query = f"{chapter_outline} {' '.join(outline_key_words)}"
+        if use_memory and memory_mode == "relevant":
+            history_messages = self.memory_manager.recall_messages(
+                session_id=session_id,
+                query=recall_query,
+                token_budget=recall_token_budget,
+                recent_count=min(recent_count, self.recall_recent_count)
+            )
+        elif use_memory and recent_count > 0:
             history_messages = self.memory_manager.load_recent_messages(
                 session_id=session_id,
                 count=recent_count,
@@ -46,70 +268,173 @@ class NovelGenerator:
                 compression_model=compression_model,
                 read_compressed=read_compressed
             )
-            messages.extend(history_messages)
         #print("13")
-        # 构建用户输入 - 使用更自然的提示词表达
-        user_content = f"\n\n请根据下面的章节细纲进行小说内容创作：\n\n章节细纲：{chapter_outline}"
-        user_content += f"\n\n 我会为你提供一些参考资料，但是你创作时只限于章节细纲的内容\n\n===参考信息==="
+        # 加载参考信息
+        references = {}
         if use_novel_outline :
-            novel_outline = self.state_manager.load_novel_outline(novel_id)
-            if novel_outline:
-                user_content += f"\n\n小说大纲：{json.dumps(novel_outline, ensure_ascii=False, indent=2)}" 
+            references["novel_outline"] = self.state_manager.load_novel_outline(novel_id)
             stage_name = ""
-            stage_outline = self.state_manager.load_stage_outline(novel_id)
-            if stage_outline:
-                user_content += f"\n\n每个阶段细纲：{json.dumps(stage_outline, ensure_ascii=False, indent=2)}"
+            references["stage_outline"] = self.state_manager.load_stage_outline(novel_id)
 
         if use_state:
             state = self.state_manager.load_latest_state(novel_id)
             if state:
-                user_content += f"\n\n当前状态：{state.model_dump_json(indent=2)}"
+                references["state"] = state.model_dump_json(indent=2)
         
         if use_world_bible:
-            world_bible = self.state_manager.load_world_bible(outline_key_words,novel_id)
-            if world_bible:
-                user_content += f"\n\n相关世界设定：{json.dumps(world_bible, ensure_ascii=False, indent=2)}"
-        user_content += f"\n\n ===参考信息===end\n"
+            references["world_bible"] = self.state_manager.load_world_bible(
+                outline_key_words, novel_id,
+                semantic_query=recall_query if memory_mode == "relevant" else None
+            )
+
+        # 按上下文预算裁剪
+        history_messages, references, token_report = self._fit_chapter_context(
+            TokenBudgeter(model_name), system_messages, history_messages,
+            chapter_outline, outline_key_words, references
+        )
+        print(f"提示词token: {token_report['total']}/{token_report['budget']}")
+
+        user_content = "".join(self._render_chapter_sections(chapter_outline, references).values())
         user_message = {"role": "user", "content": user_content}
-        messages.append(user_message)
+        messages = system_messages + history_messages + [user_message]
         
         # 保存用户消息到记忆
         if use_memory:
             self.memory_manager.save_message(session_id, user_message)
         
-        # 调用LLM
-        response = LLMCaller.call(messages, model_name)
-        #response = "".join(msg['content'] for msg in messages if 'content' in msg)
-        print(response)
+        return messages, token_report
+
+    def _render_chapter_sections(self, chapter_outline: str, references: Dict[str, Any]) -> Dict[str, str]:
+        """按顺序渲染用户输入的各个部分，拼接后即为完整的用户消息"""
+        # 构建用户输入 - 使用更自然的提示词表达
+        sections = {}
+        sections["chapter_outline"] = (
+            f"\n\n请根据下面的章节细纲进行小说内容创作：\n\n章节细纲：{chapter_outline}"
+            f"\n\n 我会为你提供一些参考资料，但是你创作时只限于章节细纲的内容\n\n===参考信息==="
+        )
+        if references.get("novel_outline"):
+            sections["novel_outline"] = f"\n\n小说大纲：{json.dumps(references['novel_outline'], ensure_ascii=False, indent=2)}"
+        if references.get("stage_outline"):
+            sections["stage_outline"] = f"\n\n每个阶段细纲：{json.dumps(references['stage_outline'], ensure_ascii=False, indent=2)}"
+        if references.get("state"):
+            sections["state"] = f"\n\n当前状态：{references['state']}"
+        if references.get("world_bible"):
+            sections["world_bible"] = f"\n\n相关世界设定：{json.dumps(references['world_bible'], ensure_ascii=False, indent=2)}"
+        sections["end"] = f"\n\n ===参考信息===end\n"
+        return sections
+
+    def _fit_chapter_context(
+        self,
+        budgeter: TokenBudgeter,
+        system_messages: List[Dict[str, Any]],
+        history_messages: List[Dict[str, Any]],
+        chapter_outline: str,
+        outline_key_words: list[str],
+        references: Dict[str, Any]
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any], Dict[str, Any]]:
+        """按优先级裁剪上下文，使提示词不超过模型预算
+
+        裁剪顺序：先丢弃最早的历史消息，再按与章节细纲的相关性剔除世界设定条目，
+        最后精简大纲（去掉阶段细纲、去掉大纲的阶段列表、去掉整个大纲）。
+        返回 (history_messages, references, token_report)
+        """
+        budget = budgeter.max_prompt_tokens
+        history = list(history_messages)
+        references = dict(references)
+        trimmed = {"history_messages": 0, "world_bible_entries": 0, "outline": []}
+
+        system_tokens = budgeter.count_messages(system_messages)
+        history_costs = [budgeter.count_message(msg) for msg in history]
+
+        def measure():
+            section_tokens = {
+                name: budgeter.count(text)
+                for name, text in self._render_chapter_sections(chapter_outline, references).items()
+            }
+            total = system_tokens + sum(history_costs) + sum(section_tokens.values()) + budgeter.MESSAGE_OVERHEAD
+            return section_tokens, total
+
+        section_tokens, total = measure()
+
+        # 1. 历史消息：从最早的开始丢弃
+        while total > budget and history:
+            total -= history_costs.pop(0)
+            history.pop(0)
+            trimmed["history_messages"] += 1
+
+        # 2. 世界设定：按相关性从低到高剔除条目
+        world_bible = references.get("world_bible")
+        related = dict((world_bible or {}).get("related_settings") or {})
+        if total > budget and related:
+            query = f"{chapter_outline} {' '.join(outline_key_words)}"
+            ranked = sorted(related, key=lambda name: TokenBudgeter.relevance(f"{name} {related[name]}", query))
+            while total > budget and ranked:
+                # 先按条目的估算大小批量剔除，再整体重新计算
+                excess = total - budget
+                while excess > 0 and ranked:
+                    name = ranked.pop(0)
+                    excess -= budgeter.count(json.dumps({name: related.pop(name)}, ensure_ascii=False, indent=2))
+                    trimmed["world_bible_entries"] += 1
+                references["world_bible"] = {**world_bible, "related_settings": dict(related)}
+                section_tokens, total = measure()
+
+        # 3. 大纲细节
+        if total > budget and references.get("stage_outline"):
+            references["stage_outline"] = None
+            trimmed["outline"].append("stage_outline")
+            section_tokens, total = measure()
+        if total > budget and references.get("novel_outline") and "story_stage" in references["novel_outline"]:
+            references["novel_outline"] = {
+                key: value for key, value in references["novel_outline"].items() if key != "story_stage"
+            }
+            trimmed["outline"].append("novel_outline.story_stage")
+            section_tokens, total = measure()
+        if total > budget and references.get("novel_outline"):
+            references["novel_outline"] = None
+            trimmed["outline"].append("novel_outline")
+            section_tokens, total = measure()
+
+        sections = {"system": system_tokens, "history": sum(history_costs)}
+        for name, tokens in section_tokens.items():
+            # 结尾标记计入章节细纲部分
+            key = "chapter_outline" if name == "end" else name
+            sections[key] = sections.get(key, 0) + tokens
+
+        token_report = {
+            "model_name": budgeter.model_name,
+            "tokenizer": budgeter.tokenizer_name,
+            "context_window": budgeter.context_window,
+            "reserved_output": budgeter.reserved_output,
+            "budget": budget,
+            "total": total,
+            "sections": sections,
+            "trimmed": trimmed,
+            "over_budget": total > budget
+        }
+        return history, references, token_report
+
+    def _finish_chapter(
+        self,
+        response: str,
+        chapter_outline: str,
+        use_memory: bool,
+        session_id: str,
+        use_compression: bool,
+        compression_model: str,
+        novel_id: Optional[str]
+    ):
+        """章节生成完成后的处理：写入记忆、自动压缩、保存章节文件"""
         # 保存AI回复到记忆
         if use_memory:
             ai_message = {"role": "assistant", "content": response}
             self.memory_manager.save_message(session_id, ai_message)
             
-            # 如果启用压缩，自动压缩最新的分片
+            # 如果启用压缩，将写满的分片交给后台压缩队列，不阻塞本次生成
             if use_compression:
                 try:
-                    # 获取当前会话的统计信息
-                    stats = self.memory_manager.get_session_stats(session_id)
-                    total_chunks = stats.get("total_chunks", 0)
-                    
-                    # 压缩最新的分片（如果存在且未压缩）
-                    if total_chunks > 0:
-                        index_data = self.memory_manager.index_manager.load_session_index(session_id)
-                        compressed_chunks = len(index_data.get("summaries", {}))
-                        
-                        # 如果有未压缩的分片，压缩最新的一个
-                        if total_chunks > compressed_chunks:
-                            latest_chunk = total_chunks
-                            success = self.memory_manager.compress_chunk(
-                                session_id=session_id,
-                                chunk_index=latest_chunk,
-                                model_name=compression_model
-                            )
-                            if success:
-                                print(f"自动压缩分片 {latest_chunk} 成功")
-                            else:
-                                print(f"自动压缩分片 {latest_chunk} 失败")
+                    enqueued = self.memory_manager.enqueue_finished_chunks(session_id, compression_model)
+                    if enqueued:
+                        print(f"分片 {enqueued} 已加入后台压缩队列")
                 except Exception as e:
                     print(f"自动压缩失败: {e}")
         #print("14")
@@ -118,32 +443,33 @@ class NovelGenerator:
         if chapter_index is not None:
             self._save_chapter(response, chapter_index, novel_id)
         #print("15")
-        #状态更新 - 如果启用状态更新且使用了状态
-        if update_state and use_state:
-            current_state = self.state_manager.load_latest_state(novel_id)
-            if current_state:
-                print(f"正在更新状态...")
-                try:
-                    # 读取状态更新规则
-                    update_rules_file = os.path.join("./prompts", "update_state_rules.txt")
-                    update_system_prompt = ""
-                    if os.path.exists(update_rules_file):
-                        with open(update_rules_file, 'r', encoding='utf-8') as f:
-                            update_system_prompt = f.read().strip()
-                    
-                    # 调用状态更新
-                    new_state = self.update_state(
-                        chapter_content=response,
-                        current_state=current_state,
-                        model_name=model_name,
-                        novel_id=novel_id,
-                        system_prompt=update_system_prompt
-                    )
-                    print(f"状态更新完成，新状态已保存")
-                except Exception as e:
-                    print(f"状态更新失败: {e}")
-        
-        return response
+
+    def _update_state_after_chapter(self, response: str, model_name: str, novel_id: Optional[str]):
+        """根据新章节内容更新并保存状态"""
+        current_state = self.state_manager.load_latest_state(novel_id)
+        if current_state:
+            print(f"正在更新状态...")
+            try:
+                # 调用状态更新
+                new_state = self.update_state(
+                    chapter_content=response,
+                    current_state=current_state,
+                    model_name=model_name,
+                    novel_id=novel_id,
+                    system_prompt=self._load_update_state_prompt()
+                )
+                print(f"状态更新完成，新状态已保存")
+            except Exception as e:
+                print(f"状态更新失败: {e}")
+
+    def _load_update_state_prompt(self) -> str:
+        """读取状态更新规则"""
+        update_rules_file = os.path.join("./prompts", "update_state_rules.txt")
+        update_system_prompt = ""
+        if os.path.exists(update_rules_file):
+            with open(update_rules_file, 'r', encoding='utf-8') as f:
+                update_system_prompt = f.read().strip()
+        return update_system_prompt
 
     def update_state(
         self,
@@ -151,17 +477,32 @@ class NovelGenerator:
         current_state: ChapterState,
         model_name: str = "deepseek_chat",
         novel_id: Optional[str] = None,
-        system_prompt: str = """
-你是一个精确的数据分析助手。你的任务是比较一个旧的JSON状态和一段新的小说章节内容，然后生成一个更新后的JSON对象。
-**规则:**
-1.  **以旧JSON为基础**: 完全基于我提供的旧JSON状态进行修改。
-2.  **从新章节提取变化**: 阅读新的小说章节，找出所有导致状态变化的事件，例如：主角等级、属性提升；获得或失去了新物品；学会了新技能或功法；人际关系发生变化；解锁了新的任务或目标。
-3.  **更新数值与描述**: 精确地更新JSON文件中的数值和描述文字。例如，"level"字段要根据小说内容合理提升。
-4.  **添加新条目**: 如果有新物品或新人物关系，就在对应的数组中添加新的对象。
-5.  **更新剧情总结**: 修改 `current_plot_summary` 字段，简要概括本章发生的核心事件。
-6.  **严格遵守格式**: 你的输出必须严格遵循下面提供的JSON格式，不包含任何解释性文字或代码块标记。
-"""
+        system_prompt: str = DEFAULT_UPDATE_STATE_PROMPT
+    ) -> ChapterState:
+        messages = self._build_update_state_messages(chapter_content, current_state, system_prompt)
+        response = LLMCaller.call(messages, model_name, use_cache=True)
+        return self._apply_state_response(response, current_state, novel_id)
+
+    async def aupdate_state(
+        self,
+        chapter_content: str,
+        current_state: ChapterState,
+        model_name: str = "deepseek_chat",
+        novel_id: Optional[str] = None,
+        system_prompt: str = DEFAULT_UPDATE_STATE_PROMPT
     ) -> ChapterState:
+        """update_state 的异步版本"""
+        messages = self._build_update_state_messages(chapter_content, current_state, system_prompt)
+        response = await LLMCaller.acall(messages, model_name, use_cache=True)
+        return await asyncio.to_thread(self._apply_state_response, response, current_state, novel_id)
+
+    def _build_update_state_messages(
+        self,
+        chapter_content: str,
+        current_state: ChapterState,
+        system_prompt: str
+    ) -> List[Dict[str, Any]]:
+        """组装状态更新的消息列表"""
         messages = []
 
         if system_prompt:
@@ -178,9 +519,15 @@ class NovelGenerator:
 请根据以上信息，生成更新后的JSON对象：
 """
         messages.append({"role": "user", "content": user_content})
-        
-        response = LLMCaller.call(messages, model_name)
-        
+        return messages
+
+    def _apply_state_response(
+        self,
+        response: str,
+        current_state: ChapterState,
+        novel_id: Optional[str]
+    ) -> ChapterState:
+        """解析LLM返回的状态JSON并保存，失败时返回原状态"""
         try:
             # 提取JSON
             import re
@@ -205,8 +552,64 @@ class NovelGenerator:
         recent_count: int = 20,
         use_compression: bool = False,
         compression_model: str = "deepseek_chat",
-        save_conversation: bool = True
+        save_conversation: bool = True,
+        hedge: bool = False
+    ) -> str:
+        messages = self._prepare_chat_messages(
+            user_input, system_prompt, session_id, use_memory, recent_count,
+            use_compression, compression_model, save_conversation
+        )
+        
+        # 调用LLM（hedge=True 时对慢请求发出对冲副本）
+        response = LLMCaller.call(messages, model_name, hedge=hedge)
+        
+        # 保存AI回复
+        if save_conversation:
+            ai_message = {"role": "assistant", "content": response}
+            self.memory_manager.save_message(session_id, ai_message)
+        
+        return response
+
+    async def achat(
+        self,
+        user_input: str,
+        model_name: str = "deepseek_chat",
+        system_prompt: str = "",
+        session_id: str = "default",
+        use_memory: bool = True,
+        recent_count: int = 20,
+        use_compression: bool = False,
+        compression_model: str = "deepseek_chat",
+        save_conversation: bool = True,
+        hedge: bool = False
     ) -> str:
+        """chat 的异步版本"""
+        messages = await asyncio.to_thread(
+            self._prepare_chat_messages,
+            user_input, system_prompt, session_id, use_memory, recent_count,
+            use_compression, compression_model, save_conversation
+        )
+        
+        response = await LLMCaller.acall(messages, model_name, hedge=hedge)
+        
+        if save_conversation:
+            ai_message = {"role": "assistant", "content": response}
+            await asyncio.to_thread(self.memory_manager.save_message, session_id, ai_message)
+        
+        return response
+
+    def _prepare_chat_messages(
+        self,
+        user_input: str,
+        system_prompt: str,
+        session_id: str,
+        use_memory: bool,
+        recent_count: int,
+        use_compression: bool,
+        compression_model: str,
+        save_conversation: bool
+    ) -> List[Dict[str, Any]]:
+        """组装对话消息列表，并保存用户消息"""
         messages = []
         
         # 添加系统提示
@@ -231,15 +634,7 @@ class NovelGenerator:
         if save_conversation:
             self.memory_manager.save_message(session_id, user_message)
         
-        # 调用LLM
-        response = LLMCaller.call(messages, model_name)
-        
-        # 保存AI回复
-        if save_conversation:
-            ai_message = {"role": "assistant", "content": response}
-            self.memory_manager.save_message(session_id, ai_message)
-        
-        return response
+        return messages
 
 
     
@@ -278,18 +673,47 @@ class NovelGenerator:
     def batch_compress_memory(
         self,
         session_id: str,
-        chunk_indices: List[int],
+        chunk_indices: Optional[List[int]] = None,
         model_name: str = "deepseek_chat",
-        compression_prompt: str = ""
+        compression_prompt: str = "",
+        max_workers: int = 4,
+        force: bool = False,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
     ) -> Dict[int, bool]:
-        """批量压缩记忆分片"""
+        """批量并行压缩记忆分片（chunk_indices 为None时压缩全部分片，已有最新摘要的分片跳过）"""
         return self.memory_manager.batch_compress_chunks(
             session_id=session_id,
             chunk_indices=chunk_indices,
             model_name=model_name,
-            compression_prompt=compression_prompt
+            compression_prompt=compression_prompt,
+            max_workers=max_workers,
+            force=force,
+            progress_callback=progress_callback
         )
     
+    def search_memory(self, session_id: str, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+        """全文检索记忆（BM25），返回消息编号、分数和片段"""
+        return self.memory_manager.search_messages(session_id, query, top_k)
+    
+    def list_memory_sessions(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = 50,
+        sort_by: str = "last_updated",
+        descending: bool = True
+    ) -> Dict[str, Any]:
+        """分页列出记忆会话及其汇总信息"""
+        return self.memory_manager.list_session_summaries(offset, limit, sort_by, descending)
+    
+    def compact_memory(
+        self,
+        policy: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+        dry_run: bool = False
+    ) -> Dict[str, Any]:
+        """按保留策略压实记忆，已有摘要的旧分片只保留摘要"""
+        return self.memory_manager.compact_sessions(policy, session_id, dry_run)
+    
     def get_memory_stats(self, session_id: str) -> Dict[str, Any]:
         """获取记忆统计信息"""
         return self.memory_manager.get_session_stats(session_id)
@@ -325,18 +749,29 @@ class NovelGenerator:
         system_prompt: str = "",
         novel_id: Optional[str] = None
     ) -> List[str]:
-        """生成多个版本的章节"""
-        versions = []
+        """生成多个版本的章节
+
+        提示词只组装一次，各版本通过 LLMBatch 一次提交；若有版本失败，
+        已完成的版本会保留在批量结果中，重新调用时只补齐失败的版本。
+        """
+        # 多版本生成时不使用记忆
+        messages, _ = self._prepare_chapter_messages(
+            chapter_outline, [""], system_prompt, False, "default",
+            True, True, 20, False, "deepseek_chat", False, novel_id, True, model_name
+        )
+        
+        print(f"正在生成 {num_versions} 个版本...")
+        requests = {f"version_{i+1}": messages for i in range(num_versions)}
+        results = LLMBatch.run(requests, model_name)
         
+        errors = [record["error"] for record in results.values() if record["error"] is not None]
+        if errors:
+            raise RuntimeError(f"{len(errors)} 个版本生成失败: {errors[0]}")
+        
+        versions = []
         for i in range(num_versions):
-            print(f"正在生成第 {i+1} 个版本...")
-            version = self.generate_chapter(
-                chapter_outline=chapter_outline,
-                model_name=model_name,
-                system_prompt=system_prompt,
-                use_memory=False,  # 多版本生成时不使用记忆
-                novel_id=novel_id
-            )
+            version = results[f"version_{i+1}"]["content"]
+            self._finish_chapter(version, chapter_outline, False, "default", False, "deepseek_chat", novel_id)
             versions.append(version)
         
         # 保存所有版本
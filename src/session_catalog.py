@@ -0,0 +1,121 @@
+# session_catalog.py
+import os, time, sqlite3, threading
+from typing import Dict, Any, List, Optional
+
+# === 会话目录 ===
+class SessionCatalog:
+    """会话目录 - 在 {memory_path}/catalog.db 中维护每个会话的汇总信息
+
+    每个会话一行：消息数、分片数、已压缩分片数、消息字节数（未压缩）、创建和更新时间。
+    写消息和保存摘要时增量更新，列出会话只需一次带排序和分页的查询，
+    不再扫描目录或逐个读取会话索引。目录为空时由 MemoryManager 从存储重建一次。
+    """
+
+    SORT_FIELDS = ("session_id", "total_messages", "chunk_count", "compressed_chunks", "bytes", "created_at", "last_updated")
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                total_messages INTEGER NOT NULL DEFAULT 0,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                compressed_chunks INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                last_updated REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_updated ON sessions (last_updated);"""
+        )
+
+    def record_write(self, session_id: str, total_messages: int, chunk_count: int, added_bytes: int):
+        """记录一次消息写入"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO sessions (session_id, total_messages, chunk_count, bytes, created_at, last_updated)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(session_id) DO UPDATE SET
+                       total_messages = MAX(total_messages, excluded.total_messages),
+                       chunk_count = MAX(chunk_count, excluded.chunk_count),
+                       bytes = bytes + excluded.bytes,
+                       last_updated = excluded.last_updated""",
+                (session_id, total_messages, chunk_count, added_bytes, now, now)
+            )
+
+    def record_compression(self, session_id: str, compressed_chunks: int):
+        """记录会话的已压缩分片数"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sessions SET compressed_chunks = ?, last_updated = ? WHERE session_id = ?",
+                (compressed_chunks, time.time(), session_id)
+            )
+
+    def upsert(self, entry: Dict[str, Any]):
+        """写入会话的完整汇总信息（重建时使用）"""
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO sessions
+                   (session_id, total_messages, chunk_count, compressed_chunks, bytes, created_at, last_updated)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                tuple(entry.get(field) for field in (
+                    "session_id", "total_messages", "chunk_count", "compressed_chunks", "bytes", "created_at", "last_updated"
+                ))
+            )
+
+    def remove(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None
+
+    @staticmethod
+    def _to_entry(row: tuple) -> Dict[str, Any]:
+        session_id, total_messages, chunk_count, compressed_chunks, size, created_at, last_updated = row
+        return {
+            "session_id": session_id,
+            "total_messages": total_messages,
+            "chunk_count": chunk_count,
+            "compressed_chunks": compressed_chunks,
+            "compression_coverage": round(compressed_chunks / chunk_count, 4) if chunk_count else 0.0,
+            "bytes": size,
+            "created_at": created_at,
+            "last_updated": last_updated
+        }
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.SORT_FIELDS)} FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return self._to_entry(row) if row else None
+
+    def list(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = 50,
+        sort_by: str = "last_updated",
+        descending: bool = True
+    ) -> Dict[str, Any]:
+        """分页列出会话
+
+        Returns:
+            {"total": 会话总数, "sessions": [会话汇总信息]}
+        """
+        if sort_by not in self.SORT_FIELDS:
+            raise ValueError(f"不支持的排序字段: {sort_by}")
+        order = "DESC" if descending else "ASC"
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            rows = self._conn.execute(
+                f"""SELECT {', '.join(self.SORT_FIELDS)} FROM sessions
+                    ORDER BY {sort_by} {order}, session_id LIMIT ? OFFSET ?""",
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return {"total": total, "sessions": [self._to_entry(row) for row in rows]}
@@ -1,7 +1,9 @@
-import os,json,re
+import os,json,re,hashlib
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
 from .world_setting import WorldSetting,BaseWorldSetting
+from .text_embedder import TextEmbedder
+from .vector_store import VectorStore
 
 class SettingExtractor:
     """
@@ -24,6 +26,7 @@ class SettingExtractor:
             if not isinstance(settings, dict):
                 raise ValueError("当提供 settings 时，settings 必须是 Dict[str, Any]")
             filepath = source
+            self.filepath = filepath
             self.settings = settings
 
         # 情况 B: 只传 source，视作 JSON 文件路径
@@ -69,6 +72,47 @@ class SettingExtractor:
         )
 
 
+    def get_similar_settings(
+        self,
+        query: str,
+        top_k: int = 10,
+        embedder: Optional[TextEmbedder] = None,
+        store_path: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        按语义相似度从 related_settings 中检索与 query 最相关的 top_k 条设定（需要 NumPy）。
+
+        设定向量保存在 store_path（默认为设定文件同目录下 vectors/{文件名}），
+        每次检索前按描述内容的哈希同步：新增或修改的条目重新向量化，已删除的条目移除。
+        """
+        if store_path is None:
+            if not self.filepath:
+                raise ValueError("没有关联文件路径的设定需要指定 store_path")
+            base_name = os.path.splitext(os.path.basename(self.filepath))[0]
+            store_path = os.path.join(os.path.dirname(self.filepath), "vectors", base_name)
+        embedder = embedder or TextEmbedder.create()
+        store = VectorStore.open(store_path, embedder.dim, embedder.name)
+
+        all_related_settings = self.settings.get("related_settings", {})
+        texts = {
+            name: f"{name} {json.dumps(description, ensure_ascii=False) if not isinstance(description, str) else description}"
+            for name, description in all_related_settings.items()
+        }
+        digests = {name: hashlib.sha1(text.encode("utf-8")).hexdigest() for name, text in texts.items()}
+        stale = [name for name in store.ids() if name not in texts]
+        if stale:
+            store.delete(stale)
+        changed = [name for name in texts if store.get_extra(name) != digests[name]]
+        if changed:
+            store.add(changed, embedder.embed([texts[name] for name in changed]), [digests[name] for name in changed])
+
+        query_vector = embedder.embed([query])[0]
+        return {
+            name: all_related_settings[name]
+            for name, score in store.search(query_vector, top_k)
+            if score > 0
+        }
+
     def to_json(self) -> str:
         """
         返回完整世界设定数据的 JSON 文本表示
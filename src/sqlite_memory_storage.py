@@ -0,0 +1,385 @@
+# sqlite_memory_storage.py
+import os, json, time, sqlite3, threading
+from typing import Dict, Any, List, Optional
+from .memory_storage import MemoryStorage
+from .memory_chunk_manager import MemoryChunkManager
+
+# === SQLite存储后端 ===
+class SQLiteMemoryStorage(MemoryStorage):
+    """SQLite存储后端（WAL模式）
+
+    消息按 (session_id, number) 主键存放，范围读取是一次索引查询；
+    追加消息在 BEGIN IMMEDIATE 事务中分配编号，多线程、多进程并发写入
+    不会得到重复编号。会话索引由 sessions/chunks/summaries/rollups/compacted_chunks
+    五张表即时汇总；chunks 表记录每个分片的末尾编号、消息数和最后写入时间，
+    与 messages 在同一事务中更新，读取索引不需要扫描消息。
+    """
+
+    def __init__(self, db_path: str, chunk_manager: MemoryChunkManager, fsync: bool = False):
+        super().__init__(chunk_manager)
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # 手动管理事务
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                total_messages INTEGER NOT NULL DEFAULT 0,
+                created_at REAL,
+                last_updated REAL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                timestamp REAL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (session_id, number)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS summaries (
+                session_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL,
+                PRIMARY KEY (session_id, chunk_index)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rollups (
+                session_id TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                node_index INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL,
+                PRIMARY KEY (session_id, level, node_index)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS compacted_chunks (
+                session_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                start_number INTEGER,
+                end_number INTEGER,
+                count INTEGER,
+                compacted_at REAL,
+                PRIMARY KEY (session_id, chunk_index)
+            ) WITHOUT ROWID;"""
+        )
+        self._transaction(self._create_chunks_table)
+        self._transaction(self._add_fallback_column)
+
+    def _add_fallback_column(self, conn):
+        """旧数据库的 summaries 表补上降级次数列"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(summaries)").fetchall()}
+        if "fallback_attempts" not in columns:
+            conn.execute("ALTER TABLE summaries ADD COLUMN fallback_attempts INTEGER NOT NULL DEFAULT 0")
+
+    @staticmethod
+    def _fallback_attempts(summary_data: Dict[str, Any]) -> int:
+        return summary_data.get("fallback_attempts", 1) if summary_data.get("fallback") else 0
+
+    def _create_chunks_table(self, conn):
+        """创建分片汇总表，旧数据库首次打开时从 messages 表回填"""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks'").fetchone()
+        if exists:
+            return
+        conn.execute(
+            """CREATE TABLE chunks (
+                session_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                end_number INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                updated_at REAL,
+                PRIMARY KEY (session_id, chunk_index)
+            ) WITHOUT ROWID"""
+        )
+        conn.execute(
+            """INSERT INTO chunks (session_id, chunk_index, end_number, count, updated_at)
+               SELECT session_id, chunk_index, MAX(number), COUNT(*), MAX(timestamp) FROM messages
+               GROUP BY session_id, chunk_index"""
+        )
+
+    def _transaction(self, fn):
+        """在写事务中执行 fn(conn)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        def insert(conn):
+            now = time.time()
+            row = conn.execute("SELECT total_messages FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO sessions (session_id, total_messages, created_at, last_updated) VALUES (?, 0, ?, ?)",
+                    (session_id, now, now)
+                )
+                total_messages = 0
+            else:
+                total_messages = row[0]
+
+            message_with_meta = {
+                "number": total_messages + 1,
+                "timestamp": now,
+                **message
+            }
+            chunk_index = self.chunk_manager.get_chunk_index(message_with_meta["number"])
+            conn.execute(
+                "INSERT INTO messages (session_id, number, chunk_index, timestamp, data) VALUES (?, ?, ?, ?, ?)",
+                (
+                    session_id, message_with_meta["number"], chunk_index,
+                    now, json.dumps(message_with_meta, ensure_ascii=False)
+                )
+            )
+            updated = conn.execute(
+                "UPDATE chunks SET end_number = ?, count = count + 1, updated_at = ? WHERE session_id = ? AND chunk_index = ?",
+                (message_with_meta["number"], now, session_id, chunk_index)
+            ).rowcount
+            if not updated:
+                conn.execute(
+                    "INSERT INTO chunks (session_id, chunk_index, end_number, count, updated_at) VALUES (?, ?, ?, 1, ?)",
+                    (session_id, chunk_index, message_with_meta["number"], now)
+                )
+            conn.execute(
+                "UPDATE sessions SET total_messages = ?, last_updated = ? WHERE session_id = ?",
+                (message_with_meta["number"], now, session_id)
+            )
+            return message_with_meta
+
+        return self._transaction(insert)
+
+    def load_session_index(self, session_id: str) -> Dict[str, Any]:
+        now = time.time()
+        index_data = {
+            "session_id": session_id,
+            "total_messages": 0,
+            "chunks": {},
+            "summaries": {},
+            "rollups": {},
+            "compacted": {},
+            "created_at": now,
+            "last_updated": now
+        }
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT total_messages, created_at, last_updated FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return index_data
+            chunk_rows = self._conn.execute(
+                "SELECT chunk_index, end_number, count, updated_at FROM chunks WHERE session_id = ?",
+                (session_id,)
+            ).fetchall()
+            summary_rows = self._conn.execute(
+                "SELECT chunk_index, created_at, fallback_attempts FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchall()
+            rollup_rows = self._conn.execute(
+                "SELECT level, node_index, created_at FROM rollups WHERE session_id = ?", (session_id,)
+            ).fetchall()
+            compacted_rows = self._conn.execute(
+                "SELECT chunk_index, start_number, end_number, count, compacted_at FROM compacted_chunks WHERE session_id = ?",
+                (session_id,)
+            ).fetchall()
+
+        index_data["total_messages"], index_data["created_at"], index_data["last_updated"] = row
+        for chunk_index, end, count, updated_at in chunk_rows:
+            start, _ = self.chunk_manager.get_chunk_range(chunk_index)
+            index_data["chunks"][str(chunk_index)] = {
+                "start": start,
+                "end": end,
+                "count": count,
+                "updated_at": updated_at
+            }
+        for chunk_index, created_at, fallback_attempts in summary_rows:
+            index_data["summaries"][str(chunk_index)] = {"created_at": created_at}
+            if fallback_attempts:
+                index_data["summaries"][str(chunk_index)]["fallback_attempts"] = fallback_attempts
+        for level, node_index, created_at in rollup_rows:
+            index_data["rollups"].setdefault(str(level), {})[str(node_index)] = {"created_at": created_at}
+        for chunk_index, start, end, count, compacted_at in compacted_rows:
+            index_data["compacted"][str(chunk_index)] = {
+                "start": start, "end": end, "count": count, "compacted_at": compacted_at
+            }
+            # 已压实的分片在 messages 表中没有行，补回分片信息
+            index_data["chunks"].setdefault(str(chunk_index), {
+                "start": start, "end": end, "count": count, "updated_at": compacted_at
+            })
+        return index_data
+
+    def load_chunk_messages(
+        self,
+        session_id: str,
+        chunk_index: int,
+        start_filter: Optional[int] = None,
+        end_filter: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        start, end = self.chunk_manager.get_chunk_range(chunk_index)
+        if start_filter is not None:
+            start = max(start, start_filter)
+        if end_filter is not None:
+            end = min(end, end_filter)
+        return self.load_messages(session_id, start, end)
+
+    def load_messages(self, session_id: str, start_msg: int, end_msg: int) -> List[Dict[str, Any]]:
+        rows = self._query(
+            "SELECT data FROM messages WHERE session_id = ? AND number BETWEEN ? AND ? ORDER BY number",
+            (session_id, start_msg, end_msg)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def save_summary(self, session_id: str, chunk_index: int, summary_data: Dict[str, Any]):
+        self._transaction(lambda conn: conn.execute(
+            """INSERT OR REPLACE INTO summaries (session_id, chunk_index, data, created_at, fallback_attempts)
+               VALUES (?, ?, ?, ?, ?)""",
+            (
+                session_id, chunk_index, json.dumps(summary_data, ensure_ascii=False), time.time(),
+                self._fallback_attempts(summary_data)
+            )
+        ))
+
+    def load_summary(self, session_id: str, chunk_index: int) -> Optional[Dict[str, Any]]:
+        rows = self._query(
+            "SELECT data FROM summaries WHERE session_id = ? AND chunk_index = ?", (session_id, chunk_index)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_rollup(self, session_id: str, level: int, node_index: int, rollup_data: Dict[str, Any]):
+        self._transaction(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO rollups (session_id, level, node_index, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, level, node_index, json.dumps(rollup_data, ensure_ascii=False), time.time())
+        ))
+
+    def load_rollup(self, session_id: str, level: int, node_index: int) -> Optional[Dict[str, Any]]:
+        rows = self._query(
+            "SELECT data FROM rollups WHERE session_id = ? AND level = ? AND node_index = ?",
+            (session_id, level, node_index)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def list_sessions(self) -> List[str]:
+        return [session_id for (session_id,) in self._query("SELECT session_id FROM sessions ORDER BY session_id")]
+
+    def drop_chunk(self, session_id: str, chunk_index: int) -> int:
+        """删除的页面由 SQLite 在后续写入中复用，不立即缩小数据库文件"""
+        def drop(conn):
+            start, end, count, size = conn.execute(
+                """SELECT MIN(number), MAX(number), COUNT(*), COALESCE(SUM(LENGTH(CAST(data AS BLOB))), 0)
+                   FROM messages WHERE session_id = ? AND chunk_index = ?""",
+                (session_id, chunk_index)
+            ).fetchone()
+            if count:
+                conn.execute(
+                    """INSERT OR REPLACE INTO compacted_chunks
+                       (session_id, chunk_index, start_number, end_number, count, compacted_at) VALUES (?, ?, ?, ?, ?, ?)""",
+                    (session_id, chunk_index, start, end, count, time.time())
+                )
+                conn.execute("DELETE FROM messages WHERE session_id = ? AND chunk_index = ?", (session_id, chunk_index))
+                conn.execute("DELETE FROM chunks WHERE session_id = ? AND chunk_index = ?", (session_id, chunk_index))
+            return size
+
+        return self._transaction(drop)
+
+    def get_session_size(self, session_id: str) -> int:
+        rows = self._query("SELECT COALESCE(SUM(LENGTH(CAST(data AS BLOB)) + 1), 0) FROM messages WHERE session_id = ?", (session_id,))
+        return rows[0][0]
+
+    def get_stats(self, session_id: Optional[str] = None) -> Dict[str, Any]:
+        return {"storage": "sqlite", "db_path": self.db_path}
+
+    def import_from(self, source: MemoryStorage, replace: bool = False) -> Dict[str, int]:
+        """从其他存储（如原JSON文件布局）批量导入全部会话
+
+        每个会话在一个事务中导入；已存在的会话默认跳过，replace=True 时覆盖。
+        Returns:
+            {会话ID: 导入的消息数}
+        """
+        imported = {}
+        existing = set(self.list_sessions())
+        for session_id in source.list_sessions():
+            if session_id in existing and not replace:
+                print(f"跳过已存在的会话: {session_id}")
+                continue
+
+            index_data = source.load_session_index(session_id)
+            total_messages = index_data["total_messages"]
+            messages = source.load_messages(session_id, 1, total_messages) if total_messages else []
+            summaries = {}
+            for chunk_key in index_data.get("summaries", {}):
+                summary = source.load_summary(session_id, int(chunk_key))
+                if summary is not None:
+                    summaries[int(chunk_key)] = summary
+            rollups = {}
+            for level, nodes in index_data.get("rollups", {}).items():
+                for node_key in nodes:
+                    rollup = source.load_rollup(session_id, int(level), int(node_key))
+                    if rollup is not None:
+                        rollups[(int(level), int(node_key))] = rollup
+
+            def write(conn, session_id=session_id, index_data=index_data, messages=messages, summaries=summaries, rollups=rollups):
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM chunks WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM compacted_chunks WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM rollups WHERE session_id = ?", (session_id,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, total_messages, created_at, last_updated) VALUES (?, ?, ?, ?)",
+                    (session_id, index_data["total_messages"], index_data.get("created_at"), index_data.get("last_updated"))
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO messages (session_id, number, chunk_index, timestamp, data) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            session_id, msg["number"], self.chunk_manager.get_chunk_index(msg["number"]),
+                            msg.get("timestamp"), json.dumps(msg, ensure_ascii=False)
+                        )
+                        for msg in messages if "number" in msg
+                    ]
+                )
+                conn.execute(
+                    """INSERT INTO chunks (session_id, chunk_index, end_number, count, updated_at)
+                       SELECT session_id, chunk_index, MAX(number), COUNT(*), MAX(timestamp) FROM messages
+                       WHERE session_id = ? GROUP BY chunk_index""",
+                    (session_id,)
+                )
+                conn.executemany(
+                    """INSERT OR REPLACE INTO summaries (session_id, chunk_index, data, created_at, fallback_attempts)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    [
+                        (
+                            session_id, chunk_index, json.dumps(summary, ensure_ascii=False), summary.get("created_at"),
+                            self._fallback_attempts(summary)
+                        )
+                        for chunk_index, summary in summaries.items()
+                    ]
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO rollups (session_id, level, node_index, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (session_id, level, node_index, json.dumps(rollup, ensure_ascii=False), rollup.get("created_at"))
+                        for (level, node_index), rollup in rollups.items()
+                    ]
+                )
+                conn.executemany(
+                    """INSERT OR REPLACE INTO compacted_chunks
+                       (session_id, chunk_index, start_number, end_number, count, compacted_at) VALUES (?, ?, ?, ?, ?, ?)""",
+                    [
+                        (session_id, int(chunk_key), info.get("start"), info.get("end"), info.get("count"), info.get("compacted_at"))
+                        for chunk_key, info in index_data.get("compacted", {}).items()
+                    ]
+                )
+
+            self._transaction(write)
+            imported[session_id] = len(messages)
+        return imported
@@ -0,0 +1,144 @@
+# state_file_cache.py
+import os, json, time, fnmatch, threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Hashable
+
+# === 数据文件解析缓存 ===
+class StateFileCache:
+    """状态、世界设定、大纲等数据文件的进程级解析缓存
+
+    文件以 (路径, mtime, 大小) 为键缓存解析后的JSON，以及由它派生的对象
+    （如校验后的 pydantic 模型），文件变化后一并失效。目录列表以目录的
+    mtime 为键缓存，同时缓存每个文件名模式的匹配结果，新建或删除文件后失效。
+    mtime 距读取时不足 racy_seconds 的文件或目录可能在同一时间戳内再次被修改，
+    这类条目每次都重新读取。缓存的对象在调用方之间共享，不应原地修改。
+    """
+
+    max_entries: int = 128
+    max_derived_per_file: int = 64
+    racy_seconds: float = 1.0
+
+    _entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    _dirs: Dict[str, Dict[str, Any]] = {}
+    _lock = threading.Lock()
+    _stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0, "listing_hits": 0, "listing_misses": 0}
+
+    @classmethod
+    def configure(cls, max_entries: Optional[int] = None, racy_seconds: Optional[float] = None):
+        """修改缓存上限，缩小时立即淘汰"""
+        with cls._lock:
+            if max_entries is not None:
+                cls.max_entries = max_entries
+            if racy_seconds is not None:
+                cls.racy_seconds = racy_seconds
+            cls._evict()
+
+    @classmethod
+    def _is_racy(cls, stat: os.stat_result) -> bool:
+        return time.time() - stat.st_mtime < cls.racy_seconds
+
+    @classmethod
+    def _evict(cls):
+        """按LRU淘汰到上限以内（调用方需持有锁）"""
+        while len(cls._entries) > cls.max_entries:
+            cls._entries.popitem(last=False)
+            cls._stats["evictions"] += 1
+
+    @classmethod
+    def _entry(cls, path: str) -> Dict[str, Any]:
+        """获取与当前文件一致的缓存条目，必要时重新解析"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with cls._lock:
+            entry = cls._entries.get(path)
+            if entry is not None and entry["signature"] == signature and not entry["racy"]:
+                cls._entries.move_to_end(path)
+                cls._stats["hits"] += 1
+                return entry
+            if entry is not None:
+                cls._stats["invalidations"] += 1
+            cls._stats["misses"] += 1
+
+        # stat 在读取前获取，读取期间文件被修改时下次会再次失效
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        entry = {"signature": signature, "racy": cls._is_racy(stat), "data": data, "derived": OrderedDict()}
+        with cls._lock:
+            cls._entries[path] = entry
+            cls._entries.move_to_end(path)
+            cls._evict()
+        return entry
+
+    @classmethod
+    def load_json(cls, path: str) -> Any:
+        """读取并解析JSON文件（共享对象）"""
+        return cls._entry(path)["data"]
+
+    @classmethod
+    def get_derived(cls, path: str, key: Hashable, factory: Callable[[Any], Any]) -> Any:
+        """获取由文件内容派生的对象，未缓存时调用 factory(解析后的JSON) 生成
+
+        factory 抛出的异常直接传给调用方，不缓存。
+        """
+        entry = cls._entry(path)
+        with cls._lock:
+            if key in entry["derived"]:
+                entry["derived"].move_to_end(key)
+                return entry["derived"][key]
+        value = factory(entry["data"])
+        with cls._lock:
+            entry["derived"][key] = value
+            while len(entry["derived"]) > cls.max_derived_per_file:
+                entry["derived"].popitem(last=False)
+        return value
+
+    @classmethod
+    def match(cls, directory: str, pattern: str) -> List[str]:
+        """列出目录中匹配文件名模式的文件路径（与 glob 一致，忽略以点开头的文件）"""
+        key = os.path.abspath(directory)
+        stat = os.stat(key)
+        with cls._lock:
+            listing = cls._dirs.get(key)
+            if listing is not None and listing["mtime_ns"] == stat.st_mtime_ns and not listing["racy"]:
+                matches = listing["matches"].get(pattern)
+                if matches is not None:
+                    cls._stats["listing_hits"] += 1
+                    return [os.path.join(directory, name) for name in matches]
+            else:
+                listing = None
+            cls._stats["listing_misses"] += 1
+
+        if listing is None:
+            names = [name for name in os.listdir(key) if not name.startswith('.')]
+            listing = {"mtime_ns": stat.st_mtime_ns, "racy": cls._is_racy(stat), "names": names, "matches": {}}
+        matches = fnmatch.filter(listing["names"], pattern)
+        with cls._lock:
+            listing["matches"][pattern] = matches
+            cls._dirs[key] = listing
+        return [os.path.join(directory, name) for name in matches]
+
+    @classmethod
+    def invalidate(cls, path: str):
+        """使文件及其所在目录的缓存失效"""
+        path = os.path.abspath(path)
+        with cls._lock:
+            cls._entries.pop(path, None)
+            cls._dirs.pop(os.path.dirname(os.path.abspath(path)), None)
+
+    @classmethod
+    def clear(cls):
+        """清空缓存"""
+        with cls._lock:
+            cls._entries.clear()
+            cls._dirs.clear()
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, Any]:
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats["cached_files"] = len(cls._entries)
+            stats["cached_dirs"] = len(cls._dirs)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -1,12 +1,21 @@
 # state_manager.py
-import os, json, glob, re, time
+import os, json, re, time, copy
 from typing import Dict, Any, List, Optional
 from .chapter_state import ChapterState
 from .setting_extractor import SettingExtractor
+from .text_embedder import TextEmbedder
 from pydantic import BaseModel
 from .outline_manager import OutlineManager
+from .state_file_cache import StateFileCache
 
 class StateManager:
+    """状态、世界设定和大纲文件的读写
+
+    目录列表和文件解析结果通过 StateFileCache 在进程内缓存，数据未变化时
+    重复加载不再扫描目录和重新解析。返回的模型和字典为缓存对象的深拷贝，
+    调用方可以随意修改。
+    """
+
     def __init__(self, data_path: str = "./data"):
         self.data_path = data_path
         os.makedirs(self.data_path, exist_ok=True)
@@ -17,7 +26,7 @@ class StateManager:
             # 如果指定了小说ID，添加ID前缀到模式中
             pattern = f"{novel_id}_{pattern}"
         
-        files = glob.glob(os.path.join(self.data_path, pattern))
+        files = StateFileCache.match(self.data_path, pattern)
         if not files:
             return None
         
@@ -38,9 +47,8 @@ class StateManager:
         if not latest_file:
             return None
 
-        with open(latest_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return ChapterState(**data)
+        state = StateFileCache.get_derived(latest_file, "chapter_state", lambda data: ChapterState(**data))
+        return state.model_copy(deep=True)
 
     def save_state(self, state: ChapterState, novel_id: Optional[str] = None):
         """保存状态，支持小说ID"""
@@ -58,17 +66,39 @@ class StateManager:
         
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(state.model_dump_json(indent=2))
+        StateFileCache.invalidate(file_path)
+
+    def load_world_bible(
+        self,
+        key_words=[""] ,
+        novel_id: Optional[str] = None,
+        semantic_query: Optional[str] = None,
+        semantic_top_k: int = 10
+    ) -> Dict[str, Any]:
+        """加载世界设定，支持小说ID过滤
 
-    def load_world_bible(self,key_words=[""] ,novel_id: Optional[str] = None) -> Dict[str, Any]:
-        """加载世界设定，支持小说ID过滤"""
+        传入 semantic_query 且安装了 NumPy 时，在关键词匹配的设定之外
+        再补充语义最相近的 semantic_top_k 条设定。
+        """
         latest_file = self._find_latest_file("world_bible_*.json", novel_id)
         if not latest_file:
             return {}
 
-        with open(latest_file, 'r', encoding='utf-8') as f:
-            setting_extractor = SettingExtractor(latest_file, json.load(f))
-            world_setting = setting_extractor.get_setting(key_words)
-            return world_setting.model_dump()
+        setting_extractor = StateFileCache.get_derived(
+            latest_file, "setting_extractor", lambda data: SettingExtractor(latest_file, data)
+        )
+        world_bible = copy.deepcopy(StateFileCache.get_derived(
+            latest_file, ("world_setting", tuple(key_words)),
+            lambda data: setting_extractor.get_setting(key_words).model_dump()
+        ))
+        
+        if semantic_query and TextEmbedder.available():
+            try:
+                similar = setting_extractor.get_similar_settings(semantic_query, semantic_top_k)
+                world_bible["related_settings"] = {**world_bible.get("related_settings", {}), **similar}
+            except Exception as e:
+                print(f"语义检索世界设定失败: {e}")
+        return world_bible
 
     def load_novel_outline(self,novel_id:Optional[str] = None)-> Dict[str, Any]:
         """加载小说大纲和细纲"""
@@ -76,10 +106,10 @@ class StateManager:
         if not latest_file:
             return {}
         
-        with open(latest_file, 'r', encoding='utf-8') as f:
-            outline_manager = OutlineManager(latest_file,json.load(f))
-            novel_outline = outline_manager.get_novel_outline()
-            return novel_outline.model_dump()
+        outline_manager = self._get_outline_manager(latest_file)
+        return copy.deepcopy(StateFileCache.get_derived(
+            latest_file, "novel_outline", lambda data: outline_manager.get_novel_outline().model_dump()
+        ))
         
     def load_stage_outline(self,stage_name = "",novel_id:Optional[str] = None)-> Dict[str, Any]:
         """加载小说细纲"""
@@ -87,10 +117,14 @@ class StateManager:
         if not latest_file:
             return {}
         
-        with open(latest_file, 'r', encoding='utf-8') as f:
-            outline_manager = OutlineManager(latest_file,json.load(f))
-            stage_outline = outline_manager.get_stage_outline(stage_name)
-            return stage_outline.model_dump()
+        outline_manager = self._get_outline_manager(latest_file)
+        return copy.deepcopy(StateFileCache.get_derived(
+            latest_file, ("stage_outline", stage_name), lambda data: outline_manager.get_stage_outline(stage_name).model_dump()
+        ))
+
+    def _get_outline_manager(self, outline_file: str) -> OutlineManager:
+        """大纲文件对应的 OutlineManager（同一版本的文件只解析一次）"""
+        return StateFileCache.get_derived(outline_file, "outline_manager", lambda data: OutlineManager(outline_file, data))
 
     def save_world_bible(self, world_bible: Dict[str, Any], novel_id: Optional[str] = None, version: int = 0):
         """保存世界设定，支持小说ID"""
@@ -108,17 +142,18 @@ class StateManager:
         
         with open(file_path, 'w', encoding='utf-8') as f:
             json.dump(world_bible, f, indent=2, ensure_ascii=False)
+        StateFileCache.invalidate(file_path)
     
     def list_novel_states(self, novel_id: str) -> List[str]:
         """列出指定小说的所有状态文件"""
         pattern = f"{novel_id}_chapter_*_state.json"
-        files = glob.glob(os.path.join(self.data_path, pattern))
+        files = StateFileCache.match(self.data_path, pattern)
         return sorted(files)
     
     def list_novels(self) -> List[str]:
         """列出所有小说ID"""
         pattern = "*_chapter_*_state.json"
-        files = glob.glob(os.path.join(self.data_path, pattern))
+        files = StateFileCache.match(self.data_path, pattern)
         novel_ids = set()
         
         for file_path in files:
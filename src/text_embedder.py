@@ -0,0 +1,81 @@
+# text_embedder.py
+import os, zlib, threading
+from typing import Any, List, Optional
+from .memory_search_index import MemorySearchIndex
+
+# === 文本向量化 ===
+class TextEmbedder:
+    """文本向量化接口 - embed 返回 (n, dim) 的 float32 矩阵，每行已做L2归一化
+
+    create() 在设置了本地模型路径（参数或环境变量 EMBEDDING_MODEL_PATH）且安装了
+    sentence-transformers 时使用本地CPU模型，否则使用不依赖模型的哈希向量化。
+    两种方式都不访问网络。
+    """
+
+    name: str = "base"
+    dim: int = 0
+
+    def embed(self, texts: List[str]) -> Any:
+        raise NotImplementedError
+
+    @staticmethod
+    def available() -> bool:
+        """向量检索依赖 NumPy，未安装时不可用"""
+        try:
+            import numpy  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    @staticmethod
+    def create(model_path: Optional[str] = None) -> "TextEmbedder":
+        """创建向量化器：优先本地模型，不可用时退回哈希向量化"""
+        model_path = model_path or os.getenv("EMBEDDING_MODEL_PATH")
+        if model_path:
+            try:
+                return LocalModelEmbedder(model_path)
+            except Exception as e:
+                print(f"加载本地向量模型失败，改用哈希向量化: {e}")
+        return HashingEmbedder()
+
+
+class HashingEmbedder(TextEmbedder):
+    """哈希向量化：检索索引切出的词项（中文字二元组和英文单词）经 crc32 映射到 dim 维并带符号累加"""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]) -> Any:
+        import numpy as np
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term in MemorySearchIndex.tokenize(text or ""):
+                digest = zlib.crc32(term.encode("utf-8"))
+                matrix[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class LocalModelEmbedder(TextEmbedder):
+    """本地 sentence-transformers 模型（CPU推理）"""
+
+    _models = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_path: str):
+        with self._lock:
+            model = self._models.get(model_path)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(model_path, device="cpu")
+                self._models[model_path] = model
+        self.model = model
+        self.dim = model.get_sentence_embedding_dimension()
+        self.name = f"local-{os.path.basename(os.path.normpath(model_path))}-{self.dim}"
+
+    def embed(self, texts: List[str]) -> Any:
+        import numpy as np
+        vectors = self.model.encode(texts, batch_size=32, normalize_embeddings=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32)
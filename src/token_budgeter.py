@@ -0,0 +1,88 @@
+# token_budgeter.py
+import threading
+from typing import Dict, Any, List, Optional
+from .llm_config_manager import LLMConfigManager
+from .memory_search_index import MemorySearchIndex
+
+# === Token预算器 ===
+class TokenBudgeter:
+    """按模型统计token并给出提示词预算
+
+    OpenAI 模型在安装了 tiktoken 时使用对应的分词器，其余模型（DeepSeek、
+    Claude、Gemini 等）使用本地快速估算：中日韩字符每字约1个token，
+    其他字符约每4个字符1个token。
+    """
+
+    MESSAGE_OVERHEAD = 4
+
+    _encoders: Dict[str, Any] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_name: str = "deepseek_chat"):
+        self.model_name = model_name
+        config = LLMConfigManager.get_config(model_name)
+        self.provider = config["provider"]
+        self.model = config["model"]
+
+        budget = LLMConfigManager.get_context_budget(model_name)
+        self.context_window = budget["context_window"]
+        self.reserved_output = budget["reserved_output"]
+        self.max_prompt_tokens = self.context_window - self.reserved_output
+
+        self._encoder = self._load_encoder(self.provider, self.model)
+        self.tokenizer_name = "tiktoken" if self._encoder is not None else "estimate"
+
+    @classmethod
+    def _load_encoder(cls, provider: str, model: str) -> Optional[Any]:
+        """加载模型对应的分词器，不可用时返回None"""
+        if provider != "openai":
+            return None
+        with cls._lock:
+            if model in cls._encoders:
+                return cls._encoders[model]
+            encoder = None
+            try:
+                import tiktoken
+                encoder = tiktoken.encoding_for_model(model)
+            except (ImportError, KeyError):
+                # 未安装 tiktoken，或是兼容OpenAI接口的第三方模型（分词器不同）
+                encoder = None
+            cls._encoders[model] = encoder
+            return encoder
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        """本地快速估算token数"""
+        if not text:
+            return 0
+        cjk = sum(1 for ch in text if "\u3000" <= ch <= "\u9fff" or "\uf900" <= ch <= "\uffef")
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def count(self, text: str) -> int:
+        """统计文本的token数"""
+        if not text:
+            return 0
+        if self._encoder is not None:
+            return len(self._encoder.encode(text, disallowed_special=()))
+        return self.estimate(text)
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        """统计单条消息的token数（含角色等固定开销）"""
+        return self.count(str(message.get("content", ""))) + self.MESSAGE_OVERHEAD
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """统计消息列表的token数"""
+        return sum(self.count_message(msg) for msg in messages)
+
+    @staticmethod
+    def _terms(text: str) -> set:
+        """提取用于相关性计算的词项（与检索索引的切分一致）"""
+        return set(MemorySearchIndex.tokenize(text))
+
+    @classmethod
+    def relevance(cls, text: str, query: str) -> float:
+        """计算文本与查询的词项重合度（0~1）"""
+        query_terms = cls._terms(query)
+        if not query_terms:
+            return 0.0
+        return len(query_terms & cls._terms(text)) / len(query_terms)
@@ -0,0 +1,307 @@
+# vector_store.py
+import os, json, threading
+from typing import Dict, Any, List, Optional, Tuple
+from .file_lock import FileLock
+
+# === 向量存储 ===
+class VectorStore:
+    """基于 NumPy 的紧凑向量存储（暴力检索）
+
+    向量以 float16 逐行追加到 {path}.f16，查询时通过内存映射读取；
+    行与ID的对应关系记录在追加写入的 {path}.log.jsonl 中
+    （首行为 {"op": "meta", "dim", "embedder"}，之后为 add/delete 操作），
+    打开时重放日志恢复。同一ID重复添加时旧行标记为删除，
+    删除行占用的空间由 compact() 回收。同一路径在进程内共享一个实例（open）。
+    多个进程共用同一存储时，写操作在 {path}.lock 文件锁内先重放其他进程
+    追加的日志再分配行号；读操作前也会重放新增的日志。
+    """
+
+    search_batch_rows: int = 65536
+
+    _registry: Dict[str, "VectorStore"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path: str, dim: int, embedder: str = ""):
+        import numpy as np
+        self._np = np
+        self.path = path
+        self.dim = dim
+        self.embedder = embedder
+        self.vectors_file = path + ".f16"
+        self.log_file = path + ".log.jsonl"
+        self.lock_file = path + ".lock"
+        self._lock = threading.RLock()
+        self._ids: List[Optional[str]] = []  # 行号 -> ID，删除的行为None
+        self._rows: Dict[str, int] = {}  # ID -> 行号
+        self._extra: Dict[str, Any] = {}  # ID -> 添加时附带的信息（如内容摘要）
+        self._deleted = set()  # 已删除且未重新添加的ID
+        self._mmap = None
+        self._log_position = (None, 0)  # (日志文件inode, 已重放到的字节位置)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with FileLock(self.lock_file):
+            self._load()
+
+    @classmethod
+    def open(cls, path: str, dim: int, embedder: str = "") -> "VectorStore":
+        """获取路径对应的向量存储"""
+        key = os.path.abspath(path)
+        with cls._registry_lock:
+            store = cls._registry.get(key)
+            if store is None or store.dim != dim or store.embedder != embedder:
+                store = cls(path, dim, embedder)
+                cls._registry[key] = store
+            return store
+
+    def _load(self):
+        """重放全部操作日志；维度或向量化器不一致时重建（调用方需持有文件锁）"""
+        self._ids, self._rows, self._extra, self._deleted, self._mmap = [], {}, {}, set(), None
+        self._log_position = (None, 0)
+        meta = None
+        if os.path.exists(self.log_file):
+            with open(self.log_file, 'rb') as f:
+                first_line = f.readline()
+            try:
+                meta = json.loads(first_line) if first_line.endswith(b"\n") else None
+            except ValueError:
+                meta = None
+        if (
+            meta is None or meta.get("op") != "meta"
+            or meta["dim"] != self.dim or meta.get("embedder") != self.embedder
+        ):
+            if meta is not None:
+                print(f"向量存储 {self.path} 的维度或向量化器已变化，重新建立")
+            self._reset()
+            return
+        self._replay(locked=True)
+        self._truncate_unlogged()
+
+    def _replay(self, locked: bool = False):
+        """从上次的位置继续重放日志中其他进程追加的记录（调用方需持有 _lock）
+
+        日志被其他进程重写（compact/clear）时返回False，表示需要整体重新加载。
+        持有文件锁时不会有写到一半的记录，行号对不上的add记录（崩溃残留）直接跳过。
+        """
+        try:
+            stat = os.stat(self.log_file)
+        except FileNotFoundError:
+            return False
+        inode, position = self._log_position
+        if inode is not None and (stat.st_ino != inode or stat.st_size < position):
+            return False
+        if stat.st_size == position:
+            return True
+
+        row_bytes = self.dim * 2
+        stored_rows = os.path.getsize(self.vectors_file) // row_bytes if os.path.exists(self.vectors_file) else 0
+        with open(self.log_file, 'rb') as f:
+            f.seek(position)
+            data = f.read()
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                # 其他进程正在写入或崩溃时留下的半行
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                position += len(line)
+                continue
+            if record["op"] == "add":
+                # 向量先写、日志后写，日志中超出向量文件的行不完整
+                if record["row"] >= stored_rows or record["row"] != len(self._ids):
+                    if not locked:
+                        break
+                    position += len(line)
+                    continue
+                self._drop(record["id"])
+                self._deleted.discard(record["id"])
+                self._ids.append(record["id"])
+                self._rows[record["id"]] = record["row"]
+                self._extra[record["id"]] = record.get("extra")
+            elif record["op"] == "delete":
+                self._drop(record["id"])
+                self._deleted.add(record["id"])
+            position += len(line)
+        self._log_position = (stat.st_ino, position)
+        return True
+
+    def _truncate_unlogged(self):
+        """截掉未记入日志的向量（崩溃时留下，调用方需持有文件锁）"""
+        row_bytes = self.dim * 2
+        if os.path.exists(self.vectors_file) and os.path.getsize(self.vectors_file) > len(self._ids) * row_bytes:
+            with open(self.vectors_file, 'r+b') as f:
+                f.truncate(len(self._ids) * row_bytes)
+
+    def _sync(self, locked: bool = False):
+        """重放其他进程的新操作，需要时重新加载（调用方需持有 _lock；locked 表示已持有文件锁）"""
+        if self._replay(locked):
+            return
+        if locked:
+            self._load()
+        else:
+            with FileLock(self.lock_file):
+                self._load()
+
+    def _reset(self):
+        """清空存储并写入新的元数据（调用方需持有文件锁）"""
+        self._ids, self._rows, self._extra, self._deleted, self._mmap = [], {}, {}, set(), None
+        open(self.vectors_file, 'wb').close()
+        tmp_log = f"{self.log_file}.{os.getpid()}.tmp"
+        with open(tmp_log, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"op": "meta", "dim": self.dim, "embedder": self.embedder}) + "\n")
+        os.replace(tmp_log, self.log_file)
+        stat = os.stat(self.log_file)
+        self._log_position = (stat.st_ino, stat.st_size)
+
+    def _drop(self, item_id: str):
+        row = self._rows.pop(item_id, None)
+        if row is not None:
+            self._ids[row] = None
+            self._extra.pop(item_id, None)
+
+    def _append_log(self, records: List[Dict[str, Any]]):
+        """追加日志并把重放位置移到末尾（调用方需持有文件锁，且已重放到末尾）"""
+        with open(self.log_file, 'ab') as f:
+            f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8"))
+        stat = os.stat(self.log_file)
+        self._log_position = (stat.st_ino, stat.st_size)
+
+    def add(self, ids: List[str], vectors: Any, extras: Optional[List[Any]] = None):
+        """添加或替换向量（vectors 为 (n, dim) 矩阵）"""
+        if not ids:
+            return
+        np = self._np
+        matrix = np.asarray(vectors, dtype=np.float16).reshape(len(ids), self.dim)
+        with self._lock, FileLock(self.lock_file):
+            # 先重放其他进程追加的记录，行号才不会冲突
+            self._sync(locked=True)
+            self._truncate_unlogged()
+            first_row = len(self._ids)
+            with open(self.vectors_file, 'ab') as f:
+                f.write(matrix.tobytes())
+            records = []
+            for offset, item_id in enumerate(ids):
+                extra = extras[offset] if extras else None
+                self._drop(item_id)
+                self._deleted.discard(item_id)
+                self._ids.append(item_id)
+                self._rows[item_id] = first_row + offset
+                self._extra[item_id] = extra
+                records.append({"op": "add", "id": item_id, "row": first_row + offset, "extra": extra})
+            self._append_log(records)
+
+    def delete(self, ids: List[str]):
+        """删除向量（只做标记，空间由 compact 回收）；尚未添加的ID也记为已删除"""
+        with self._lock, FileLock(self.lock_file):
+            self._sync(locked=True)
+            ids = [item_id for item_id in ids if item_id in self._rows or item_id not in self._deleted]
+            for item_id in ids:
+                self._drop(item_id)
+                self._deleted.add(item_id)
+            if ids:
+                self._append_log([{"op": "delete", "id": item_id} for item_id in ids])
+
+    def contains(self, item_id: str) -> bool:
+        with self._lock:
+            self._sync()
+            return item_id in self._rows
+
+    def is_deleted(self, item_id: str) -> bool:
+        """ID是否被删除过（重新添加后不再算删除）"""
+        with self._lock:
+            self._sync()
+            return item_id in self._deleted
+
+    def get_extra(self, item_id: str) -> Any:
+        with self._lock:
+            self._sync()
+            return self._extra.get(item_id)
+
+    def ids(self) -> List[str]:
+        with self._lock:
+            self._sync()
+            return list(self._rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._rows)
+
+    def _matrix(self):
+        """当前全部行的只读内存映射，行数变化时重新映射（调用方需持有锁）"""
+        rows = len(self._ids)
+        if rows == 0:
+            return None
+        if self._mmap is None or self._mmap.shape[0] != rows:
+            self._mmap = self._np.memmap(self.vectors_file, dtype=self._np.float16, mode='r', shape=(rows, self.dim))
+        return self._mmap
+
+    def search(self, query_vector: Any, top_k: int = 10) -> List[Tuple[str, float]]:
+        """按余弦相似度（向量已归一化，即内积）返回 [(ID, 相似度)]"""
+        np = self._np
+        query = np.asarray(query_vector, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            self._sync()
+            matrix = self._matrix()
+            if matrix is None or not self._rows:
+                return []
+            ids = list(self._ids)
+            scores = np.empty(len(ids), dtype=np.float32)
+            for start in range(0, len(ids), self.search_batch_rows):
+                block = np.asarray(matrix[start:start + self.search_batch_rows], dtype=np.float32)
+                scores[start:start + len(block)] = block @ query
+        deleted = np.fromiter((item_id is None for item_id in ids), dtype=bool, count=len(ids))
+        scores[deleted] = -np.inf
+        top_k = min(top_k, len(ids) - int(deleted.sum()))
+        if top_k <= 0:
+            return []
+        top_rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+        return [(ids[row], float(scores[row])) for row in top_rows]
+
+    def compact(self):
+        """重写向量文件和日志，去掉已删除的行"""
+        with self._lock, FileLock(self.lock_file):
+            self._sync(locked=True)
+            matrix = self._matrix()
+            live = [(row, item_id) for row, item_id in enumerate(self._ids) if item_id is not None]
+            vectors = self._np.array(matrix[[row for row, _ in live]]) if live and matrix is not None else None
+            # 替换文件前释放内存映射
+            del matrix
+            self._mmap = None
+            tmp_vectors = f"{self.vectors_file}.{os.getpid()}.tmp"
+            tmp_log = f"{self.log_file}.{os.getpid()}.tmp"
+            with open(tmp_vectors, 'wb') as f:
+                if vectors is not None:
+                    f.write(vectors.tobytes())
+            records = [{"op": "meta", "dim": self.dim, "embedder": self.embedder}]
+            records.extend(
+                {"op": "add", "id": item_id, "row": new_row, "extra": self._extra.get(item_id)}
+                for new_row, (_, item_id) in enumerate(live)
+            )
+            # 保留删除记录，避免调用方把已删除的数据当作缺失重新添加
+            records.extend({"op": "delete", "id": item_id} for item_id in sorted(self._deleted))
+            with open(tmp_log, 'w', encoding='utf-8') as f:
+                f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            os.replace(tmp_vectors, self.vectors_file)
+            os.replace(tmp_log, self.log_file)
+            self._ids = [item_id for _, item_id in live]
+            self._rows = {item_id: row for row, item_id in enumerate(self._ids)}
+            stat = os.stat(self.log_file)
+            self._log_position = (stat.st_ino, stat.st_size)
+
+    def clear(self):
+        """删除全部向量"""
+        with self._lock, FileLock(self.lock_file):
+            self._reset()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            return {
+                "vectors": len(self._rows),
+                "deleted_rows": len(self._ids) - len(self._rows),
+                "deleted_ids": len(self._deleted),
+                "dim": self.dim,
+                "embedder": self.embedder,
+                "bytes": len(self._ids) * self.dim * 2
+            }
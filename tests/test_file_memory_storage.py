@@ -0,0 +1,52 @@
+import multiprocessing
+import threading
+
+from src.file_memory_storage import FileMemoryStorage
+from src.memory_chunk_manager import MemoryChunkManager
+
+MESSAGES_PER_WRITER = 40
+
+
+def open_storage(memory_path):
+    return FileMemoryStorage(str(memory_path), MemoryChunkManager(chunk_size=7))
+
+
+def append_messages(memory_path, writer):
+    storage = open_storage(memory_path)
+    for i in range(MESSAGES_PER_WRITER):
+        storage.append_message("s", {"role": "user", "content": f"{writer}-{i}"})
+    # 子进程退出时不执行 atexit，索引需要手动写回
+    storage.flush()
+
+
+def assert_all_messages_stored(storage, writers):
+    total = MESSAGES_PER_WRITER * len(writers)
+    messages = storage.load_messages("s", 1, total + 10)
+    assert [msg["number"] for msg in messages] == list(range(1, total + 1))
+    assert sorted(msg["content"] for msg in messages) == sorted(
+        f"{writer}-{i}" for writer in writers for i in range(MESSAGES_PER_WRITER)
+    )
+    assert storage.load_session_index("s")["total_messages"] == total
+
+
+def test_writer_processes_get_unique_numbers(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=append_messages, args=(tmp_path, writer)) for writer in ("a", "b")]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    assert_all_messages_stored(open_storage(tmp_path), ["a", "b"])
+
+
+def test_writer_threads_get_unique_numbers(tmp_path):
+    writers = ["t0", "t1", "t2", "t3"]
+    threads = [threading.Thread(target=append_messages, args=(tmp_path, writer)) for writer in writers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert_all_messages_stored(open_storage(tmp_path), writers)
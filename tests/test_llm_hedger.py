@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import pytest
+
+from src.llm_hedger import LLMHedger
+from src.llm_retry_policy import LLMRetryPolicy
+
+
+@pytest.fixture
+def fresh_policy(monkeypatch):
+    monkeypatch.setattr(LLMRetryPolicy, "_breakers", {})
+    monkeypatch.setattr(LLMRetryPolicy, "_metrics", {})
+    monkeypatch.setattr(LLMRetryPolicy, "_counters", {})
+    monkeypatch.setattr(LLMRetryPolicy, "use_fallback", False)
+    monkeypatch.setattr(LLMHedger, "default_delay", 0.05)
+    monkeypatch.setattr(LLMHedger, "min_delay", 0.05)
+    monkeypatch.setattr(LLMHedger, "get_hedge_model", classmethod(lambda cls, model_name: "hedge"))
+
+
+def open_breaker(model_name):
+    breaker = LLMRetryPolicy.get_breaker(model_name)
+    breaker.state = breaker.OPEN
+    breaker.opened_at = time.time() - breaker.recovery_timeout - 1
+    return breaker
+
+
+def test_cancelled_loser_releases_half_open_trial(fresh_policy):
+    breaker = open_breaker("primary")
+
+    async def invoke(model_name):
+        if model_name == "primary":
+            await asyncio.sleep(10)
+        return model_name
+
+    async def arun(model_name):
+        return await LLMRetryPolicy.aexecute(model_name, invoke)
+
+    async def main():
+        winner = await LLMHedger.acall("primary", arun)
+        # 半开试探被取消后，熔断器应仍能放行下一个请求
+        return winner, breaker.allow_request()
+
+    assert asyncio.run(main()) == ("hedge", True)
+    assert breaker.get_state()["state"] == breaker.HALF_OPEN
+
+
+def test_primary_success_closes_breaker(fresh_policy):
+    breaker = open_breaker("primary")
+
+    async def invoke(model_name):
+        return model_name
+
+    async def arun(model_name):
+        return await LLMRetryPolicy.aexecute(model_name, invoke)
+
+    assert asyncio.run(LLMHedger.acall("primary", arun)) == "primary"
+    assert breaker.get_state()["state"] == breaker.CLOSED
@@ -0,0 +1,55 @@
+import multiprocessing
+import os
+
+from src.memory_compression_worker import MemoryCompressionWorker
+
+
+class StubManager:
+    def __init__(self, memory_path, results=None):
+        self.memory_path = str(memory_path)
+        self.results = results or {}
+
+    def compress_chunk(self, session_id, chunk_index, model_name, compression_prompt):
+        return self.results.get(chunk_index, True)
+
+
+def enqueue_and_wait(memory_path, started, finish):
+    MemoryCompressionWorker.workers = 0
+    worker = MemoryCompressionWorker.for_manager(StubManager(memory_path))
+    for chunk_index in (1, 2):
+        worker.enqueue("child", chunk_index)
+    started.set()
+    finish.wait(30)
+
+
+def test_fallback_compression_counts_as_failed(tmp_path):
+    # 分片2压缩时LLM调用失败，只保存了降级摘要
+    worker = MemoryCompressionWorker(StubManager(tmp_path, {2: False}), str(tmp_path / "compression_queue.json"))
+    assert worker.enqueue("s", 1)
+    assert worker.enqueue("s", 2)
+    assert worker.wait_idle(10)
+
+    stats = worker.get_stats()
+    assert (stats["completed"], stats["failed"]) == (1, 1)
+
+
+def test_queue_of_exited_process_is_adopted(tmp_path, monkeypatch):
+    monkeypatch.setattr(MemoryCompressionWorker, "workers", 0)
+    context = multiprocessing.get_context("spawn")
+    started, finish = context.Event(), context.Event()
+    child = context.Process(target=enqueue_and_wait, args=(tmp_path, started, finish))
+    child.start()
+    try:
+        assert started.wait(60)
+        worker = MemoryCompressionWorker(StubManager(tmp_path), str(tmp_path / "compression_queue.json"))
+        worker.enqueue("parent", 1)
+        # 子进程仍在运行，它的队列不能被接管或覆盖
+        assert list(worker._pending) == [("parent", 1)]
+    finally:
+        finish.set()
+        child.join(60)
+    assert child.exitcode == 0
+
+    worker._load_queue()
+    assert sorted(worker._pending) == [("child", 1), ("child", 2), ("parent", 1)]
+    assert [path.name for path in tmp_path.glob("compression_queue*.json")] == [f"compression_queue.{os.getpid()}.json"]
@@ -0,0 +1,70 @@
+import multiprocessing
+
+from src.memory_index_manager import MemoryIndexManager
+
+
+def write_summaries(memory_path, chunk_indices, barrier):
+    manager = MemoryIndexManager(str(memory_path))
+    # 两个进程都先缓存到空索引，再各自写入
+    manager.load_session_index("s")
+    barrier.wait(30)
+    for chunk_index in chunk_indices:
+        manager.update_chunk_info("s", chunk_index, chunk_index * 10 - 9, chunk_index * 10, 10)
+        manager.update_summary_info("s", chunk_index, f"s_summary_{chunk_index:03d}.json")
+    # 子进程退出时不执行 atexit，索引需要手动写回
+    manager.flush()
+
+
+def test_merge_index_keeps_both_sides():
+    target = {
+        "total_messages": 15,
+        "chunks": {"1": {"start": 1, "end": 10, "count": 10}, "2": {"start": 11, "end": 15, "count": 5}},
+        "summaries": {"1": {"file": "a.json", "created_at": 2.0}},
+        "rollups": {},
+        "compacted": {},
+        "created_at": 5.0,
+        "last_updated": 6.0
+    }
+    other = {
+        "total_messages": 20,
+        "chunks": {"2": {"start": 11, "end": 20, "count": 10}},
+        "summaries": {"1": {"file": "old.json", "created_at": 1.0}, "2": {"file": "b.json", "created_at": 3.0}},
+        "rollups": {"2": {"1": {"file": "r.json", "created_at": 4.0}}},
+        "compacted": {"1": {"start": 1, "end": 10, "count": 10, "compacted_at": 7.0}},
+        "created_at": 1.0,
+        "last_updated": 8.0
+    }
+    MemoryIndexManager._merge_index(target, other)
+
+    assert target["total_messages"] == 20
+    assert target["chunks"]["2"]["end"] == 20
+    assert target["summaries"]["1"]["file"] == "a.json"
+    assert target["summaries"]["2"]["file"] == "b.json"
+    assert target["rollups"]["2"]["1"]["file"] == "r.json"
+    assert "1" in target["compacted"]
+    assert (target["created_at"], target["last_updated"]) == (1.0, 8.0)
+
+
+def test_processes_keep_each_others_summaries(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(2)
+    processes = [
+        context.Process(target=write_summaries, args=(tmp_path, chunk_indices, barrier))
+        for chunk_indices in ([1, 3, 5], [2, 4, 6])
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    index_data = MemoryIndexManager(str(tmp_path)).load_session_index("s")
+    assert sorted(index_data["summaries"], key=int) == ["1", "2", "3", "4", "5", "6"]
+    assert index_data["total_messages"] == 60
+
+
+def test_loaded_index_is_a_copy(tmp_path):
+    manager = MemoryIndexManager(str(tmp_path))
+    manager.update_summary_info("s", 1, "s_summary_001.json")
+    manager.load_session_index("s")["summaries"].clear()
+    assert "1" in manager.load_session_index("s")["summaries"]
@@ -0,0 +1,81 @@
+import multiprocessing
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from src.vector_store import VectorStore
+
+DIM = 8
+VECTORS_PER_WRITER = 30
+
+
+def unit_vector(seed):
+    vector = np.random.default_rng(seed).standard_normal(DIM)
+    return vector / np.linalg.norm(vector)
+
+
+def add_vectors(path, writer):
+    store = VectorStore(path, DIM, "test")
+    for i in range(VECTORS_PER_WRITER):
+        seed = writer * 1000 + i
+        store.add([f"id{seed}"], [unit_vector(seed)], [seed])
+
+
+def assert_rows_match(store):
+    matrix = store._matrix()
+    for item_id in store.ids():
+        stored = np.asarray(matrix[store._rows[item_id]], dtype=np.float32)
+        assert np.allclose(stored, unit_vector(store.get_extra(item_id)), atol=1e-2)
+
+
+def test_instance_replays_rows_added_by_another(tmp_path):
+    path = str(tmp_path / "vectors")
+    first = VectorStore(path, DIM, "test")
+    second = VectorStore(path, DIM, "test")
+
+    first.add(["a"], [unit_vector(1)], [1])
+    assert second.contains("a")
+    assert second.search(unit_vector(1), 1)[0][0] == "a"
+
+    # 第二个实例分配的行号不能覆盖第一个实例写入的行
+    second.add(["b"], [unit_vector(2)], [2])
+    first.add(["c"], [unit_vector(3)], [3])
+    first.delete(["a"])
+    for store in (first, second):
+        assert sorted(store.ids()) == ["b", "c"]
+        assert store.is_deleted("a")
+        assert_rows_match(store)
+
+
+def test_instance_reloads_after_compact_by_another(tmp_path):
+    path = str(tmp_path / "vectors")
+    first = VectorStore(path, DIM, "test")
+    second = VectorStore(path, DIM, "test")
+    first.add(["a", "b", "c"], [unit_vector(1), unit_vector(2), unit_vector(3)], [1, 2, 3])
+    first.delete(["b"])
+    assert len(second) == 2
+
+    first.compact()
+    second.add(["d"], [unit_vector(4)], [4])
+    for store in (first, second):
+        assert sorted(store.ids()) == ["a", "c", "d"]
+        assert store.get_stats()["deleted_rows"] == 0
+        assert_rows_match(store)
+
+
+def test_writer_processes_get_unique_rows(tmp_path):
+    path = str(tmp_path / "vectors")
+    VectorStore(path, DIM, "test")
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=add_vectors, args=(path, writer)) for writer in (1, 2, 3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    store = VectorStore(path, DIM, "test")
+    assert len(store) == 3 * VECTORS_PER_WRITER
+    assert store.get_stats()["deleted_rows"] == 0
+    assert_rows_match(store)
@@ -10,7 +10,9 @@ import json
 import time
 import logger
 import re
-from flask import Flask, request, jsonify, send_from_directory
+import queue
+import threading
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 from src.llm_caller import LLMCaller
 from src.novel_generator import NovelGenerator
@@ -137,90 +139,109 @@ def get_template_file(filename):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def parse_generate_request(data):
+    """解析生成请求参数并加载模版
+
+    返回 (generate_kwargs, template, error)，error 为 (错误响应, 状态码) 或 None
+    """
+    # 获取参数
+    template_id = data.get("template_id")
+    chapter_outline = data.get("chapter_outline")  # 改为章节细纲
+    model_name = data.get("model_name", "deepseek_chat")
+    use_memory = data.get("use_memory", False)
+    read_compressed = data.get("read_compressed", False)
+    use_compression = data.get("use_compression", False)
+    use_state = data.get("use_state", True)
+    use_world_bible = data.get("use_world_bible", True)
+    use_novel_outline = data.get("use_novel_outline",True)
+    update_state = data.get("update_state", False)
+    recent_count = data.get("recent_count", 20)
+    session_id = data.get("session_id", "default")
+    novel_id = data.get("novel_id")
+    outline_raw_key_words = data.get("outline_raw_key_words","")
+    use_cache = data.get("use_cache", False)
+    memory_mode = data.get("memory_mode", "recent")  # recent 或 relevant
+    recall_token_budget = data.get("recall_token_budget")
+    
+    #将outline_raw_key_words（str）处理成outline_key_words(list[str])
+    # 使用正则表达式将中文逗号、英文逗号、竖线、空格作为分隔符
+    outline_key_words = [
+        word.strip()
+        for word in re.split(r"[,\s，|]+", outline_raw_key_words)
+        if word.strip()
+    ]
+    print("|||| ",outline_key_words)
+    
+    if not template_id:
+        return None, None, (jsonify({"error": "缺少模版ID"}), 400)
+    
+    if not chapter_outline:
+        return None, None, (jsonify({"error": "缺少章节细纲"}), 400)
+    
+    # 加载模版
+    index_data = load_template_index()
+    if template_id not in index_data['templates']:
+        return None, None, (jsonify({"error": f"模版不存在: {template_id}"}), 404)
+    
+    template = index_data['templates'][template_id]
+    
+    # 读取模版文件内容
+    writer_role_file = os.path.join(TEMPLATES_DIR, template['files']['writer_role'])
+    writing_rules_file = os.path.join(TEMPLATES_DIR, template['files']['writing_rules'])
+    
+    writer_role = ""
+    writing_rules = ""
+    print("33333")
+    if os.path.exists(writer_role_file):
+        with open(writer_role_file, 'r', encoding='utf-8') as f:
+            writer_role = f.read()
+    print("344443")
+    if os.path.exists(writing_rules_file):
+        with open(writing_rules_file, 'r', encoding='utf-8') as f:
+            writing_rules = f.read()
+    print("3323")
+    # 构建系统提示
+    system_prompt = f"{writer_role}\n\n{writing_rules}".strip()
+    print("133")
+    generate_kwargs = dict(
+        chapter_outline=chapter_outline,  # 使用章节细纲
+        model_name=model_name,
+        system_prompt=system_prompt,
+        use_memory=use_memory,
+        session_id=session_id,
+        use_state=use_state,
+        use_world_bible=use_world_bible,
+        update_state=update_state,
+        recent_count=recent_count,
+        use_compression=use_compression,
+        read_compressed=read_compressed,
+        novel_id=novel_id,
+        use_novel_outline = use_novel_outline,
+        outline_key_words = outline_key_words,
+        use_cache = use_cache,
+        memory_mode = memory_mode,
+        recall_token_budget = recall_token_budget
+    )
+    return generate_kwargs, template, None
+
 @app.route('/api/generate', methods=['POST'])
 def generate_novel():
     """生成小说"""
     try:
         data = request.json
         
-        # 获取参数
-        template_id = data.get("template_id")
-        chapter_outline = data.get("chapter_outline")  # 改为章节细纲
-        model_name = data.get("model_name", "deepseek_chat")
-        use_memory = data.get("use_memory", False)
-        read_compressed = data.get("read_compressed", False)
-        use_compression = data.get("use_compression", False)
-        use_state = data.get("use_state", True)
-        use_world_bible = data.get("use_world_bible", True)
-        use_novel_outline = data.get("use_novel_outline",True)
-        update_state = data.get("update_state", False)
-        recent_count = data.get("recent_count", 20)
-        session_id = data.get("session_id", "default")
-        novel_id = data.get("novel_id")
-        outline_raw_key_words = data.get("outline_raw_key_words","")
-        
-        #将outline_raw_key_words（str）处理成outline_key_words(list[str])
-        # 使用正则表达式将中文逗号、英文逗号、竖线、空格作为分隔符
-        outline_key_words = [
-            word.strip()
-            for word in re.split(r"[,\s，|]+", outline_raw_key_words)
-            if word.strip()
-        ]
-        print("|||| ",outline_key_words)
-        
-        if not template_id:
-            return jsonify({"error": "缺少模版ID"}), 400
-        
-        if not chapter_outline:
-            return jsonify({"error": "缺少章节细纲"}), 400
-        
-        # 加载模版
-        index_data = load_template_index()
-        if template_id not in index_data['templates']:
-            return jsonify({"error": f"模版不存在: {template_id}"}), 404
-        
-        template = index_data['templates'][template_id]
-        
-        # 读取模版文件内容
-        writer_role_file = os.path.join(TEMPLATES_DIR, template['files']['writer_role'])
-        writing_rules_file = os.path.join(TEMPLATES_DIR, template['files']['writing_rules'])
-        
-        writer_role = ""
-        writing_rules = ""
-        print("33333")
-        if os.path.exists(writer_role_file):
-            with open(writer_role_file, 'r', encoding='utf-8') as f:
-                writer_role = f.read()
-        print("344443")
-        if os.path.exists(writing_rules_file):
-            with open(writing_rules_file, 'r', encoding='utf-8') as f:
-                writing_rules = f.read()
-        print("3323")
-        # 构建系统提示
-        system_prompt = f"{writer_role}\n\n{writing_rules}".strip()
-        print("133")
+        generate_kwargs, template, error = parse_generate_request(data)
+        if error:
+            return error
+        
         # 生成内容
-        content = generator.generate_chapter(
-            chapter_outline=chapter_outline,  # 使用章节细纲
-            model_name=model_name,
-            system_prompt=system_prompt,
-            use_memory=use_memory,
-            session_id=session_id,
-            use_state=use_state,
-            use_world_bible=use_world_bible,
-            update_state=update_state,
-            recent_count=recent_count,
-            use_compression=use_compression,
-            read_compressed=read_compressed,
-            novel_id=novel_id,
-            use_novel_outline = use_novel_outline,
-            outline_key_words = outline_key_words
-        )
+        content, token_report = generator.generate_chapter(return_token_report=True, **generate_kwargs)
         print("33")
         return jsonify({
             "content": content,
-            "template_used": template.get('name', template_id),
-            "novel_id": novel_id,
+            "token_report": token_report,
+            "template_used": template.get('name', data.get("template_id")),
+            "novel_id": generate_kwargs["novel_id"],
             "word_count": len(content),
             "generated_at": time.strftime("%Y-%m-%d %H:%M:%S")
         })
@@ -230,6 +251,54 @@ def generate_novel():
         print(f"生成错误: {e}")
         return jsonify({"error": str(e)}), 500
 
+def sse_event(payload, event=None):
+    """格式化一条Server-Sent Events消息"""
+    message = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+@app.route('/api/generate/stream', methods=['POST'])
+def generate_novel_stream():
+    """流式生成小说（Server-Sent Events）"""
+    try:
+        data = request.json
+        
+        generate_kwargs, template, error = parse_generate_request(data)
+        if error:
+            return error
+        
+        token_stream, token_report = generator.generate_chapter(
+            stream=True, return_token_report=True, **generate_kwargs
+        )
+        
+    except Exception as e:
+        print(f"生成错误: {e}")
+        return jsonify({"error": str(e)}), 500
+    
+    def event_stream():
+        word_count = 0
+        try:
+            yield sse_event(token_report, event="token_report")
+            for token in token_stream:
+                word_count += len(token)
+                yield sse_event({"token": token})
+            yield sse_event({
+                "template_used": template.get('name', data.get("template_id")),
+                "novel_id": generate_kwargs["novel_id"],
+                "word_count": word_count,
+                "generated_at": time.strftime("%Y-%m-%d %H:%M:%S")
+            }, event="done")
+        except Exception as e:
+            print(f"流式生成错误: {e}")
+            yield sse_event({"error": str(e)}, event="error")
+    
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """AI对话"""
@@ -243,6 +312,7 @@ def chat():
         model_name = data.get('model_name', 'deepseek_chat')
         use_memory = data.get('use_memory', True)
         session_id = data.get('session_id', 'web_chat')  # 接收会话ID参数
+        hedge = data.get('hedge', False)  # 是否对慢请求发出对冲副本
         
         # 调用对话功能
         response = generator.chat(
@@ -252,7 +322,8 @@ def chat():
             session_id=session_id,  # 使用传入的会话ID
             use_memory=use_memory,
             recent_count=10,
-            save_conversation=use_memory
+            save_conversation=use_memory,
+            hedge=hedge
         )
         
         return jsonify({
@@ -265,6 +336,131 @@ def chat():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/llm/stats', methods=['GET'])
+def get_llm_stats():
+    """获取LLM调用层统计信息（客户端池、并发调度、响应缓存、重试与熔断、限流、对冲、请求合并、批量调用）"""
+    try:
+        from src.llm_client_pool import LLMClientPool
+        from src.llm_scheduler import LLMScheduler
+        from src.llm_response_cache import LLMResponseCache
+        from src.llm_retry_policy import LLMRetryPolicy
+        from src.llm_rate_limiter import LLMRateLimiter
+        from src.llm_hedger import LLMHedger
+        from src.llm_single_flight import LLMSingleFlight
+        from src.llm_batch import LLMBatch
+        return jsonify({
+            "client_pool": LLMClientPool.get_stats(),
+            "scheduler": LLMScheduler.get_stats(),
+            "response_cache": LLMResponseCache.get_stats(),
+            "retry_policy": LLMRetryPolicy.get_stats(),
+            "rate_limiter": LLMRateLimiter.get_stats(),
+            "hedging": LLMHedger.get_stats(),
+            "single_flight": LLMSingleFlight.get_stats(),
+            "batch": LLMBatch.get_stats()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/memory/sessions', methods=['GET'])
+def list_memory_sessions():
+    """分页列出记忆会话"""
+    try:
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', 50, type=int)
+        sort_by = request.args.get('sort', 'last_updated')
+        descending = request.args.get('order', 'desc') != 'asc'
+        result = generator.list_memory_sessions(offset, limit, sort_by, descending)
+        return jsonify({"offset": offset, "limit": limit, **result})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"列出会话错误: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/memory/compact', methods=['POST'])
+def compact_memory():
+    """按保留策略压实记忆"""
+    data = request.json or {}
+    try:
+        report = generator.compact_memory(
+            policy=data.get("policy"),
+            session_id=data.get("session_id"),
+            dry_run=data.get("dry_run", False)
+        )
+        return jsonify(report)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"压实记忆错误: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/memory/<session_id>/compress', methods=['POST'])
+def compress_memory(session_id):
+    """批量压缩会话记忆（Server-Sent Events 推送每个分片的进度）"""
+    data = request.json or {}
+    chunk_indices = data.get("chunk_indices")  # 为空时压缩全部分片
+    model_name = data.get("model_name", "deepseek_chat")
+    max_workers = data.get("max_workers", 4)
+    force = data.get("force", False)
+    
+    events = queue.Queue()
+    
+    def run():
+        try:
+            results = generator.batch_compress_memory(
+                session_id=session_id,
+                chunk_indices=chunk_indices,
+                model_name=model_name,
+                max_workers=max_workers,
+                force=force,
+                progress_callback=lambda event: events.put(("progress", event))
+            )
+            events.put(("done", {
+                "session_id": session_id,
+                "succeeded": sum(1 for success in results.values() if success),
+                "failed": [chunk_index for chunk_index, success in results.items() if not success],
+                "total": len(results)
+            }))
+        except Exception as e:
+            print(f"批量压缩错误: {e}")
+            events.put(("error", {"error": str(e)}))
+    
+    threading.Thread(target=run, daemon=True).start()
+    
+    def event_stream():
+        while True:
+            event, payload = events.get()
+            yield sse_event(payload, event=event)
+            if event != "progress":
+                break
+    
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/api/memory/<session_id>/search', methods=['GET'])
+def search_memory(session_id):
+    """全文检索会话记忆"""
+    query = request.args.get('q', '')
+    top_k = request.args.get('top_k', 10, type=int)
+    if not query.strip():
+        return jsonify({"error": "缺少查询内容"}), 400
+    
+    try:
+        start_time = time.time()
+        results = generator.search_memory(session_id, query, top_k)
+        return jsonify({
+            "session_id": session_id,
+            "query": query,
+            "results": results,
+            "elapsed_ms": round((time.time() - start_time) * 1000, 2)
+        })
+    except Exception as e:
+        print(f"检索记忆错误: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/novels', methods=['GET'])
 def get_novels():
     """获取所有小说列表"""